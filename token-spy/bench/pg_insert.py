@@ -0,0 +1,116 @@
+"""Postgres insert throughput: per-batch setup vs prepared statements and COPY.
+
+Writes synthetic usage rows to the configured Postgres (DB_HOST, DB_NAME, ...)
+through the old write path (SET LOCAL per transaction, generic INSERTs,
+multi-row VALUES) and through db_postgres.log_usage / log_usage_batch, and
+reports rows per second for single-row and batched writes. Rows go to a
+dedicated bench agent and are deleted afterwards.
+
+    python3 bench/pg_insert.py [--rows 2000] [--batch 50]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from psycopg2.extras import execute_values  # noqa: E402
+
+import db_postgres  # noqa: E402
+import session_state  # noqa: E402
+
+AGENT = "bench-pg-insert"
+
+
+def make_entry(i: int) -> dict:
+    return {
+        "agent": AGENT,
+        "model": "claude-sonnet-4",
+        "request_body_bytes": 180_000,
+        "message_count": 40 + i % 20,
+        "conversation_history_chars": 150_000 + i,
+        "input_tokens": 1200,
+        "output_tokens": 350,
+        "cache_read_tokens": 90_000,
+        "cache_write_tokens": 300,
+        "estimated_cost_usd": 0.0421,
+        "duration_ms": 2300,
+        "stop_reason": "end_turn",
+    }
+
+
+def legacy_batch(entries: list[dict]):
+    """The write path before prepared statements and COPY."""
+    rows = [
+        db_postgres._request_row(e, db_postgres._get_or_create_agent(e["agent"]))
+        for e in entries
+    ]
+    conn = db_postgres._get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL app.current_tenant = %s", (str(db_postgres._tenant_id),))
+            execute_values(
+                cur,
+                f"INSERT INTO requests ({', '.join(db_postgres.REQUEST_COLS)}) VALUES %s",
+                rows,
+                page_size=len(rows),
+            )
+            now = time.time()
+            states = {}
+            for row, entry in zip(rows, entries):
+                agent_id = row[db_postgres.ROW_AGENT_ID]
+                if agent_id not in states:
+                    states[agent_id] = db_postgres._load_session_state(cur, agent_id, for_update=True)
+                states[agent_id] = session_state.advance(states[agent_id], row[0], entry, now)
+            for agent_id, state in states.items():
+                db_postgres._store_session_state(cur, agent_id, state)
+            conn.commit()
+    finally:
+        db_postgres._put_conn(conn)
+
+
+def run(label: str, write, rows: int, batch: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, rows, batch):
+        write([make_entry(j) for j in range(i, min(i + batch, rows))])
+    elapsed = time.perf_counter() - start
+    rate = rows / elapsed
+    print(f"  {label:<28} {rate:>10,.0f} rows/s  ({elapsed * 1000 / (rows / batch):.2f} ms/txn)")
+    return rate
+
+
+def cleanup():
+    agent_id = db_postgres._get_or_create_agent(AGENT)
+    conn = db_postgres._get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL app.current_tenant = %s", (str(db_postgres._tenant_id),))
+            cur.execute("DELETE FROM requests WHERE agent_id = %s", (agent_id,))
+            cur.execute("DELETE FROM session_state WHERE agent_id = %s", (agent_id,))
+            conn.commit()
+    finally:
+        db_postgres._put_conn(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000, help="rows written per mode")
+    parser.add_argument("--batch", type=int, default=50, help="rows per batch for batched modes")
+    args = parser.parse_args()
+
+    db_postgres.init_db()
+    print(f"{args.rows} rows per mode, batch size {args.batch}, {db_postgres.DB_HOST}/{db_postgres.DB_NAME}")
+    try:
+        old_single = run("legacy, single row", legacy_batch, args.rows, 1)
+        new_single = run("prepared, single row", db_postgres.log_usage_batch, args.rows, 1)
+        old_batch = run(f"legacy, batch of {args.batch}", legacy_batch, args.rows, args.batch)
+        new_batch = run(f"COPY, batch of {args.batch}", db_postgres.log_usage_batch, args.rows, args.batch)
+    finally:
+        cleanup()
+    print(f"speedup: single row x{new_single / old_single:.2f}, batched x{new_batch / old_batch:.2f}")
+
+
+if __name__ == "__main__":
+    main()
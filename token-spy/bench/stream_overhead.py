@@ -0,0 +1,157 @@
+"""Per-token proxy overhead of SSE usage capture: line re-parse vs byte scanner.
+
+Replays a synthetic upstream stream through the old handler logic (split into
+lines, strip, json.loads every data line) and through the incremental
+scanners used by the streaming handlers now, and reports microseconds of
+parsing work per streamed token.
+
+    python3 bench/stream_overhead.py [--tokens 4000] [--runs 20]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse_scan import AnthropicStreamScanner, OpenAIStreamScanner  # noqa: E402
+
+
+def anthropic_stream(tokens: int) -> list[bytes]:
+    def ev(name, data):
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+    chunks = [ev("message_start", {"type": "message_start", "message": {
+        "id": "msg_1", "model": "claude-sonnet-4", "usage": {
+            "input_tokens": 1200, "cache_read_input_tokens": 90000,
+            "cache_creation_input_tokens": 300, "output_tokens": 1}}})]
+    chunks.append(ev("content_block_start", {"type": "content_block_start", "index": 0,
+                                             "content_block": {"type": "text", "text": ""}}))
+    for i in range(tokens):
+        chunks.append(ev("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                 "delta": {"type": "text_delta", "text": f" word{i}"}}))
+    chunks.append(ev("content_block_stop", {"type": "content_block_stop", "index": 0}))
+    chunks.append(ev("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                       "usage": {"output_tokens": tokens}}))
+    chunks.append(ev("message_stop", {"type": "message_stop"}))
+    return chunks
+
+
+def openai_stream(tokens: int) -> list[bytes]:
+    def ev(data):
+        return f"data: {json.dumps(data)}\n\n".encode()
+    base = {"id": "chatcmpl-1", "object": "chat.completion.chunk", "model": "gpt-4o"}
+    chunks = [ev({**base, "choices": [{"index": 0, "delta": {"content": f" word{i}"},
+                                       "finish_reason": None}], "usage": None})
+              for i in range(tokens)]
+    chunks.append(ev({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": None}))
+    chunks.append(ev({**base, "choices": [], "usage": {
+        "prompt_tokens": 1200, "completion_tokens": tokens,
+        "prompt_tokens_details": {"cached_tokens": 1024}}}))
+    chunks.append(b"data: [DONE]\n\n")
+    return chunks
+
+
+def legacy_anthropic(chunks: list[bytes]) -> dict:
+    """The pre-scanner handler loop: aiter_lines + strip + json.loads per data line."""
+    usage = {"input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0,
+             "cache_write_tokens": 0, "stop_reason": None}
+    current_event = None
+    for chunk in chunks:
+        for line in chunk.decode().splitlines():
+            _ = line + "\n"
+            stripped = line.strip()
+            if stripped.startswith("event:"):
+                current_event = stripped[6:].strip()
+            elif stripped.startswith("data:") and current_event:
+                data_str = stripped[5:].strip()
+                if data_str == "[DONE]":
+                    continue
+                try:
+                    data = json.loads(data_str)
+                except json.JSONDecodeError:
+                    continue
+                if current_event == "message_start":
+                    msg_usage = data.get("message", {}).get("usage", {})
+                    usage["input_tokens"] = msg_usage.get("input_tokens", 0)
+                    usage["cache_read_tokens"] = msg_usage.get("cache_read_input_tokens", 0)
+                    usage["cache_write_tokens"] = msg_usage.get("cache_creation_input_tokens", 0)
+                elif current_event == "message_delta":
+                    delta_usage = data.get("usage", {})
+                    if delta_usage.get("output_tokens") is not None:
+                        usage["output_tokens"] = delta_usage["output_tokens"]
+                    stop = data.get("delta", {}).get("stop_reason")
+                    if stop:
+                        usage["stop_reason"] = stop
+    return usage
+
+
+def legacy_openai(chunks: list[bytes]) -> dict:
+    usage = {"input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0,
+             "cache_write_tokens": 0, "stop_reason": None}
+    for chunk in chunks:
+        for line in chunk.decode().splitlines():
+            _ = line + "\n"
+            stripped = line.strip()
+            if not stripped.startswith("data:"):
+                continue
+            data_str = stripped[5:].strip()
+            if data_str == "[DONE]":
+                continue
+            try:
+                data = json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+            chunk_usage = data.get("usage")
+            if chunk_usage:
+                usage["input_tokens"] = chunk_usage.get("prompt_tokens", 0)
+                usage["output_tokens"] = chunk_usage.get("completion_tokens", 0)
+                usage["cache_read_tokens"] = chunk_usage.get("prompt_tokens_details", {}).get("cached_tokens", 0)
+            choices = data.get("choices", [])
+            if choices and choices[0].get("finish_reason"):
+                usage["stop_reason"] = choices[0]["finish_reason"]
+    return usage
+
+
+def scan(scanner_cls, chunks: list[bytes]) -> dict:
+    scanner = scanner_cls()
+    for chunk in chunks:
+        scanner.feed(chunk)
+    assert scanner.complete
+    return scanner.usage
+
+
+def bench(fn, chunks, runs: int) -> tuple[float, dict]:
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = fn(chunks)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=4000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    cases = [
+        ("anthropic", anthropic_stream(args.tokens), legacy_anthropic,
+         lambda c: scan(AnthropicStreamScanner, c)),
+        ("openai", openai_stream(args.tokens), legacy_openai,
+         lambda c: scan(OpenAIStreamScanner, c)),
+    ]
+    print(f"{args.tokens} tokens/stream, best of {args.runs} runs")
+    for name, chunks, legacy, scanner in cases:
+        old_t, old_usage = bench(legacy, chunks, args.runs)
+        new_t, new_usage = bench(scanner, chunks, args.runs)
+        assert old_usage == new_usage, (name, old_usage, new_usage)
+        print(f"  {name:<10} legacy {old_t * 1e6 / args.tokens:6.2f} us/token   "
+              f"scanner {new_t * 1e6 / args.tokens:6.2f} us/token   "
+              f"({old_t / new_t:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
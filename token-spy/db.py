@@ -1,8 +1,13 @@
 """SQLite storage for token usage metrics."""
 
+import json
 import sqlite3
 import os
 import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import session_state
 
 DB_PATH = os.environ.get("DB_PATH", os.path.join(os.path.dirname(__file__), "data", "usage.db"))
 
@@ -13,6 +18,8 @@ def _get_conn() -> sqlite3.Connection:
     if not hasattr(_local, "conn") or _local.conn is None:
         os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
         _local.conn = sqlite3.connect(DB_PATH)
+        # Only takes effect on a new database; lets retention return freed pages to the OS
+        _local.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
         _local.conn.execute("PRAGMA journal_mode=WAL")
         _local.conn.execute("PRAGMA busy_timeout=5000")
     return _local.conn
@@ -59,157 +66,409 @@ def init_db():
             -- Derived
             estimated_cost_usd REAL DEFAULT 0,
             duration_ms INTEGER DEFAULT 0,
-            stop_reason TEXT
+            stop_reason TEXT,
+
+            -- timestamp as integer epoch milliseconds (see _init_ts_ms)
+            ts_ms INTEGER
         );
 
         CREATE INDEX IF NOT EXISTS idx_usage_timestamp ON usage(timestamp);
-        CREATE INDEX IF NOT EXISTS idx_usage_agent ON usage(agent);
+        DROP INDEX IF EXISTS idx_usage_agent;
+
+        -- Incrementally maintained current-session state (see session_state.py)
+        CREATE TABLE IF NOT EXISTS session_state (
+            agent TEXT PRIMARY KEY,
+            session_start_id INTEGER,
+            session_turns INTEGER NOT NULL DEFAULT 0,
+            session_cost REAL NOT NULL DEFAULT 0,
+            last_history_chars INTEGER NOT NULL DEFAULT 0,
+            recent TEXT NOT NULL DEFAULT '[]',
+            last_turn_at REAL NOT NULL DEFAULT 0
+        );
     """)
     conn.commit()
+    _init_ts_ms(conn)
+    _init_rollups(conn)
 
 
-def log_usage(entry: dict):
+# ── Epoch timestamps ─────────────────────────────────────────────────────────
+# ts_ms mirrors the ISO `timestamp` text as integer epoch milliseconds, so
+# range filters compare integers and the hot per-agent queries can be answered
+# from a covering index. Databases from before the column existed get it
+# added empty; backfill_ts_ms (see migrate_ts_ms.py) fills old rows in batches
+# while the proxy keeps running, and queries use the text column until then.
+
+_TS_MS_EXPR = "IFNULL(CAST(ROUND((julianday({}) - 2440587.5) * 86400000) AS INTEGER), 0)"
+
+_ts_ms_ready = False
+
+
+def _init_ts_ms(conn: sqlite3.Connection):
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(usage)")}
+    if "ts_ms" not in cols:
+        conn.execute("ALTER TABLE usage ADD COLUMN ts_ms INTEGER")
+    conn.executescript(f"""
+        CREATE INDEX IF NOT EXISTS idx_usage_ts ON usage(ts_ms);
+        -- Covers session-state rebuilds: per-agent time range plus the columns they read
+        CREATE INDEX IF NOT EXISTS idx_usage_agent_ts ON usage(
+            agent, ts_ms, conversation_history_chars, cache_read_tokens,
+            cache_write_tokens, estimated_cost_usd
+        );
+        DROP INDEX IF EXISTS idx_usage_agent_timestamp;
+
+        -- Rows inserted without ts_ms (e.g. by an older instance) get it from timestamp
+        CREATE TRIGGER IF NOT EXISTS usage_ts_ms AFTER INSERT ON usage
+        WHEN NEW.ts_ms IS NULL BEGIN
+            UPDATE usage SET ts_ms = {_TS_MS_EXPR.format("NEW.timestamp")} WHERE id = NEW.id;
+        END;
+    """)
+
+
+def ts_ms_ready() -> bool:
+    """True once every row has ts_ms (new rows always do, so this never reverts)."""
+    global _ts_ms_ready
+    if not _ts_ms_ready:
+        _ts_ms_ready = _get_conn().execute(
+            "SELECT 1 FROM usage WHERE ts_ms IS NULL LIMIT 1"
+        ).fetchone() is None
+    return _ts_ms_ready
+
+
+def backfill_ts_ms(batch_size: int = 5000) -> int:
+    """Fill ts_ms for up to `batch_size` rows that lack it. Returns rows updated."""
     conn = _get_conn()
-    cols = [
-        "agent", "model",
-        "request_body_bytes", "message_count", "user_message_count",
-        "assistant_message_count", "tool_count",
-        "system_prompt_total_chars",
-        "workspace_agents_chars", "workspace_soul_chars", "workspace_tools_chars",
-        "workspace_identity_chars", "workspace_user_chars", "workspace_heartbeat_chars",
-        "workspace_bootstrap_chars",
-        "skill_injection_chars", "base_prompt_chars",
-        "conversation_history_chars",
-        "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens",
-        "estimated_cost_usd", "duration_ms", "stop_reason",
+    n = conn.execute(
+        f"UPDATE usage SET ts_ms = {_TS_MS_EXPR.format('timestamp')} "
+        "WHERE id IN (SELECT id FROM usage WHERE ts_ms IS NULL LIMIT ?)",
+        (batch_size,),
+    ).rowcount
+    conn.commit()
+    return n
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _ms(dt: datetime) -> int:
+    """Epoch milliseconds, truncated like the ISO text (_iso) of the same instant."""
+    return (dt - _EPOCH) // timedelta(milliseconds=1)
+
+
+# ── Rollups ──────────────────────────────────────────────────────────────────
+# usage_rollup_minute / usage_rollup_hour hold per-agent sums per time bucket,
+# keyed by the bucket's timestamp prefix ('YYYY-MM-DDTHH:MM' / 'YYYY-MM-DDTHH').
+# An AFTER INSERT trigger keeps them current for every writer sharing the file.
+
+# usage columns summed per bucket (under the same names)
+_ROLLUP_SUMS = [
+    "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens",
+    "estimated_cost_usd",
+    "system_prompt_total_chars", "conversation_history_chars",
+    "skill_injection_chars", "base_prompt_chars",
+]
+# Averaged columns also count their non-NULL values (as n_<column>), like AVG()
+_ROLLUP_AVGS = [
+    "input_tokens", "system_prompt_total_chars", "conversation_history_chars",
+    "skill_injection_chars", "base_prompt_chars",
+]
+_ROLLUP_COLS = ["turns", *_ROLLUP_SUMS, *(f"n_{c}" for c in _ROLLUP_AVGS), "max_input_tokens"]
+
+# table -> length of the timestamp prefix that names its bucket
+_ROLLUP_TABLES = {"usage_rollup_minute": 16, "usage_rollup_hour": 13}
+
+
+def _rollup_values(row: str = "") -> list[str]:
+    """SQL expressions for one usage row's contribution to _ROLLUP_COLS."""
+    return [
+        "1",
+        *(f"IFNULL({row}{c}, 0)" for c in _ROLLUP_SUMS),
+        *(f"({row}{c} IS NOT NULL)" for c in _ROLLUP_AVGS),
+        f"IFNULL({row}input_tokens, 0)",
     ]
-    values = [entry.get(c) for c in cols]
-    placeholders = ", ".join(["?"] * len(cols))
-    col_names = ", ".join(cols)
-    conn.execute(f"INSERT INTO usage ({col_names}) VALUES ({placeholders})", values)
+
+
+def _iso(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _init_rollups(conn: sqlite3.Connection):
+    """Create rollup tables and their trigger, backfilling from existing rows once."""
+    cols = ", ".join(_ROLLUP_COLS)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'usage_rollup'"
+        ).fetchone()
+        if not exists:
+            body = []
+            for table, width in _ROLLUP_TABLES.items():
+                defs = ", ".join(
+                    f"{c} {'REAL' if c == 'estimated_cost_usd' else 'INTEGER'} NOT NULL DEFAULT 0"
+                    for c in _ROLLUP_COLS
+                )
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        bucket TEXT NOT NULL,
+                        agent TEXT NOT NULL,
+                        {defs},
+                        PRIMARY KEY (bucket, agent)
+                    ) WITHOUT ROWID
+                """)
+                aggs = [f"SUM({e})" for e in _rollup_values()[:-1]] + ["MAX(IFNULL(input_tokens, 0))"]
+                conn.execute(f"DELETE FROM {table}")
+                conn.execute(f"""
+                    INSERT INTO {table} (bucket, agent, {cols})
+                    SELECT substr(timestamp, 1, {width}), agent, {", ".join(aggs)}
+                    FROM usage GROUP BY 1, 2
+                """)
+                updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in _ROLLUP_COLS[:-1])
+                body.append(f"""
+                    INSERT INTO {table} (bucket, agent, {cols})
+                    VALUES (substr(NEW.timestamp, 1, {width}), NEW.agent, {", ".join(_rollup_values("NEW."))})
+                    ON CONFLICT (bucket, agent) DO UPDATE SET {updates},
+                        max_input_tokens = MAX(max_input_tokens, excluded.max_input_tokens);
+                """)
+            conn.execute(
+                f"CREATE TRIGGER usage_rollup AFTER INSERT ON usage BEGIN {''.join(body)} END"
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+_USAGE_COLS = [
+    "agent", "model",
+    "request_body_bytes", "message_count", "user_message_count",
+    "assistant_message_count", "tool_count",
+    "system_prompt_total_chars",
+    "workspace_agents_chars", "workspace_soul_chars", "workspace_tools_chars",
+    "workspace_identity_chars", "workspace_user_chars", "workspace_heartbeat_chars",
+    "workspace_bootstrap_chars",
+    "skill_injection_chars", "base_prompt_chars",
+    "conversation_history_chars",
+    "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens",
+    "estimated_cost_usd", "duration_ms", "stop_reason",
+]
+
+_INSERT_SQL = (
+    f"INSERT INTO usage (timestamp, ts_ms, {', '.join(_USAGE_COLS)}) "
+    f"VALUES (?, ?, {', '.join(['?'] * len(_USAGE_COLS))})"
+)
+
+
+def log_usage(entry: dict):
+    log_usage_batch([entry])
+
+
+def log_usage_batch(entries: list[dict]):
+    """Insert several usage rows in one transaction (one fsync per batch).
+
+    Each row keeps the entry's own `timestamp` (a UTC datetime; the flush
+    time if it has none). Session state for the affected agents is advanced
+    in the same transaction.
+    """
+    if not entries:
+        return
+    now = datetime.now(timezone.utc)
+    rows = []
+    for e in entries:
+        ts = e.get("timestamp") or now
+        rows.append([_iso(ts), _ms(ts), *(e.get(c) for c in _USAGE_COLS)])
+    conn = _get_conn()
+    conn.executemany(_INSERT_SQL, rows)
+    # The write lock is held for the whole transaction, so the AUTOINCREMENT
+    # ids of this batch are contiguous and end at last_insert_rowid().
+    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    first_id = last_id - len(entries) + 1
+    _advance_session_state(conn, entries, range(first_id, last_id + 1))
     conn.commit()
 
 
+_STATE_COLS = [
+    "session_start_id", "session_turns", "session_cost",
+    "last_history_chars", "recent", "last_turn_at",
+]
+
+
+def _load_session_state(conn, agent: str) -> dict | None:
+    row = conn.execute(
+        f"SELECT {', '.join(_STATE_COLS)} FROM session_state WHERE agent = ?", [agent]
+    ).fetchone()
+    if row is None:
+        return None
+    state = dict(zip(_STATE_COLS, tuple(row)))
+    state["recent"] = json.loads(state["recent"])
+    return state
+
+
+def _store_session_state(conn, agent: str, state: dict, replace: bool = True):
+    verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+    values = [state[c] for c in _STATE_COLS]
+    values[_STATE_COLS.index("recent")] = json.dumps(state["recent"])
+    conn.execute(
+        f"{verb} INTO session_state (agent, {', '.join(_STATE_COLS)}) "
+        f"VALUES (?, {', '.join(['?'] * len(_STATE_COLS))})",
+        [agent, *values],
+    )
+
+
+def _advance_session_state(conn, entries: list[dict], ids):
+    now = time.time()
+    states: dict[str, dict | None] = {}
+    # Agents seeded from raw rows, which already include this batch
+    seeded = set()
+    for entry, row_id in zip(entries, ids):
+        agent = entry.get("agent")
+        if agent not in states:
+            states[agent] = _load_session_state(conn, agent)
+            if not session_state.is_current(states[agent]):
+                states[agent] = _rebuild_session_state(conn, agent, store=False)
+                if states[agent] is not None:
+                    seeded.add(agent)
+        if agent not in seeded:
+            states[agent] = session_state.advance(states[agent], row_id, entry, now)
+    for agent, state in states.items():
+        _store_session_state(conn, agent, state)
+
+
+def _rebuild_session_state(conn, agent: str, store: bool = True) -> dict | None:
+    """Seed state from raw rows for an agent that has none yet (or an outdated one).
+
+    With store=False the caller writes the state itself, in its own transaction.
+    """
+    if ts_ms_ready():
+        # Index-only scan of idx_usage_agent_ts; sorting by id in SQL would
+        # tempt the planner into a full rowid-order table scan instead
+        rows = sorted(conn.execute("""
+            SELECT id, conversation_history_chars, cache_read_tokens, cache_write_tokens,
+                   estimated_cost_usd, ts_ms / 1000.0 AS ts
+            FROM usage
+            WHERE agent = ? AND ts_ms > ?
+        """, [agent, _ms(datetime.now(timezone.utc)) - 86_400_000]).fetchall(), key=lambda r: r[0])
+    else:
+        rows = conn.execute("""
+            SELECT id, conversation_history_chars, cache_read_tokens, cache_write_tokens,
+                   estimated_cost_usd, (julianday(timestamp) - 2440587.5) * 86400.0 AS ts
+            FROM usage
+            WHERE agent = ? AND timestamp > strftime('%Y-%m-%dT%H:%M:%fZ', 'now', '-24 hours')
+            ORDER BY id ASC
+        """, [agent]).fetchall()
+    keys = ["id", "conversation_history_chars", "cache_read_tokens",
+            "cache_write_tokens", "estimated_cost_usd", "ts"]
+    state = session_state.rebuild([dict(zip(keys, tuple(r))) for r in rows])
+    if state is not None and store:
+        # A concurrent writer may have created the row meanwhile — keep theirs
+        _store_session_state(conn, agent, state, replace=False)
+        conn.commit()
+    return state
+
+
 def query_usage(agent: str | None = None, hours: int = 24, limit: int = 200) -> list[dict]:
     conn = _get_conn()
     conn.row_factory = sqlite3.Row
-    sql = "SELECT * FROM usage WHERE timestamp > datetime('now', ?)"
-    params: list = [f"-{hours} hours"]
+    if ts_ms_ready():
+        sql = "SELECT * FROM usage WHERE ts_ms > ?"
+        params: list = [_ms(datetime.now(timezone.utc)) - hours * 3_600_000]
+        order = "ts_ms"
+    else:
+        # Same format as the column default, so the comparison is chronological
+        sql = "SELECT * FROM usage WHERE timestamp > strftime('%Y-%m-%dT%H:%M:%fZ', 'now', ?)"
+        params = [f"-{hours} hours"]
+        order = "timestamp"
     if agent:
         sql += " AND agent = ?"
         params.append(agent)
-    sql += " ORDER BY timestamp DESC LIMIT ?"
+    sql += f" ORDER BY {order} DESC LIMIT ?"
     params.append(limit)
     rows = conn.execute(sql, params).fetchall()
     return [dict(r) for r in rows]
 
 
 def query_summary(hours: int = 24) -> list[dict]:
+    """Per-agent totals and averages over the last `hours`.
+
+    Whole hours inside the window come from usage_rollup_hour, whole minutes
+    at either edge from usage_rollup_minute, and only rows in the window's
+    first and last (partial) minutes are read from usage itself.
+    """
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(hours=hours)
+    start_ts, now_ts = _iso(start), _iso(now)
+    sm, sh = start_ts[:16], start_ts[:13]          # first minute / hour buckets
+    nm, nh = now_ts[:16], now_ts[:13]              # current minute / hour buckets
+    sm_next_dt = start.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    sm_next = _iso(sm_next_dt)[:16]
+    sh_next = _iso(start.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1))[:13]
+    # Raw rows in the first and last partial minutes
+    if ts_ms_ready():
+        raw_col = "ts_ms"
+        raw = {"start": _ms(start), "sm_next_raw": _ms(sm_next_dt),
+               "nm_raw": _ms(now.replace(second=0, microsecond=0))}
+    else:
+        raw_col = "timestamp"
+        raw = {"start": start_ts, "sm_next_raw": sm_next, "nm_raw": nm}
+
+    rollup_cols = ", ".join(["agent", *_ROLLUP_COLS])
+    raw_cols = ", ".join(["agent", *_rollup_values()])
     conn = _get_conn()
     conn.row_factory = sqlite3.Row
-    rows = conn.execute("""
+    rows = conn.execute(f"""
         SELECT
             agent,
-            COUNT(*) as turns,
+            SUM(turns) as turns,
             SUM(input_tokens) as total_input_tokens,
             SUM(output_tokens) as total_output_tokens,
             SUM(cache_read_tokens) as total_cache_read,
             SUM(cache_write_tokens) as total_cache_write,
             SUM(estimated_cost_usd) as total_cost,
-            AVG(input_tokens) as avg_input_tokens,
-            MAX(input_tokens) as max_input_tokens,
-            AVG(system_prompt_total_chars) as avg_system_chars,
-            AVG(conversation_history_chars) as avg_history_chars,
-            AVG(skill_injection_chars) as avg_skill_chars,
-            AVG(base_prompt_chars) as avg_base_prompt_chars
-        FROM usage
-        WHERE timestamp > datetime('now', ?)
+            1.0 * SUM(input_tokens) / SUM(n_input_tokens) as avg_input_tokens,
+            MAX(max_input_tokens) as max_input_tokens,
+            1.0 * SUM(system_prompt_total_chars) / SUM(n_system_prompt_total_chars) as avg_system_chars,
+            1.0 * SUM(conversation_history_chars) / SUM(n_conversation_history_chars) as avg_history_chars,
+            1.0 * SUM(skill_injection_chars) / SUM(n_skill_injection_chars) as avg_skill_chars,
+            1.0 * SUM(base_prompt_chars) / SUM(n_base_prompt_chars) as avg_base_prompt_chars
+        FROM (
+            SELECT {rollup_cols} FROM usage_rollup_hour
+            WHERE bucket > :sh AND bucket < :nh
+            UNION ALL
+            SELECT {rollup_cols} FROM usage_rollup_minute
+            WHERE bucket > :sm AND bucket < :nm AND bucket < :sh_next
+            UNION ALL
+            SELECT {rollup_cols} FROM usage_rollup_minute
+            WHERE bucket >= :nh AND bucket < :nm AND bucket >= :sh_next
+            UNION ALL
+            SELECT {raw_cols} FROM usage
+            WHERE {raw_col} > :start AND {raw_col} < :sm_next_raw
+            UNION ALL
+            SELECT {raw_cols} FROM usage
+            WHERE {raw_col} >= :nm_raw AND {raw_col} >= :sm_next_raw
+        ) AS window
         GROUP BY agent
-    """, [f"-{hours} hours"]).fetchall()
+    """, {"sh": sh, "nh": nh, "sm": sm, "nm": nm, "sh_next": sh_next, **raw}).fetchall()
     return [dict(r) for r in rows]
 
 
 def query_session_status(agent: str, char_limit: int = 200_000) -> dict:
     """Get current session health metrics for an agent.
 
-    Detects session boundaries by looking for sudden drops in conversation_history_chars
-    (indicating a session reset). Returns metrics for the current session.
+    Session boundaries (sudden drops in conversation_history_chars) are
+    tracked incrementally on insert, so this is a single-row lookup.
     char_limit controls the threshold levels for recommendations.
     """
     conn = _get_conn()
-    conn.row_factory = sqlite3.Row
-
-    # Get all recent turns for this agent, ordered chronologically
-    rows = conn.execute("""
-        SELECT conversation_history_chars, cache_read_tokens, cache_write_tokens,
-               estimated_cost_usd, timestamp
-        FROM usage
-        WHERE agent = ? AND timestamp > datetime('now', '-24 hours')
-        ORDER BY timestamp ASC
-    """, [agent]).fetchall()
-
-    if not rows:
-        return {
-            "agent": agent,
-            "current_session_turns": 0,
-            "current_history_chars": 0,
-            "last_turn_cost": 0,
-            "avg_cost_last_5": 0,
-            "cache_write_pct_last_5": 0,
-            "cost_since_last_reset": 0,
-            "turns_since_last_reset": 0,
-            "recommendation": "no_data",
-        }
-
-    rows = [dict(r) for r in rows]
-
-    # Find last session reset: a turn where history drops by >50%
-    last_reset_idx = 0
-    for i in range(1, len(rows)):
-        prev = rows[i - 1]["conversation_history_chars"] or 0
-        curr = rows[i]["conversation_history_chars"] or 0
-        if prev > 1000 and curr < prev * 0.5:
-            last_reset_idx = i
-
-    session_rows = rows[last_reset_idx:]
-    current_history = session_rows[-1]["conversation_history_chars"] or 0
-    last_cost = session_rows[-1]["estimated_cost_usd"] or 0
-    total_cost = sum(r["estimated_cost_usd"] or 0 for r in session_rows)
-
-    # Last 5 turns for rolling averages
-    last_5 = session_rows[-5:]
-    avg_cost_5 = sum(r["estimated_cost_usd"] or 0 for r in last_5) / max(len(last_5), 1)
-    total_cache_5 = sum((r["cache_read_tokens"] or 0) + (r["cache_write_tokens"] or 0) for r in last_5)
-    total_write_5 = sum(r["cache_write_tokens"] or 0 for r in last_5)
-    cache_write_pct = total_write_5 / max(total_cache_5, 1)
-
-    # Recommendation logic (thresholds scale with configurable char_limit)
-    if current_history > char_limit * 2.5:
-        rec = "reset_recommended"
-    elif current_history > char_limit * 2:
-        rec = "compact_soon"
-    elif current_history > char_limit:
-        rec = "monitor"
-    elif cache_write_pct > 0.20 and len(last_5) >= 3:
-        rec = "cache_unstable"
-    else:
-        rec = "healthy"
-
-    return {
-        "agent": agent,
-        "current_session_turns": len(session_rows),
-        "current_history_chars": current_history,
-        "last_turn_cost": round(last_cost, 6),
-        "avg_cost_last_5": round(avg_cost_5, 6),
-        "cache_write_pct_last_5": round(cache_write_pct, 4),
-        "cost_since_last_reset": round(total_cost, 6),
-        "turns_since_last_reset": len(session_rows),
-        "recommendation": rec,
-    }
+    state = _load_session_state(conn, agent)
+    if not session_state.is_current(state):
+        state = _rebuild_session_state(conn, agent)
+    return session_state.to_status(agent, state, char_limit, time.time())
 
 
 def query_recent_events(limit: int = 100, after_id: str = None):
-    """Query recent token usage events for SSE streaming."""
+    """Query token usage events for SSE streaming, oldest first.
+
+    With after_id, returns up to `limit` rows logged after that id (for
+    tailing); otherwise the `limit` most recent rows.
+    """
     conn = _get_conn()
     conn.row_factory = sqlite3.Row
 
@@ -223,7 +482,7 @@ def query_recent_events(limit: int = 100, after_id: str = None):
                 estimated_cost_usd as cost_usd, timestamp
             FROM usage
             WHERE id > ?
-            ORDER BY timestamp DESC
+            ORDER BY id ASC
             LIMIT ?
             """,
             (after_id, limit)
@@ -237,10 +496,121 @@ def query_recent_events(limit: int = 100, after_id: str = None):
                 (input_tokens + output_tokens) as total_tokens,
                 estimated_cost_usd as cost_usd, timestamp
             FROM usage
-            ORDER BY timestamp DESC
+            ORDER BY id DESC
             LIMIT ?
             """,
             (limit,)
         ).fetchall()
+        rows = rows[::-1]
 
     return [dict(r) for r in rows]
+
+
+# ── Retention ────────────────────────────────────────────────────────────────
+# Used by retention.py. Raw rows are deleted in id-ordered batches so each
+# write transaction stays short; the hour rollup is never pruned, so totals
+# for old windows survive at hourly resolution.
+
+def fetch_usage_before(cutoff: str, limit: int) -> list[dict]:
+    """Oldest raw rows (by id) with a timestamp before `cutoff` (ISO, like the column)."""
+    conn = _get_conn()
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(
+        "SELECT * FROM usage WHERE timestamp < ? ORDER BY id LIMIT ?", (cutoff, limit)
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def count_usage_before(cutoff: str) -> int:
+    return _get_conn().execute("SELECT COUNT(*) FROM usage WHERE timestamp < ?", (cutoff,)).fetchone()[0]
+
+
+def delete_usage_range(first_id: int, last_id: int, cutoff: str) -> int:
+    """Delete rows in an id range returned by fetch_usage_before for the same cutoff."""
+    conn = _get_conn()
+    n = conn.execute(
+        "DELETE FROM usage WHERE id BETWEEN ? AND ? AND timestamp < ?", (first_id, last_id, cutoff)
+    ).rowcount
+    conn.commit()
+    return n
+
+
+def prune_minute_rollups(cutoff: str) -> int:
+    """Drop minute buckets before `cutoff`; their hour buckets remain."""
+    conn = _get_conn()
+    n = conn.execute("DELETE FROM usage_rollup_minute WHERE bucket < ?", (cutoff[:16],)).rowcount
+    conn.commit()
+    return n
+
+
+def incremental_vacuum(max_pages: int) -> int | None:
+    """Return up to `max_pages` free pages to the OS.
+
+    Returns the number of pages released, or None if the database predates
+    auto_vacuum=INCREMENTAL (freed pages are then only reused, until a full VACUUM).
+    """
+    conn = _get_conn()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # executescript steps the pragma to completion; execute() frees a single page
+    conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+# ── Cost recomputation ───────────────────────────────────────────────────────
+# Used by recost.py. Rows are read in id order as columns; changed costs are
+# written back together with the matching rollup adjustments, one short
+# transaction per chunk. The rollup trigger only fires on INSERT, so the
+# rollups are corrected here by each row's cost delta.
+
+_COST_INPUT_COLS = [
+    "id", "timestamp", "agent", "model",
+    "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens",
+    "estimated_cost_usd",
+]
+
+
+def fetch_cost_columns(after, limit: int) -> tuple[dict, int | None]:
+    """Up to `limit` rows after checkpoint `after` (an id, or None), as column lists.
+
+    Returns (columns, checkpoint of the last row) — columns is empty when done.
+    """
+    cur = _get_conn().cursor()
+    cur.row_factory = None
+    rows = cur.execute(
+        f"SELECT {', '.join(_COST_INPUT_COLS)} FROM usage WHERE id > ? ORDER BY id LIMIT ?",
+        (after or 0, limit),
+    ).fetchall()
+    if not rows:
+        return {}, after
+    return dict(zip(_COST_INPUT_COLS, map(list, zip(*rows)))), rows[-1][0]
+
+
+def update_costs(changes: list[tuple]) -> int:
+    """Apply (id, timestamp, agent, new_cost, old_cost) changes and adjust the rollups."""
+    if not changes:
+        return 0
+    conn = _get_conn()
+    deltas: dict[tuple, float] = {}
+    for _, ts, agent, new, old in changes:
+        for table, width in _ROLLUP_TABLES.items():
+            key = (table, ts[:width], agent)
+            deltas[key] = deltas.get(key, 0.0) + (new or 0) - (old or 0)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "UPDATE usage SET estimated_cost_usd = ? WHERE id = ?",
+            [(new, row_id) for row_id, _, _, new, _ in changes],
+        )
+        for table in _ROLLUP_TABLES:
+            conn.executemany(
+                f"UPDATE {table} SET estimated_cost_usd = estimated_cost_usd + ? "
+                "WHERE bucket = ? AND agent = ?",
+                [(d, bucket, agent) for (t, bucket, agent), d in deltas.items() if t == table],
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return len(changes)
@@ -4,17 +4,28 @@ Drop-in replacement for db.py (SQLite) when using PostgreSQL backend.
 Set DB_BACKEND=postgres to use this module.
 """
 
+import io
 import os
+import json
+import time
 import logging
 from decimal import Decimal
 from typing import Optional
-from uuid import UUID, uuid4
+from uuid import UUID
 from datetime import datetime, timezone
 
 import psycopg2
-from psycopg2.extras import RealDictCursor, register_uuid
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor, execute_values, register_uuid
 from psycopg2 import pool
 
+import session_state
+from db_postgres_common import (
+    INSERT_REQUEST, REQUEST_COLS, ROW_AGENT_ID, ROW_ID, SCHEMA_DDL, STATE_COLS,
+    KnownPrompts, request_row,
+)
+
 # Register UUID type adapter
 register_uuid()
 
@@ -35,6 +46,14 @@ SINGLE_TENANT_SLUG = os.environ.get("SINGLE_TENANT_SLUG", "default")
 _pool: Optional[pool.ThreadedConnectionPool] = None
 _tenant_id: Optional[UUID] = None
 _agent_cache: dict[str, UUID] = {}
+_known_prompts = KnownPrompts()
+# Cleared if the server refuses COPY into requests (e.g. row-level security)
+_copy_supported = True
+
+
+class _Connection(psycopg2.extensions.connection):
+    """Pool connection that remembers whether its session has been set up."""
+    session_ready = False
 
 
 def _get_pool() -> pool.ThreadedConnectionPool:
@@ -49,6 +68,7 @@ def _get_pool() -> pool.ThreadedConnectionPool:
             database=DB_NAME,
             user=DB_USER,
             password=DB_PASSWORD,
+            connection_factory=_Connection,
         )
     return _pool
 
@@ -92,8 +112,18 @@ def init_db():
                 )
                 _tenant_id = cur.fetchone()["id"]
                 logger.info(f"Created tenant: {SINGLE_TENANT_SLUG} ({_tenant_id})")
+
+            for ddl in SCHEMA_DDL:
+                cur.execute(ddl)
             
             conn.commit()
+
+            # Warm the agent cache so the write path never has to look agents up
+            cur.execute("SET LOCAL app.current_tenant = %s", (str(_tenant_id),))
+            cur.execute("SELECT name, id FROM agents WHERE tenant_id = %s", (_tenant_id,))
+            for row in cur.fetchall():
+                _agent_cache.setdefault(row["name"], row["id"])
+            conn.commit()
     finally:
         _put_conn(conn)
 
@@ -139,90 +169,198 @@ def _get_or_create_agent(agent_name: str) -> UUID:
         _put_conn(conn)
 
 
+# Server-side prepared statements for the write path, created once per
+# pooled connection by _setup_session
+_PREPARED = {
+    "tokenspy_insert_request": INSERT_REQUEST,
+    "tokenspy_load_state": (
+        f"SELECT {', '.join(STATE_COLS)} FROM session_state "
+        "WHERE tenant_id = $1 AND agent_id = $2 FOR UPDATE"
+    ),
+    "tokenspy_store_state": (
+        f"INSERT INTO session_state (tenant_id, agent_id, {', '.join(STATE_COLS)}) "
+        f"VALUES ($1, $2, {', '.join(f'${i + 3}' for i in range(len(STATE_COLS)))}) "
+        "ON CONFLICT (tenant_id, agent_id) DO UPDATE SET "
+        + ", ".join(f"{c} = EXCLUDED.{c}" for c in STATE_COLS)
+    ),
+}
+
+
+def _setup_session(conn):
+    """Set the tenant for the whole session and prepare write statements (once per connection)."""
+    if conn.session_ready:
+        return
+    with conn.cursor() as cur:
+        cur.execute("SELECT set_config('app.current_tenant', %s, false)", (str(_tenant_id),))
+        for name, sql in _PREPARED.items():
+            cur.execute(f"PREPARE {name} AS {sql}")
+    conn.commit()
+    conn.session_ready = True
+
+
+def _execute_prepared(cur, name: str, params) -> None:
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+
+def _copy_field(value) -> str:
+    """One value in COPY text format."""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _copy_requests(cur, rows: list[tuple]):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(map(_copy_field, row)))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY requests ({', '.join(REQUEST_COLS)}) FROM STDIN", buf)
+
+
+def _request_row(entry: dict, agent_id: UUID) -> tuple:
+    return request_row(entry, _tenant_id, agent_id)
+
+
 def log_usage(entry: dict):
     """Log a single request's usage metrics."""
+    log_usage_batch([entry])
+
+
+def log_usage_batch(entries: list[dict]):
+    """Log several requests' usage metrics in one transaction.
+
+    The tenant is set and the write statements are prepared once per pooled
+    connection, and agent ids come from a cache warmed by init_db. A single
+    row goes through the prepared INSERT; larger batches are streamed with
+    COPY (falling back to a multi-row INSERT if the server refuses COPY).
+    """
+    global _copy_supported
+    if not entries:
+        return
     if _tenant_id is None:
         init_db()
-    
-    agent_name = entry.get("agent", "unknown")
-    agent_id = _get_or_create_agent(agent_name)
-    
-    # Map SQLite entry format to PostgreSQL schema
+
+    rows = [
+        _request_row(entry, _get_or_create_agent(entry.get("agent", "unknown")))
+        for entry in entries
+    ]
+
     conn = _get_conn()
     try:
+        _setup_session(conn)
         with conn.cursor() as cur:
-            cur.execute("SET LOCAL app.current_tenant = %s", (str(_tenant_id),))
-            
-            cur.execute(
-                """
-                INSERT INTO requests (
-                    id, tenant_id, agent_id, provider, model,
-                    request_body_bytes, message_count, user_message_count,
-                    assistant_message_count, tool_count,
-                    system_prompt_total_chars,
-                    workspace_agents_chars, workspace_soul_chars, workspace_tools_chars,
-                    workspace_identity_chars, workspace_user_chars, workspace_heartbeat_chars,
-                    workspace_bootstrap_chars, workspace_memory_chars,
-                    skill_injection_chars, base_prompt_chars,
-                    conversation_history_chars,
-                    input_tokens, output_tokens, cache_read_tokens, cache_write_tokens,
-                    estimated_cost_usd, duration_ms, stop_reason
-                ) VALUES (
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s
-                )
-                """,
-                (
-                    uuid4(), _tenant_id, agent_id,
-                    _detect_provider(entry.get("model", "")),
-                    entry.get("model", "unknown"),
-                    entry.get("request_body_bytes", 0),
-                    entry.get("message_count", 0),
-                    entry.get("user_message_count", 0),
-                    entry.get("assistant_message_count", 0),
-                    entry.get("tool_count", 0),
-                    entry.get("system_prompt_total_chars", 0),
-                    entry.get("workspace_agents_chars", 0),
-                    entry.get("workspace_soul_chars", 0),
-                    entry.get("workspace_tools_chars", 0),
-                    entry.get("workspace_identity_chars", 0),
-                    entry.get("workspace_user_chars", 0),
-                    entry.get("workspace_heartbeat_chars", 0),
-                    entry.get("workspace_bootstrap_chars", 0),
-                    entry.get("workspace_memory_chars", 0),
-                    entry.get("skill_injection_chars", 0),
-                    entry.get("base_prompt_chars", 0),
-                    entry.get("conversation_history_chars", 0),
-                    entry.get("input_tokens", 0),
-                    entry.get("output_tokens", 0),
-                    entry.get("cache_read_tokens", 0),
-                    entry.get("cache_write_tokens", 0),
-                    entry.get("estimated_cost_usd", 0),
-                    entry.get("duration_ms", 0),
-                    entry.get("stop_reason"),
+            new_prompts = _store_system_prompts(cur, entries)
+            if len(rows) == 1:
+                _execute_prepared(cur, "tokenspy_insert_request", rows[0])
+            elif _copy_supported:
+                try:
+                    _copy_requests(cur, rows)
+                except (psycopg2.errors.FeatureNotSupported, psycopg2.errors.InsufficientPrivilege) as e:
+                    logger.warning(f"COPY into requests unavailable, using multi-row INSERT: {e}")
+                    _copy_supported = False
+                    conn.rollback()
+                    new_prompts = _store_system_prompts(cur, entries)
+            if len(rows) > 1 and not _copy_supported:
+                execute_values(
+                    cur,
+                    f"INSERT INTO requests ({', '.join(REQUEST_COLS)}) VALUES %s",
+                    rows,
+                    page_size=len(rows),
                 )
-            )
+            _advance_session_state(cur, rows, entries)
             conn.commit()
     finally:
         _put_conn(conn)
 
+    _known_prompts.remember(new_prompts)
 
-def _detect_provider(model: str) -> str:
-    """Detect provider from model name."""
-    model_lower = model.lower()
-    if "claude" in model_lower:
-        return "anthropic"
-    elif "kimi" in model_lower:
-        return "moonshot"
-    elif "gpt" in model_lower or "o1" in model_lower:
-        return "openai"
-    elif "gemini" in model_lower:
-        return "google"
-    elif "qwen" in model_lower:
-        return "alibaba"
-    return "unknown"
+
+def _store_system_prompts(cur, entries: list[dict]) -> list[str]:
+    """Upsert the batch's system prompts and bump their usage counts.
+
+    Prompt text is only sent for hashes this process hasn't stored yet;
+    known prompts just get a usage_count increment. Returns the hashes
+    newly sent, to be remembered once the transaction commits.
+    """
+    new, known = _known_prompts.plan(entries)
+    if new:
+        execute_values(
+            cur,
+            """
+            INSERT INTO system_prompts (prompt_hash, prompt_text, usage_count, tenant_id)
+            VALUES %s
+            ON CONFLICT (prompt_hash)
+            DO UPDATE SET usage_count = system_prompts.usage_count + EXCLUDED.usage_count
+            """,
+            [(h, text, n, str(_tenant_id)) for h, text, n in new],
+        )
+    if known:
+        execute_values(
+            cur,
+            """
+            UPDATE system_prompts AS p SET usage_count = p.usage_count + v.n
+            FROM (VALUES %s) AS v (prompt_hash, n)
+            WHERE p.prompt_hash = v.prompt_hash
+            """,
+            known,
+        )
+    return [h for h, _, _ in new]
+
+
+def _load_session_state(cur, agent_id: UUID, for_update: bool = False) -> Optional[dict]:
+    cur.execute(
+        f"SELECT {', '.join(STATE_COLS)} FROM session_state "
+        f"WHERE tenant_id = %s AND agent_id = %s" + (" FOR UPDATE" if for_update else ""),
+        (_tenant_id, agent_id),
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip(STATE_COLS, row.values() if isinstance(row, dict) else row))
+
+
+def _store_session_state(cur, agent_id: UUID, state: dict, replace: bool = True):
+    on_conflict = (
+        "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in STATE_COLS)
+        if replace else "DO NOTHING"
+    )
+    values = [state[c] for c in STATE_COLS]
+    values[STATE_COLS.index("recent")] = json.dumps(state["recent"])
+    cur.execute(
+        f"""
+        INSERT INTO session_state (tenant_id, agent_id, {', '.join(STATE_COLS)})
+        VALUES (%s, %s, {', '.join(['%s'] * len(STATE_COLS))})
+        ON CONFLICT (tenant_id, agent_id) {on_conflict}
+        """,
+        (_tenant_id, agent_id, *values),
+    )
+
+
+def _advance_session_state(cur, rows: list[tuple], entries: list[dict]):
+    """Advance per-agent session state for a just-inserted batch (same transaction)."""
+    now = time.time()
+    states: dict[UUID, Optional[dict]] = {}
+    # Agents seeded from raw rows, which already include this batch
+    seeded = set()
+    for row, entry in zip(rows, entries):
+        request_id, agent_id = row[ROW_ID], row[ROW_AGENT_ID]
+        if agent_id not in states:
+            _execute_prepared(cur, "tokenspy_load_state", (_tenant_id, agent_id))
+            found = cur.fetchone()
+            states[agent_id] = dict(zip(STATE_COLS, found)) if found else None
+            if not session_state.is_current(states[agent_id]):
+                with cur.connection.cursor(cursor_factory=RealDictCursor) as dict_cur:
+                    states[agent_id] = _rebuild_session_state(dict_cur, agent_id, store=False)
+                if states[agent_id] is not None:
+                    seeded.add(agent_id)
+        if agent_id not in seeded:
+            states[agent_id] = session_state.advance(states[agent_id], request_id, entry, now)
+    for agent_id, state in states.items():
+        values = [state[c] for c in STATE_COLS]
+        values[STATE_COLS.index("recent")] = json.dumps(state["recent"])
+        _execute_prepared(cur, "tokenspy_store_state", (_tenant_id, agent_id, *values))
 
 
 def query_usage(agent: str | None = None, hours: int = 24, limit: int = 200) -> list[dict]:
@@ -331,8 +469,8 @@ def query_summary(hours: int = 24) -> list[dict]:
 def query_session_status(agent: str, char_limit: int = 200_000) -> dict:
     """Get current session health metrics for an agent.
 
-    Detects session boundaries by looking for sudden drops in conversation_history_chars
-    (indicating a session reset). Returns metrics for the current session.
+    Session boundaries (sudden drops in conversation_history_chars) are
+    tracked incrementally on insert, so this is a single-row lookup.
     """
     if _tenant_id is None:
         init_db()
@@ -341,91 +479,63 @@ def query_session_status(agent: str, char_limit: int = 200_000) -> dict:
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SET LOCAL app.current_tenant = %s", (str(_tenant_id),))
-            
-            # Get all recent turns for this agent, ordered chronologically
+
             cur.execute(
-                """
-                SELECT 
-                    r.conversation_history_chars, 
-                    r.cache_read_tokens, 
-                    r.cache_write_tokens,
-                    r.estimated_cost_usd, 
-                    r.timestamp
-                FROM requests r
-                LEFT JOIN agents a ON r.agent_id = a.id
-                WHERE r.tenant_id = %s
-                AND a.name = %s
-                AND r.timestamp > NOW() - INTERVAL '24 hours'
-                ORDER BY r.timestamp ASC
-                """,
+                "SELECT id FROM agents WHERE tenant_id = %s AND name = %s",
                 (_tenant_id, agent)
             )
-            rows = cur.fetchall()
-
-            if not rows:
-                return {
-                    "agent": agent,
-                    "current_session_turns": 0,
-                    "current_history_chars": 0,
-                    "last_turn_cost": 0,
-                    "avg_cost_last_5": 0,
-                    "cache_write_pct_last_5": 0,
-                    "cost_since_last_reset": 0,
-                    "turns_since_last_reset": 0,
-                    "recommendation": "no_data",
-                }
-
-            rows = [dict(r) for r in rows]
-
-            # Find last session reset: a turn where history drops by >50%
-            last_reset_idx = 0
-            for i in range(1, len(rows)):
-                prev = rows[i - 1]["conversation_history_chars"] or 0
-                curr = rows[i]["conversation_history_chars"] or 0
-                if prev > 1000 and curr < prev * 0.5:
-                    last_reset_idx = i
-
-            session_rows = rows[last_reset_idx:]
-            current_history = session_rows[-1]["conversation_history_chars"] or 0
-            last_cost = float(session_rows[-1]["estimated_cost_usd"] or 0)
-            total_cost = sum(float(r["estimated_cost_usd"] or 0) for r in session_rows)
-
-            # Last 5 turns for rolling averages
-            last_5 = session_rows[-5:]
-            avg_cost_5 = sum(float(r["estimated_cost_usd"] or 0) for r in last_5) / max(len(last_5), 1)
-            total_cache_5 = sum((r["cache_read_tokens"] or 0) + (r["cache_write_tokens"] or 0) for r in last_5)
-            total_write_5 = sum(r["cache_write_tokens"] or 0 for r in last_5)
-            cache_write_pct = total_write_5 / max(total_cache_5, 1)
-
-            # Recommendation logic (thresholds scale with configurable char_limit)
-            if current_history > char_limit * 2.5:
-                rec = "reset_recommended"
-            elif current_history > char_limit * 2:
-                rec = "compact_soon"
-            elif current_history > char_limit:
-                rec = "monitor"
-            elif cache_write_pct > 0.20 and len(last_5) >= 3:
-                rec = "cache_unstable"
-            else:
-                rec = "healthy"
-
-            return {
-                "agent": agent,
-                "current_session_turns": len(session_rows),
-                "current_history_chars": current_history,
-                "last_turn_cost": round(last_cost, 6),
-                "avg_cost_last_5": round(avg_cost_5, 6),
-                "cache_write_pct_last_5": round(cache_write_pct, 4),
-                "cost_since_last_reset": round(total_cost, 6),
-                "turns_since_last_reset": len(session_rows),
-                "recommendation": rec,
-            }
+            agent_row = cur.fetchone()
+            state = None
+            if agent_row:
+                state = _load_session_state(cur, agent_row["id"])
+                if not session_state.is_current(state):
+                    state = _rebuild_session_state(cur, agent_row["id"])
+            conn.commit()
+            return session_state.to_status(agent, state, char_limit, time.time())
     finally:
         _put_conn(conn)
 
 
+def _rebuild_session_state(cur, agent_id: UUID, store: bool = True) -> Optional[dict]:
+    """Seed state from raw rows for an agent that has none yet (or an outdated one).
+
+    With store=False the caller writes the state itself, in its own transaction.
+    `cur` must return dict rows.
+    """
+    cur.execute(
+        """
+        SELECT
+            r.id,
+            r.conversation_history_chars,
+            r.cache_read_tokens,
+            r.cache_write_tokens,
+            r.estimated_cost_usd,
+            EXTRACT(EPOCH FROM r.timestamp)::float8 AS ts
+        FROM requests r
+        WHERE r.tenant_id = %s
+        AND r.agent_id = %s
+        AND r.timestamp > NOW() - INTERVAL '24 hours'
+        ORDER BY r.timestamp ASC
+        """,
+        (_tenant_id, agent_id)
+    )
+    state = session_state.rebuild([dict(r) for r in cur.fetchall()])
+    if state is not None and store:
+        # A concurrent writer may have created the row meanwhile — keep theirs
+        _store_session_state(cur, agent_id, state, replace=False)
+    return state
+
+
 def query_recent_events(limit: int = 100, after_id: Optional[UUID] = None):
-    """Query recent token usage events for SSE streaming."""
+    """Query token usage events for SSE streaming, oldest first.
+
+    With after_id, returns up to `limit` rows logged after that row, keyed on
+    (timestamp, id) since request ids are random UUIDs; otherwise the `limit`
+    most recent rows.
+    """
+    if _tenant_id is None:
+        init_db()
+
     conn = _get_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -446,8 +556,10 @@ def query_recent_events(limit: int = 100, after_id: Optional[UUID] = None):
                     FROM requests r
                     LEFT JOIN agents a ON r.agent_id = a.id
                     WHERE r.tenant_id = %s
-                    AND r.id > %s
-                    ORDER BY r.timestamp DESC
+                    AND (r.timestamp, r.id) > (
+                        SELECT timestamp, id FROM requests WHERE id = %s
+                    )
+                    ORDER BY r.timestamp ASC, r.id ASC
                     LIMIT %s
                     """,
                     (_tenant_id, after_id, limit)
@@ -469,12 +581,14 @@ def query_recent_events(limit: int = 100, after_id: Optional[UUID] = None):
                     FROM requests r
                     LEFT JOIN agents a ON r.agent_id = a.id
                     WHERE r.tenant_id = %s
-                    ORDER BY r.timestamp DESC
+                    ORDER BY r.timestamp DESC, r.id DESC
                     LIMIT %s
                     """,
                     (_tenant_id, limit)
                 )
             rows = cur.fetchall()
+            if not after_id:
+                rows = rows[::-1]
             # Convert datetime objects to ISO format strings for JSON serialization
             result = []
             for row in rows:
@@ -487,3 +601,83 @@ def query_recent_events(limit: int = 100, after_id: Optional[UUID] = None):
             return result
     finally:
         _put_conn(conn)
+
+
+# ── Cost recomputation ───────────────────────────────────────────────────────
+# Used by recost.py. Rows are read in (timestamp, id) order, since request ids
+# are random UUIDs; the checkpoint is the last row's [timestamp, id].
+
+_COST_INPUT_COLS = [
+    "id", "timestamp", "agent", "model",
+    "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens",
+    "estimated_cost_usd",
+]
+
+
+def fetch_cost_columns(after, limit: int) -> tuple[dict, Optional[list]]:
+    """Up to `limit` rows after checkpoint `after` ([timestamp, id] or None), as column lists.
+
+    Returns (columns, checkpoint of the last row) — columns is empty when done.
+    """
+    if _tenant_id is None:
+        init_db()
+
+    conn = _get_conn()
+    try:
+        _setup_session(conn)
+        with conn.cursor() as cur:
+            sql = """
+                SELECT r.id, r.timestamp, a.name, r.model,
+                       r.input_tokens, r.output_tokens, r.cache_read_tokens, r.cache_write_tokens,
+                       r.estimated_cost_usd
+                FROM requests r
+                LEFT JOIN agents a ON r.agent_id = a.id
+                WHERE r.tenant_id = %s
+            """
+            params = [_tenant_id]
+            if after:
+                sql += " AND (r.timestamp, r.id) > (%s::timestamptz, %s::uuid)"
+                params.extend(after)
+            sql += " ORDER BY r.timestamp, r.id LIMIT %s"
+            params.append(limit)
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+        conn.commit()
+    finally:
+        _put_conn(conn)
+    if not rows:
+        return {}, after
+    columns = dict(zip(_COST_INPUT_COLS, map(list, zip(*rows))))
+    columns["estimated_cost_usd"] = [None if c is None else float(c) for c in columns["estimated_cost_usd"]]
+    last = rows[-1]
+    return columns, [last[1].isoformat(), str(last[0])]
+
+
+def update_costs(changes: list[tuple]) -> int:
+    """Apply (id, timestamp, agent, new_cost, old_cost) changes in one statement."""
+    if not changes:
+        return 0
+    conn = _get_conn()
+    try:
+        _setup_session(conn)
+        with conn.cursor() as cur:
+            # execute_values takes no other parameters, so the tenant is inlined
+            tenant = cur.mogrify("%s", (_tenant_id,)).decode()
+            execute_values(
+                cur,
+                f"""
+                UPDATE requests AS r SET estimated_cost_usd = v.cost
+                FROM (VALUES %s) AS v(id, ts, cost)
+                WHERE r.id = v.id AND r.timestamp = v.ts AND r.tenant_id = {tenant}
+                """,
+                [(row_id, ts, new) for row_id, ts, _, new, _ in changes],
+                template="(%s::uuid, %s::timestamptz, %s::numeric)",
+                page_size=len(changes),
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _put_conn(conn)
+    return len(changes)
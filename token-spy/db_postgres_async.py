@@ -0,0 +1,425 @@
+"""Async PostgreSQL/TimescaleDB storage for token usage metrics (asyncpg).
+
+Same schema and function names as db_postgres.py (the driver-independent
+parts are shared in db_postgres_common.py), but every function is a
+coroutine running on the server's event loop, so handlers await the
+database instead of parking a worker thread on a psycopg2 connection.
+Set DB_BACKEND=postgres-async to use this module.
+
+Each pooled connection gets the tenant set for its whole session when it is
+opened; asyncpg caches prepared statements per connection on its own, and
+batches are written with COPY.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Optional
+from uuid import UUID
+
+import asyncpg
+
+import session_state
+from db_postgres_common import (
+    INSERT_REQUEST, REQUEST_COLS, ROW_AGENT_ID, ROW_ID, SCHEMA_DDL, STATE_COLS,
+    KnownPrompts, request_row,
+)
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings
+DB_HOST = os.environ.get("DB_HOST", "localhost")
+DB_PORT = int(os.environ.get("DB_PORT", "5434"))
+DB_NAME = os.environ.get("DB_NAME", "tokenspy")
+DB_USER = os.environ.get("DB_USER", "tokenspy")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "")
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+
+# Single-tenant mode: bypass multi-tenancy for personal deployments
+SINGLE_TENANT_SLUG = os.environ.get("SINGLE_TENANT_SLUG", "default")
+
+_pool: Optional[asyncpg.Pool] = None
+_init_lock: Optional[asyncio.Lock] = None
+_tenant_id: Optional[UUID] = None
+_agent_cache: dict[str, UUID] = {}
+_known_prompts = KnownPrompts()
+# Cleared if the server refuses COPY into requests (e.g. row-level security)
+_copy_supported = True
+
+_USAGE_SELECT = """
+    SELECT
+        r.id, r.timestamp, a.name as agent, r.model,
+        r.request_body_bytes, r.message_count, r.user_message_count,
+        r.assistant_message_count, r.tool_count,
+        r.system_prompt_total_chars,
+        r.workspace_agents_chars, r.workspace_soul_chars, r.workspace_tools_chars,
+        r.workspace_identity_chars, r.workspace_user_chars, r.workspace_heartbeat_chars,
+        r.workspace_bootstrap_chars, r.workspace_memory_chars,
+        r.skill_injection_chars, r.base_prompt_chars,
+        r.conversation_history_chars,
+        r.input_tokens, r.output_tokens, r.cache_read_tokens, r.cache_write_tokens,
+        r.estimated_cost_usd, r.duration_ms, r.stop_reason
+    FROM requests r
+    LEFT JOIN agents a ON r.agent_id = a.id
+    WHERE r.tenant_id = $1
+    AND r.timestamp > NOW() - make_interval(hours => $2)
+"""
+
+_EVENTS_SELECT = """
+    SELECT
+        r.id,
+        r.request_id as session_id,
+        r.model,
+        r.provider,
+        r.input_tokens,
+        r.output_tokens,
+        (r.input_tokens + r.output_tokens) as total_tokens,
+        r.estimated_cost_usd as cost_usd,
+        r.timestamp,
+        a.name as agent_name
+    FROM requests r
+    LEFT JOIN agents a ON r.agent_id = a.id
+    WHERE r.tenant_id = $1
+"""
+
+
+async def _setup_connection(conn: asyncpg.Connection):
+    """Per-connection session setup, run once when the pool opens a connection."""
+    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+    await conn.execute("SELECT set_config('app.current_tenant', $1, false)", str(_tenant_id))
+
+
+async def init_db():
+    """Resolve (or create) the tenant, ensure tables exist and open the pool."""
+    global _pool, _tenant_id, _init_lock
+    if _init_lock is None:
+        _init_lock = asyncio.Lock()
+    async with _init_lock:
+        if _pool is not None:
+            return
+        conn = await asyncpg.connect(
+            host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+        )
+        try:
+            tenant_id = await conn.fetchval(
+                "SELECT id FROM tenants WHERE slug = $1 AND deleted_at IS NULL",
+                SINGLE_TENANT_SLUG,
+            )
+            if tenant_id:
+                logger.info(f"Using existing tenant: {SINGLE_TENANT_SLUG} ({tenant_id})")
+            else:
+                tenant_id = await conn.fetchval(
+                    """
+                    INSERT INTO tenants (name, slug, plan)
+                    VALUES ($1, $2, 'free')
+                    RETURNING id
+                    """,
+                    SINGLE_TENANT_SLUG.replace("-", " ").title(), SINGLE_TENANT_SLUG,
+                )
+                logger.info(f"Created tenant: {SINGLE_TENANT_SLUG} ({tenant_id})")
+            _tenant_id = tenant_id
+
+            for ddl in SCHEMA_DDL:
+                await conn.execute(ddl)
+        finally:
+            await conn.close()
+
+        _pool = await asyncpg.create_pool(
+            host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+            min_size=DB_POOL_MIN, max_size=DB_POOL_MAX, init=_setup_connection,
+        )
+        # Warm the agent cache so the write path never has to look agents up
+        for row in await _pool.fetch("SELECT name, id FROM agents WHERE tenant_id = $1", _tenant_id):
+            _agent_cache.setdefault(row["name"], row["id"])
+
+
+async def close_db():
+    """Close the pool (on shutdown)."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+
+async def _get_pool() -> asyncpg.Pool:
+    if _pool is None:
+        await init_db()
+    return _pool
+
+
+async def _get_or_create_agent(agent_name: str) -> UUID:
+    """Get or create an agent by name (within the current tenant)."""
+    if agent_name in _agent_cache:
+        return _agent_cache[agent_name]
+
+    pool = await _get_pool()
+    slug = agent_name.lower().replace(" ", "-")
+    async with pool.acquire() as conn:
+        agent_id = await conn.fetchval(
+            "SELECT id FROM agents WHERE tenant_id = $1 AND slug = $2",
+            _tenant_id, slug,
+        )
+        if agent_id is None:
+            agent_id = await conn.fetchval(
+                """
+                INSERT INTO agents (tenant_id, name, slug)
+                VALUES ($1, $2, $3)
+                RETURNING id
+                """,
+                _tenant_id, agent_name, slug,
+            )
+            logger.info(f"Created agent: {agent_name} ({agent_id})")
+    _agent_cache[agent_name] = agent_id
+    return agent_id
+
+
+async def log_usage(entry: dict):
+    """Log a single request's usage metrics."""
+    await log_usage_batch([entry])
+
+
+async def log_usage_batch(entries: list[dict]):
+    """Log several requests' usage metrics in one transaction.
+
+    A single row is a plain (cached, prepared) INSERT; larger batches are
+    streamed with COPY, falling back to executemany if the server refuses.
+    """
+    global _copy_supported
+    if not entries:
+        return
+    pool = await _get_pool()
+
+    rows = [
+        request_row(entry, _tenant_id, await _get_or_create_agent(entry.get("agent", "unknown")))
+        for entry in entries
+    ]
+
+    async with pool.acquire() as conn:
+        if len(rows) > 1 and _copy_supported:
+            try:
+                async with conn.transaction():
+                    new_prompts = await _store_system_prompts(conn, entries)
+                    await conn.copy_records_to_table("requests", records=rows, columns=REQUEST_COLS)
+                    await _advance_session_state(conn, rows, entries)
+                _known_prompts.remember(new_prompts)
+                return
+            except (asyncpg.FeatureNotSupportedError, asyncpg.InsufficientPrivilegeError) as e:
+                logger.warning(f"COPY into requests unavailable, using multi-row INSERT: {e}")
+                _copy_supported = False
+        async with conn.transaction():
+            new_prompts = await _store_system_prompts(conn, entries)
+            await conn.executemany(INSERT_REQUEST, rows)
+            await _advance_session_state(conn, rows, entries)
+    _known_prompts.remember(new_prompts)
+
+
+async def _store_system_prompts(conn, entries: list[dict]) -> list[str]:
+    """Upsert the batch's system prompts and bump their usage counts.
+
+    Prompt text is only sent for hashes this process hasn't stored yet;
+    known prompts just get a usage_count increment. Returns the hashes
+    newly sent, to be remembered once the transaction commits.
+    """
+    new, known = _known_prompts.plan(entries)
+    if new:
+        await conn.executemany(
+            """
+            INSERT INTO system_prompts (prompt_hash, prompt_text, usage_count, tenant_id)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (prompt_hash)
+            DO UPDATE SET usage_count = system_prompts.usage_count + EXCLUDED.usage_count
+            """,
+            [(h, text, n, str(_tenant_id)) for h, text, n in new],
+        )
+    if known:
+        await conn.execute(
+            """
+            UPDATE system_prompts AS p SET usage_count = p.usage_count + v.n
+            FROM unnest($1::text[], $2::int[]) AS v (prompt_hash, n)
+            WHERE p.prompt_hash = v.prompt_hash
+            """,
+            [h for h, _ in known], [n for _, n in known],
+        )
+    return [h for h, _, _ in new]
+
+
+async def _load_session_state(conn, agent_id: UUID, for_update: bool = False) -> Optional[dict]:
+    row = await conn.fetchrow(
+        f"SELECT {', '.join(STATE_COLS)} FROM session_state "
+        "WHERE tenant_id = $1 AND agent_id = $2" + (" FOR UPDATE" if for_update else ""),
+        _tenant_id, agent_id,
+    )
+    return dict(row) if row is not None else None
+
+
+async def _store_session_state(conn, agent_id: UUID, state: dict, replace: bool = True):
+    on_conflict = (
+        "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in STATE_COLS)
+        if replace else "DO NOTHING"
+    )
+    await conn.execute(
+        f"""
+        INSERT INTO session_state (tenant_id, agent_id, {', '.join(STATE_COLS)})
+        VALUES ($1, $2, {', '.join(f'${i + 3}' for i in range(len(STATE_COLS)))})
+        ON CONFLICT (tenant_id, agent_id) {on_conflict}
+        """,
+        _tenant_id, agent_id, *(state[c] for c in STATE_COLS),
+    )
+
+
+async def _advance_session_state(conn, rows: list[tuple], entries: list[dict]):
+    """Advance per-agent session state for a just-inserted batch (same transaction)."""
+    now = time.time()
+    states: dict[UUID, Optional[dict]] = {}
+    # Agents seeded from raw rows, which already include this batch
+    seeded = set()
+    for row, entry in zip(rows, entries):
+        request_id, agent_id = row[ROW_ID], row[ROW_AGENT_ID]
+        if agent_id not in states:
+            states[agent_id] = await _load_session_state(conn, agent_id, for_update=True)
+            if not session_state.is_current(states[agent_id]):
+                states[agent_id] = await _rebuild_session_state(conn, agent_id, store=False)
+                if states[agent_id] is not None:
+                    seeded.add(agent_id)
+        if agent_id not in seeded:
+            states[agent_id] = session_state.advance(states[agent_id], request_id, entry, now)
+    for agent_id, state in states.items():
+        await _store_session_state(conn, agent_id, state)
+
+
+def _jsonable(row) -> dict:
+    """Record -> dict with ISO timestamps and float amounts, as db_postgres returns them."""
+    d = dict(row)
+    for k, v in d.items():
+        if isinstance(v, Decimal):
+            d[k] = float(v)
+        elif k == "timestamp" and v is not None:
+            d[k] = v.isoformat()
+    return d
+
+
+async def query_usage(agent: str | None = None, hours: int = 24, limit: int = 200) -> list[dict]:
+    """Query recent usage records."""
+    pool = await _get_pool()
+    sql = _USAGE_SELECT
+    params = [_tenant_id, hours]
+    if agent:
+        params.append(agent)
+        sql += f" AND a.name = ${len(params)}"
+    params.append(limit)
+    sql += f" ORDER BY r.timestamp DESC LIMIT ${len(params)}"
+    return [_jsonable(r) for r in await pool.fetch(sql, *params)]
+
+
+async def query_summary(hours: int = 24) -> list[dict]:
+    """Get summary metrics grouped by agent."""
+    pool = await _get_pool()
+    rows = await pool.fetch(
+        """
+        SELECT
+            a.name as agent,
+            COUNT(*) as turns,
+            SUM(r.input_tokens) as total_input_tokens,
+            SUM(r.output_tokens) as total_output_tokens,
+            SUM(r.cache_read_tokens) as total_cache_read,
+            SUM(r.cache_write_tokens) as total_cache_write,
+            SUM(r.estimated_cost_usd) as total_cost,
+            AVG(r.input_tokens) as avg_input_tokens,
+            MAX(r.input_tokens) as max_input_tokens,
+            AVG(r.system_prompt_total_chars) as avg_system_chars,
+            AVG(r.conversation_history_chars) as avg_history_chars,
+            AVG(r.skill_injection_chars) as avg_skill_chars,
+            AVG(r.base_prompt_chars) as avg_base_prompt_chars
+        FROM requests r
+        LEFT JOIN agents a ON r.agent_id = a.id
+        WHERE r.tenant_id = $1
+        AND r.timestamp > NOW() - make_interval(hours => $2)
+        GROUP BY a.name
+        """,
+        _tenant_id, hours,
+    )
+    return [_jsonable(r) for r in rows]
+
+
+async def query_session_status(agent: str, char_limit: int = 200_000) -> dict:
+    """Get current session health metrics for an agent.
+
+    Session boundaries (sudden drops in conversation_history_chars) are
+    tracked incrementally on insert, so this is a single-row lookup.
+    """
+    pool = await _get_pool()
+    async with pool.acquire() as conn:
+        agent_id = await conn.fetchval(
+            "SELECT id FROM agents WHERE tenant_id = $1 AND name = $2",
+            _tenant_id, agent,
+        )
+        state = None
+        if agent_id:
+            state = await _load_session_state(conn, agent_id)
+            if not session_state.is_current(state):
+                state = await _rebuild_session_state(conn, agent_id)
+    return session_state.to_status(agent, state, char_limit, time.time())
+
+
+async def _rebuild_session_state(conn, agent_id: UUID, store: bool = True) -> Optional[dict]:
+    """Seed state from raw rows for an agent that has none yet (or an outdated one).
+
+    With store=False the caller writes the state itself, in its own transaction.
+    """
+    rows = await conn.fetch(
+        """
+        SELECT
+            r.id,
+            r.conversation_history_chars,
+            r.cache_read_tokens,
+            r.cache_write_tokens,
+            r.estimated_cost_usd,
+            EXTRACT(EPOCH FROM r.timestamp)::float8 AS ts
+        FROM requests r
+        WHERE r.tenant_id = $1
+        AND r.agent_id = $2
+        AND r.timestamp > NOW() - INTERVAL '24 hours'
+        ORDER BY r.timestamp ASC
+        """,
+        _tenant_id, agent_id,
+    )
+    state = session_state.rebuild([dict(r) for r in rows])
+    if state is not None and store:
+        # A concurrent writer may have created the row meanwhile — keep theirs
+        await _store_session_state(conn, agent_id, state, replace=False)
+    return state
+
+
+async def query_recent_events(limit: int = 100, after_id: Optional[UUID] = None):
+    """Query token usage events for SSE streaming, oldest first.
+
+    With after_id, returns up to `limit` rows logged after that row, keyed on
+    (timestamp, id) since request ids are random UUIDs; otherwise the `limit`
+    most recent rows.
+    """
+    pool = await _get_pool()
+    if after_id:
+        rows = await pool.fetch(
+            _EVENTS_SELECT + """
+            AND (r.timestamp, r.id) > (
+                SELECT timestamp, id FROM requests WHERE id = $2
+            )
+            ORDER BY r.timestamp ASC, r.id ASC
+            LIMIT $3
+            """,
+            _tenant_id, after_id, limit,
+        )
+    else:
+        rows = await pool.fetch(
+            _EVENTS_SELECT + """
+            ORDER BY r.timestamp DESC, r.id DESC
+            LIMIT $2
+            """,
+            _tenant_id, limit,
+        )
+        rows = rows[::-1]
+    return [_jsonable(r) for r in rows]
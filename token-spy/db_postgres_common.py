@@ -0,0 +1,155 @@
+"""Driver-independent parts of the PostgreSQL backends.
+
+db_postgres (psycopg2) and db_postgres_async (asyncpg) share a schema and
+write the same rows. The column lists, the tables init_db ensures, the
+mapping from a usage entry to a `requests` row and the system-prompt
+bookkeeping live here so the two cannot drift apart; the modules only
+differ in how they talk to the driver.
+"""
+
+from datetime import datetime, timezone
+from decimal import Decimal
+from uuid import UUID, uuid4
+
+REQUEST_COLS = [
+    "id", "timestamp", "tenant_id", "agent_id", "provider", "model",
+    "request_body_bytes", "message_count", "user_message_count",
+    "assistant_message_count", "tool_count",
+    "system_prompt_total_chars",
+    "workspace_agents_chars", "workspace_soul_chars", "workspace_tools_chars",
+    "workspace_identity_chars", "workspace_user_chars", "workspace_heartbeat_chars",
+    "workspace_bootstrap_chars", "workspace_memory_chars",
+    "skill_injection_chars", "base_prompt_chars",
+    "conversation_history_chars",
+    "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens",
+    "estimated_cost_usd", "duration_ms", "stop_reason", "system_prompt_hash",
+]
+
+# Positions in a request_row() tuple
+ROW_ID = REQUEST_COLS.index("id")
+ROW_AGENT_ID = REQUEST_COLS.index("agent_id")
+
+STATE_COLS = [
+    "session_start_id", "session_turns", "session_cost",
+    "last_history_chars", "recent", "last_turn_at",
+]
+
+# Single-row insert with $n placeholders (server-side PREPARE and asyncpg)
+INSERT_REQUEST = (
+    f"INSERT INTO requests ({', '.join(REQUEST_COLS)}) "
+    f"VALUES ({', '.join(f'${i + 1}' for i in range(len(REQUEST_COLS)))})"
+)
+
+# Tables token-spy adds to the base schema, created by init_db
+SCHEMA_DDL = [
+    # Incrementally maintained current-session state (see session_state.py)
+    """
+    CREATE TABLE IF NOT EXISTS session_state (
+        tenant_id UUID NOT NULL,
+        agent_id UUID NOT NULL,
+        session_start_id UUID,
+        session_turns INTEGER NOT NULL DEFAULT 0,
+        session_cost DOUBLE PRECISION NOT NULL DEFAULT 0,
+        last_history_chars INTEGER NOT NULL DEFAULT 0,
+        recent JSONB NOT NULL DEFAULT '[]',
+        last_turn_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (tenant_id, agent_id)
+    )
+    """,
+    # Each distinct system prompt is stored once; requests reference it by hash
+    """
+    CREATE TABLE IF NOT EXISTS system_prompts (
+        prompt_hash TEXT PRIMARY KEY,
+        prompt_text TEXT NOT NULL,
+        token_count INTEGER,
+        first_seen TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        usage_count INTEGER DEFAULT 1,
+        tenant_id TEXT
+    )
+    """,
+    "ALTER TABLE requests ADD COLUMN IF NOT EXISTS system_prompt_hash TEXT",
+]
+
+
+def detect_provider(model: str) -> str:
+    """Detect provider from model name."""
+    model_lower = model.lower()
+    if "claude" in model_lower:
+        return "anthropic"
+    elif "kimi" in model_lower:
+        return "moonshot"
+    elif "gpt" in model_lower or "o1" in model_lower:
+        return "openai"
+    elif "gemini" in model_lower:
+        return "google"
+    elif "qwen" in model_lower:
+        return "alibaba"
+    return "unknown"
+
+
+def request_row(entry: dict, tenant_id: UUID, agent_id: UUID) -> tuple:
+    """Map a SQLite-format usage entry to a `requests` row tuple (REQUEST_COLS order)."""
+    return (
+        uuid4(), entry.get("timestamp") or datetime.now(timezone.utc), tenant_id, agent_id,
+        detect_provider(entry.get("model", "")),
+        entry.get("model", "unknown"),
+        entry.get("request_body_bytes", 0),
+        entry.get("message_count", 0),
+        entry.get("user_message_count", 0),
+        entry.get("assistant_message_count", 0),
+        entry.get("tool_count", 0),
+        entry.get("system_prompt_total_chars", 0),
+        entry.get("workspace_agents_chars", 0),
+        entry.get("workspace_soul_chars", 0),
+        entry.get("workspace_tools_chars", 0),
+        entry.get("workspace_identity_chars", 0),
+        entry.get("workspace_user_chars", 0),
+        entry.get("workspace_heartbeat_chars", 0),
+        entry.get("workspace_bootstrap_chars", 0),
+        entry.get("workspace_memory_chars", 0),
+        entry.get("skill_injection_chars", 0),
+        entry.get("base_prompt_chars", 0),
+        entry.get("conversation_history_chars", 0),
+        entry.get("input_tokens", 0),
+        entry.get("output_tokens", 0),
+        entry.get("cache_read_tokens", 0),
+        entry.get("cache_write_tokens", 0),
+        Decimal(str(entry.get("estimated_cost_usd", 0))),
+        entry.get("duration_ms", 0),
+        entry.get("stop_reason"),
+        entry.get("system_prompt_hash"),
+    )
+
+
+class KnownPrompts:
+    """Prompt hashes this process has already stored in system_prompts."""
+
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        self._hashes: set[str] = set()
+
+    def plan(self, entries: list[dict]) -> tuple[list[tuple], list[tuple]]:
+        """Split a batch's system prompts into what to write.
+
+        Returns ([(hash, text, count)] to upsert with their text, and
+        [(hash, count)] usage_count increments for prompts already stored).
+        Prompt text is only sent for hashes not seen yet.
+        """
+        counts: dict[str, int] = {}
+        texts: dict[str, str] = {}
+        for entry in entries:
+            prompt_hash = entry.get("system_prompt_hash")
+            if not prompt_hash:
+                continue
+            counts[prompt_hash] = counts.get(prompt_hash, 0) + 1
+            if prompt_hash not in self._hashes and entry.get("system_prompt_text") is not None:
+                texts[prompt_hash] = entry["system_prompt_text"]
+        new = [(h, text, counts[h]) for h, text in texts.items()]
+        known = [(h, n) for h, n in counts.items() if h not in texts]
+        return new, known
+
+    def remember(self, hashes: list[str]):
+        """Record hashes whose text was stored (call once the transaction commits)."""
+        if len(self._hashes) + len(hashes) > self.max_size:
+            self._hashes.clear()
+        self._hashes.update(hashes)
@@ -0,0 +1,89 @@
+"""In-process pub/sub for the /token_events SSE stream.
+
+Usage events are published once — by `_log_entry` for this instance's own
+turns, and by a single DB tailer for turns logged by other instances sharing
+the database — and fanned out to every connected dashboard.
+
+Each event gets a process-local sequence id that is sent as the SSE `id:`
+field. A ring buffer of recent events lets reconnecting clients resume from
+their `Last-Event-ID`. Every subscriber has a bounded queue; a client that
+falls behind far enough to fill it is evicted (its stream ends and the
+browser's EventSource reconnects and resumes from the ring buffer).
+
+All methods must be called from the event loop thread.
+"""
+
+import asyncio
+from collections import deque
+
+
+class Subscriber:
+    """One connected SSE client."""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.evicted = False
+
+
+class EventBroadcaster:
+    def __init__(self, ring_size: int = 500, client_queue_size: int = 256):
+        self._ring: deque = deque(maxlen=ring_size)
+        self._seq = 0
+        self._client_queue_size = client_queue_size
+        self._subscribers: set[Subscriber] = set()
+        self._stats = {"published": 0, "evicted": 0}
+
+    def publish(self, event: dict) -> int:
+        """Assign an id to `event`, buffer it and push it to all subscribers."""
+        self._seq += 1
+        item = (self._seq, event)
+        self._ring.append(item)
+        self._stats["published"] += 1
+        for sub in list(self._subscribers):
+            try:
+                sub.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self._evict(sub)
+        return self._seq
+
+    def subscribe(self, last_event_id: int | None = None, replay: int = 50) -> Subscriber:
+        """Register a client, pre-filling its queue with events it hasn't seen.
+
+        With a Last-Event-ID still covered by the ring buffer, everything after
+        it is replayed; otherwise the most recent `replay` events are sent.
+        """
+        sub = Subscriber(self._client_queue_size)
+        oldest = self._ring[0][0] if self._ring else None
+        if last_event_id is not None and oldest is not None and oldest - 1 <= last_event_id <= self._seq:
+            backlog = [item for item in self._ring if item[0] > last_event_id]
+        else:
+            backlog = list(self._ring)[-replay:] if replay > 0 else []
+        for item in backlog[-self._client_queue_size:]:
+            sub.queue.put_nowait(item)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        self._subscribers.discard(sub)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "last_event_id": self._seq,
+            "subscribers": len(self._subscribers),
+            "buffered": len(self._ring),
+        }
+
+    def _evict(self, sub: Subscriber):
+        # Drop the backlog and wake the client with a None sentinel so its
+        # stream ends; it resumes from the ring buffer on reconnect.
+        self._subscribers.discard(sub)
+        sub.evicted = True
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+        self._stats["evicted"] += 1
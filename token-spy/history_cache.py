@@ -0,0 +1,76 @@
+"""Incremental conversation history sizing.
+
+`conversation_history_chars` is the length of the compact JSON encoding of
+the `messages` array. Re-encoding the whole history on every turn duplicates
+a multi-hundred-KB string just to take its length, even though each turn
+only appends a message or two to the previous turn's history.
+
+This cache remembers the recent histories it has measured along with the
+encoded length of each message. A new request is matched against them by
+comparing messages for equality (a C-level walk that allocates nothing),
+and only the messages past the common prefix are encoded.
+
+The measured length always equals len(json.dumps(messages, separators=(",", ":"))),
+with one caveat: equal values with different encodings (1 vs 1.0 vs true) in
+the same position of a reused message would be measured with the older encoding.
+
+Must be used from a single thread (the event loop).
+"""
+
+import json
+from collections import OrderedDict
+
+
+class HistoryLengthCache:
+    def __init__(self, max_sessions: int = 16):
+        self.max_sessions = max(0, max_sessions)
+        # slot id -> (messages, prefix) where prefix[i] is the encoded length
+        # of messages[:i] excluding brackets and separators
+        self._entries: OrderedDict[int, tuple[list, list[int]]] = OrderedDict()
+        self._next_slot = 0
+        self._stats = {"requests": 0, "messages_reused": 0, "messages_encoded": 0}
+
+    def measure(self, messages: list) -> int:
+        """Length of the compact JSON encoding of `messages`."""
+        n = len(messages)
+        self._stats["requests"] += 1
+        if not self.max_sessions:
+            self._stats["messages_encoded"] += n
+            return len(json.dumps(messages, separators=(",", ":")))
+
+        slot, reused = None, 0
+        for key, (prev, _) in self._entries.items():
+            k = _common_prefix(prev, messages)
+            if k > reused:
+                slot, reused = key, k
+
+        prefix = self._entries[slot][1][:reused + 1] if slot is not None else [0]
+        total = prefix[-1]
+        for m in messages[reused:]:
+            total += len(json.dumps(m, separators=(",", ":")))
+            prefix.append(total)
+        self._stats["messages_reused"] += reused
+        self._stats["messages_encoded"] += n - reused
+
+        if slot is None:
+            slot = self._next_slot
+            self._next_slot += 1
+        self._entries[slot] = (list(messages), prefix)
+        self._entries.move_to_end(slot)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+
+        return total + (n - 1 if n else 0) + 2
+
+    def stats(self) -> dict:
+        return {**self._stats, "sessions": len(self._entries), "max_sessions": self.max_sessions}
+
+
+def _common_prefix(a: list, b: list) -> int:
+    k = 0
+    for x, y in zip(a, b):
+        # Messages reused by the request parser are the same objects
+        if x is not y and x != y:
+            break
+        k += 1
+    return k
@@ -0,0 +1,362 @@
+"""In-memory columnar store for recent usage rows.
+
+Dashboards poll /api/usage and /api/summary every few seconds, almost
+always over the last few hours, and each poll used to be a database
+query. HotStore keeps the last `hours` of rows in memory and serves
+those reads from it; writes still go to the backing store (off the request
+path, via the usage writer) and anything it can't answer is passed through.
+
+Rows are stored column by column in fixed-size ring buffers: one
+array('q') per integer column (NULL as a sentinel), array('d') for cost
+(NULL as NaN) and dictionary-encoded array('i') codes for agent, model and
+stop reason. Rows are appended in time order, so a time window is a binary
+search plus a contiguous scan. Rows older than `hours`, or beyond
+`max_rows`, are evicted oldest first.
+
+Summaries are kept as running per-agent aggregates in one-minute buckets,
+updated as rows are appended (the same split the SQLite rollup tables
+use). A summary merges the whole minutes in its window and scans only the
+rows of the partial minute at its start, so it holds the lock for a few
+thousand bucket merges rather than a pass over every row.
+
+On start the window is loaded from the backing store. After that the store
+only sees rows written by this process, so it suits deployments where one
+instance writes the database. Queries reaching back before the oldest row
+known to be complete (the load was capped by max_rows, or rows were evicted
+by count) go to the backing store. So do event queries: the /token_events
+tailer follows other instances' turns by database id, which only the
+backing store knows.
+
+Row ids are the store's own sequence numbers, not database ids. Thread-safe.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+
+from storage import Storage
+
+_NULL = -(1 << 63)
+
+_INT_COLS = [
+    "request_body_bytes", "message_count", "user_message_count",
+    "assistant_message_count", "tool_count",
+    "system_prompt_total_chars",
+    "workspace_agents_chars", "workspace_soul_chars", "workspace_tools_chars",
+    "workspace_identity_chars", "workspace_user_chars", "workspace_heartbeat_chars",
+    "workspace_bootstrap_chars", "workspace_memory_chars",
+    "skill_injection_chars", "base_prompt_chars",
+    "conversation_history_chars",
+    "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens",
+    "duration_ms",
+]
+_CODE_COLS = ["agent", "model", "stop_reason"]
+
+# Summary output key -> column, as the database backends name them
+_SUMS = {
+    "total_input_tokens": "input_tokens",
+    "total_output_tokens": "output_tokens",
+    "total_cache_read": "cache_read_tokens",
+    "total_cache_write": "cache_write_tokens",
+}
+_AVGS = {
+    "avg_input_tokens": "input_tokens",
+    "avg_system_chars": "system_prompt_total_chars",
+    "avg_history_chars": "conversation_history_chars",
+    "avg_skill_chars": "skill_injection_chars",
+    "avg_base_prompt_chars": "base_prompt_chars",
+}
+
+# Running aggregate layout: [turns, cost, max input tokens, one total per
+# _SUMS key, one total per _AVGS key, one non-NULL count per _AVGS key]
+_ACC_SUMS = 3
+_ACC_AVGS = _ACC_SUMS + len(_SUMS)
+_ACC_COUNTS = _ACC_AVGS + len(_AVGS)
+_ACC_LEN = _ACC_COUNTS + len(_AVGS)
+_BUCKET_MS = 60_000
+
+
+def _iso(ts_ms: int) -> str:
+    return datetime.fromtimestamp(ts_ms / 1000, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _parse_ms(value) -> int:
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+class HotStore(Storage):
+    def __init__(self, backing: Storage, hours: float = 24, max_rows: int = 200_000):
+        self.backing = backing
+        self.hours = hours
+        self.capacity = max(1, max_rows)
+        cap = self.capacity
+        self._ids = array("q", bytes(8 * cap))
+        self._ts = array("q", bytes(8 * cap))
+        self._ints = {c: array("q", bytes(8 * cap)) for c in _INT_COLS}
+        self._cost = array("d", bytes(8 * cap))
+        self._codes = {c: array("i", bytes(4 * cap)) for c in _CODE_COLS}
+        # Dictionary encoding shared by the code columns; code 0 is NULL
+        self._values: list = [None]
+        self._value_codes: dict = {None: 0}
+        self._start = 0       # physical index of the oldest row
+        self._count = 0
+        self._next_id = 1
+        self._complete_since = None  # ms; rows from here on are all in memory
+        # minute -> {agent code: running aggregate}, oldest minute first
+        self._buckets: dict[int, dict[int, list]] = {}
+        self._sum_cols = [self._ints[c] for c in _SUMS.values()]
+        self._avg_cols = [self._ints[c] for c in _AVGS.values()]
+        self._lock = threading.Lock()
+        self._stats = {"rows_loaded": 0, "rows_appended": 0, "rows_evicted": 0,
+                       "hits": 0, "passthrough": 0}
+
+    # ── Storage interface ────────────────────────────────────────────────────
+
+    async def init(self):
+        await self.backing.init()
+        now = self._now_ms()
+        rows = await self.backing.query_usage(hours=self.hours, limit=self.capacity)
+        rows.reverse()  # newest first -> oldest first, ties kept in insertion order
+        rows.sort(key=lambda r: _parse_ms(r["timestamp"]))
+        with self._lock:
+            self._start = self._count = 0
+            self._buckets = {}
+            for row in rows:
+                self._append(row, _parse_ms(row["timestamp"]))
+            if len(rows) >= self.capacity:
+                # Capped: older rows in the window were not loaded
+                self._complete_since = self._ts[self._start] + 1
+            else:
+                self._complete_since = now - int(self.hours * 3_600_000)
+            self._stats["rows_loaded"] = len(rows)
+
+    async def close(self):
+        await self.backing.close()
+
+    def write_batch(self, entries: list[dict]):
+        # Backing store first: a failed write must not leave phantom rows in memory
+        self.backing.write_batch(entries)
+        now = self._now_ms()
+        with self._lock:
+            for entry in entries:
+                ts = _parse_ms(entry["timestamp"]) if entry.get("timestamp") else now
+                # Appends stay in time order even if the clock steps back
+                last = self._ts[self._phys(self._count - 1)] if self._count else ts
+                self._append(entry, max(ts, last))
+            self._stats["rows_appended"] += len(entries)
+
+    async def query_usage(self, agent: str | None = None, hours: int = 24, limit: int = 200) -> list[dict]:
+        since = self._now_ms() - int(hours * 3_600_000)
+        if not self._covers(since):
+            return await self.backing.query_usage(agent=agent, hours=hours, limit=limit)
+        with self._lock:
+            code = self._value_codes.get(agent) if agent else None
+            if agent and code is None:
+                return []
+            first = self._first_after(since)
+            agents = self._codes["agent"]
+            out = []
+            for i in range(self._count - 1, first - 1, -1):
+                if len(out) >= limit:
+                    break
+                p = self._phys(i)
+                if code is None or agents[p] == code:
+                    out.append(self._row(p))
+        return out
+
+    async def query_summary(self, hours: int = 24) -> list[dict]:
+        since = self._now_ms() - int(hours * 3_600_000)
+        if not self._covers(since):
+            return await self.backing.query_summary(hours=hours)
+        # Merging a day of minute buckets is cheap but not free; keep it off the event loop
+        return await asyncio.to_thread(self._summary, since)
+
+    async def query_session_status(self, agent: str, char_limit: int = 200_000) -> dict:
+        return await self.backing.query_session_status(agent, char_limit=char_limit)
+
+    async def query_recent_events(self, limit: int = 100, after_id=None) -> list[dict]:
+        # Needs rows from every instance and database ids to resume from
+        with self._lock:
+            self._stats["passthrough"] += 1
+        return await self.backing.query_recent_events(limit=limit, after_id=after_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            oldest = self._ts[self._start] if self._count else None
+            return {
+                **self._stats,
+                "rows": self._count,
+                "capacity": self.capacity,
+                "hours": self.hours,
+                "oldest": _iso(oldest) if oldest is not None else None,
+                "complete_since": _iso(self._complete_since) if self._complete_since else None,
+                "backing": self.backing.stats(),
+            }
+
+    # ── Internals (callers hold the lock unless noted) ──────────────────────
+
+    @staticmethod
+    def _now_ms() -> int:
+        return int(time.time() * 1000)
+
+    def _phys(self, i: int) -> int:
+        return (self._start + i) % self.capacity
+
+    def _covers(self, since: int) -> bool:
+        """Whether every row at or after `since` is in memory (takes the lock)."""
+        with self._lock:
+            ok = self._complete_since is not None and since >= self._complete_since
+            self._stats["hits" if ok else "passthrough"] += 1
+        return ok
+
+    def _code(self, value) -> int:
+        code = self._value_codes.get(value)
+        if code is None:
+            code = self._value_codes[value] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def _append(self, row: dict, ts_ms: int):
+        self._evict(ts_ms - int(self.hours * 3_600_000))
+        if self._count == self.capacity:
+            # Full: the oldest row goes, and with it completeness before the next one
+            self._complete_since = max(self._complete_since or 0, self._ts[self._start] + 1)
+            self._start = (self._start + 1) % self.capacity
+            self._count -= 1
+            self._stats["rows_evicted"] += 1
+            self._drop_buckets()
+        p = self._phys(self._count)
+        self._ids[p] = self._next_id
+        self._next_id += 1
+        self._ts[p] = ts_ms
+        for c, col in self._ints.items():
+            v = row.get(c)
+            col[p] = _NULL if v is None else int(v)
+        cost = row.get("estimated_cost_usd")
+        self._cost[p] = math.nan if cost is None else float(cost)
+        for c, col in self._codes.items():
+            col[p] = self._code(row.get(c))
+        self._count += 1
+        agents = self._buckets.setdefault(ts_ms // _BUCKET_MS, {})
+        acc = agents.get(self._codes["agent"][p])
+        if acc is None:
+            acc = agents[self._codes["agent"][p]] = [0, 0.0] + [0] * (_ACC_LEN - 2)
+        self._accumulate(acc, p)
+
+    def _evict(self, cutoff_ms: int):
+        evicted = False
+        while self._count and self._ts[self._start] <= cutoff_ms:
+            self._start = (self._start + 1) % self.capacity
+            self._count -= 1
+            self._stats["rows_evicted"] += 1
+            evicted = True
+        if evicted:
+            self._drop_buckets()
+
+    def _drop_buckets(self):
+        """Drop minute buckets older than the oldest row still held.
+
+        The oldest row's own minute may have lost rows to eviction; summaries
+        never use it whole, since the rows it lost are before any window the
+        store covers.
+        """
+        oldest = self._ts[self._start] // _BUCKET_MS if self._count else None
+        while self._buckets:
+            minute = next(iter(self._buckets))
+            if oldest is not None and minute >= oldest:
+                return
+            del self._buckets[minute]
+
+    def _accumulate(self, acc: list, p: int):
+        """Add the row at physical index `p` to a running aggregate."""
+        acc[0] += 1
+        cost = self._cost[p]
+        if not math.isnan(cost):
+            acc[1] += cost
+        v = self._ints["input_tokens"][p]
+        if v > acc[2]:  # NULL (the sentinel) counts as 0, as in the rollups
+            acc[2] = v
+        for j, col in enumerate(self._sum_cols, _ACC_SUMS):
+            v = col[p]
+            if v != _NULL:
+                acc[j] += v
+        for j, col in enumerate(self._avg_cols, _ACC_AVGS):
+            v = col[p]
+            if v != _NULL:
+                acc[j] += v
+                acc[j + len(_AVGS)] += 1
+
+    def _search(self, col: array, value: int) -> int:
+        """First logical index whose `col` value is >= value."""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if col[self._phys(mid)] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _first_after(self, since: int) -> int:
+        return self._search(self._ts, since + 1)
+
+    def _row(self, p: int) -> dict:
+        row = {"id": self._ids[p], "timestamp": _iso(self._ts[p])}
+        for c, col in self._codes.items():
+            row[c] = self._values[col[p]]
+        for c, col in self._ints.items():
+            v = col[p]
+            row[c] = None if v == _NULL else v
+        cost = self._cost[p]
+        row["estimated_cost_usd"] = None if math.isnan(cost) else cost
+        return row
+
+    def _summary(self, since: int) -> list[dict]:
+        """Per-agent totals and averages, as the database backends compute them (takes the lock)."""
+        # Rows before the first whole minute are scanned; minutes from it on are merged
+        edge = (since // _BUCKET_MS + 1) * _BUCKET_MS
+        groups: dict[int, list] = {}
+
+        def group(code: int) -> list:
+            acc = groups.get(code)
+            if acc is None:
+                acc = groups[code] = [0, 0.0] + [0] * (_ACC_LEN - 2)
+            return acc
+
+        with self._lock:
+            agents = self._codes["agent"]
+            for i in range(self._first_after(since), self._count):
+                p = self._phys(i)
+                if self._ts[p] >= edge:
+                    break
+                self._accumulate(group(agents[p]), p)
+            for minute, bucket in self._buckets.items():
+                if minute * _BUCKET_MS < edge:
+                    continue
+                for code, acc in bucket.items():
+                    g = group(code)
+                    g[0] += acc[0]
+                    g[1] += acc[1]
+                    g[2] = max(g[2], acc[2])
+                    for j in range(_ACC_SUMS, _ACC_LEN):
+                        g[j] += acc[j]
+            values = self._values  # append-only, so codes stay valid after the lock
+        out = []
+        for code, g in groups.items():
+            row = {"agent": values[code], "turns": g[0]}
+            row.update(zip(_SUMS, g[_ACC_SUMS:_ACC_AVGS]))
+            row["total_cost"] = g[1]
+            row["max_input_tokens"] = g[2]
+            for key, total, n in zip(_AVGS, g[_ACC_AVGS:_ACC_COUNTS], g[_ACC_COUNTS:]):
+                row[key] = total / n if n else None
+            out.append(row)
+        return out
@@ -0,0 +1,63 @@
+"""Bounded capture of a streamed JSON response body, for usage extraction.
+
+Non-streaming responses are forwarded chunk by chunk instead of being
+buffered whole, so the proxy no longer holds the full body to read `usage`
+from it. JsonTail keeps the body in memory only while it is under `limit`
+bytes (then parse() is an ordinary json.loads); past that it keeps just
+the last `limit` bytes. Both APIs put `usage` (and, before it, the stop
+reason) at the end of the object, so the top-level fields needed for
+logging are recovered from the tail.
+"""
+
+import json
+import re
+
+_DECODER = json.JSONDecoder()
+_USAGE = re.compile(rb'"usage"\s*:\s*\{')
+_STRING_FIELD = rb'"%s"\s*:\s*("(?:[^"\\]|\\.)*"|null)'
+
+
+class JsonTail:
+    def __init__(self, limit: int = 65536):
+        self.limit = limit
+        self.size = 0
+        self._buf = bytearray()
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        self._buf += chunk
+        if self.size > self.limit and len(self._buf) > 2 * self.limit:
+            # Trim in large steps so long bodies aren't copied on every chunk
+            del self._buf[:-self.limit]
+
+    @property
+    def truncated(self) -> bool:
+        return self.size > self.limit
+
+    def parse(self, fields: tuple[str, ...] = ()) -> dict:
+        """The body as a dict; for truncated bodies, just `usage` plus the named string fields."""
+        if not self.truncated:
+            try:
+                data = json.loads(self._buf)
+            except ValueError:
+                return {}
+            return data if isinstance(data, dict) else {}
+        tail = bytes(self._buf[-self.limit:])
+        data = {}
+        # The last "usage" object in the tail belongs to the top level
+        matches = list(_USAGE.finditer(tail))
+        if matches:
+            start = matches[-1].end() - 1
+            try:
+                usage, _ = _DECODER.raw_decode(tail[start:].decode("utf-8", errors="replace"))
+                data["usage"] = usage
+            except ValueError:
+                pass
+        for name in fields:
+            found = re.findall(_STRING_FIELD % re.escape(name.encode()), tail)
+            if found:
+                try:
+                    data[name] = json.loads(found[-1])
+                except ValueError:
+                    pass
+        return data
@@ -8,25 +8,39 @@ Supports Anthropic, Moonshot, OpenAI, and generic OpenAI-compatible APIs.
 """
 
 import asyncio
+import copy
+import functools
 import json
 import logging
 import os
-import re
 import time
+from datetime import datetime, timezone
 
 import httpx
-from fastapi import FastAPI, Request, Response
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 
-# Database backend selection: sqlite (default) or postgres
+# Database backend selection: sqlite (default), postgres or postgres-async
 DB_BACKEND = os.environ.get("DB_BACKEND", "sqlite").lower()
 
-if DB_BACKEND == "postgres":
-    from db_postgres import init_db, log_usage, query_session_status, query_summary, query_usage, query_recent_events
-else:
-    from db import init_db, log_usage, query_session_status, query_summary, query_usage, query_recent_events
-
-from providers import ProviderRegistry, AnthropicProvider, OpenAICompatibleProvider
+from providers import ProviderRegistry, AnthropicProvider, OpenAICompatibleProvider, LLMProvider
+from providers.pricing import catalog as pricing_catalog, provider_for_model
+from providers.system_prompt import analyze_system_text
+from prompt_cache import PromptCache
+from history_cache import HistoryLengthCache
+from request_parse import RequestParser
+from session_index import SessionIndex
+from turn_index import TurnIndex
+from remote_transport import RemoteError, RemoteTransport
+from poll_scheduler import PollScheduler
+from settings_store import SettingsStore
+from usage_writer import UsageWriter
+from storage import BackendStorage, Storage
+from hot_store import HotStore
+from events import EventBroadcaster
+from sse_scan import AnthropicStreamScanner, OpenAIStreamScanner
+from json_tail import JsonTail
+from metrics import Registry
 
 # ── Configuration ────────────────────────────────────────────────────────────
 
@@ -64,30 +78,64 @@ if not OPENAI_UPSTREAM:
     else:
         OPENAI_UPSTREAM = UPSTREAM_BASE_URL  # fallback: same upstream
 
-# Cost per million tokens by model prefix (longer prefixes matched first)
-# USD per 1M tokens — input, output, cache_read, cache_write
-COST_PER_MILLION = {
-    # Anthropic Claude models
-    "claude-opus-4-6": {"input": 5.0, "output": 25.0, "cache_read": 0.50, "cache_write": 6.25},
-    "claude-opus-4-5": {"input": 5.0, "output": 25.0, "cache_read": 0.50, "cache_write": 6.25},
-    "claude-opus-4-1": {"input": 15.0, "output": 75.0, "cache_read": 1.50, "cache_write": 18.75},
-    "claude-opus-4": {"input": 15.0, "output": 75.0, "cache_read": 1.50, "cache_write": 18.75},
-    "claude-sonnet-4": {"input": 3.0, "output": 15.0, "cache_read": 0.30, "cache_write": 3.75},
-    "claude-haiku-4-5": {"input": 1.0, "output": 5.0, "cache_read": 0.10, "cache_write": 1.25},
-    "claude-haiku-3-5": {"input": 0.80, "output": 4.0, "cache_read": 0.08, "cache_write": 1.0},
-    "claude-haiku": {"input": 0.80, "output": 4.0, "cache_read": 0.08, "cache_write": 1.0},
-    # Moonshot Kimi models
-    "kimi-k2-0711": {"input": 0.60, "output": 3.0, "cache_read": 0.10, "cache_write": 0.60},
-    "kimi-k2-0905": {"input": 0.60, "output": 2.50, "cache_read": 0.15, "cache_write": 0.60},
-    "kimi-k2-thinking": {"input": 0.60, "output": 2.50, "cache_read": 0.15, "cache_write": 0.60},
-    "kimi-k2": {"input": 0.60, "output": 2.50, "cache_read": 0.15, "cache_write": 0.60},
-    # OpenAI models
-    "gpt-4o": {"input": 2.50, "output": 10.0, "cache_read": 1.25, "cache_write": 0},
-    "gpt-4o-mini": {"input": 0.15, "output": 0.60, "cache_read": 0.075, "cache_write": 0},
-    "gpt-4-turbo": {"input": 10.0, "output": 30.0, "cache_read": 0, "cache_write": 0},
-    "gpt-4": {"input": 30.0, "output": 60.0, "cache_read": 0, "cache_write": 0},
-    "gpt-3.5-turbo": {"input": 0.50, "output": 1.50, "cache_read": 0, "cache_write": 0},
-}
+# Upstream connection pools, one per upstream (see providers/http_pool.py).
+# These are the defaults; settings.json "upstream_pools": {"anthropic": {...},
+# "openai": {...}} overrides them per upstream. Read when the pool is created.
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_HTTP2 = os.environ.get("UPSTREAM_HTTP2", "true").lower() in ("1", "true", "yes")
+
+# Background usage writer — rows are batched off the event loop.
+# Flushes when USAGE_BATCH_SIZE rows are pending or after USAGE_FLUSH_MS.
+USAGE_BATCH_SIZE = int(os.environ.get("USAGE_BATCH_SIZE", "50"))
+USAGE_FLUSH_MS = int(os.environ.get("USAGE_FLUSH_MS", "500"))
+USAGE_QUEUE_SIZE = int(os.environ.get("USAGE_QUEUE_SIZE", "10000"))
+USAGE_OVERFLOW_SIZE = int(os.environ.get("USAGE_OVERFLOW_SIZE", "1000"))
+
+# /token_events fan-out. EVENTS_TAIL_SECONDS is how often the DB is checked
+# for turns logged by other instances (0 disables the tailer).
+EVENTS_BUFFER_SIZE = int(os.environ.get("EVENTS_BUFFER_SIZE", "500"))
+EVENTS_CLIENT_QUEUE = int(os.environ.get("EVENTS_CLIENT_QUEUE", "256"))
+EVENTS_TAIL_SECONDS = float(os.environ.get("EVENTS_TAIL_SECONDS", "2"))
+
+# System prompt breakdowns are cached by content hash (LRU, bounded by both)
+PROMPT_CACHE_MB = float(os.environ.get("PROMPT_CACHE_MB", "64"))
+PROMPT_CACHE_ENTRIES = int(os.environ.get("PROMPT_CACHE_ENTRIES", "256"))
+
+# Non-streaming responses are forwarded as they arrive; at most this many
+# trailing bytes are kept to read usage from a body too large to parse whole
+RESPONSE_TAIL_BYTES = int(os.environ.get("RESPONSE_TAIL_BYTES", "65536"))
+
+# Recent conversation histories kept so only newly appended messages are
+# measured for conversation_history_chars (0 re-encodes every request)
+HISTORY_CACHE_SESSIONS = int(os.environ.get("HISTORY_CACHE_SESSIONS", "16"))
+
+# Opt-in: parse request bodies incrementally, reusing messages already decoded
+# from the previous turn instead of json.loads-ing the whole body every time
+LAZY_REQUEST_PARSE = os.environ.get("LAZY_REQUEST_PARSE", "").lower() in ("1", "true", "yes")
+
+# SQLite retention: raw usage rows older than RETENTION_DAYS are archived to
+# gzip JSONL under RETENTION_ARCHIVE_DIR (empty: delete without archiving)
+# and pruned every RETENTION_INTERVAL_HOURS. 0 days keeps everything.
+RETENTION_DAYS = float(os.environ.get("RETENTION_DAYS", "0"))
+RETENTION_ARCHIVE_DIR = os.environ.get(
+    "RETENTION_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "data", "archive")
+)
+RETENTION_INTERVAL_HOURS = float(os.environ.get("RETENTION_INTERVAL_HOURS", "6"))
+
+# In-memory hot store: the last HOT_STORE_HOURS of usage (at most HOT_STORE_ROWS
+# rows) are kept in memory and dashboard reads are served from it. 0 disables.
+HOT_STORE_HOURS = int(os.environ.get("HOT_STORE_HOURS", "0"))
+HOT_STORE_ROWS = int(os.environ.get("HOT_STORE_ROWS", "200000"))
+
+# Model prices live in each provider's COST_TABLE; PRICING_PATH is an optional
+# JSON file that overrides or extends them per provider ({"anthropic": {...},
+# "openai": {...}, "default": {...}}), re-read within PRICING_RELOAD_SECONDS
+# of a change. See providers/pricing.py.
+PRICING_PATH = os.environ.get("PRICING_PATH", os.path.join(os.path.dirname(__file__), "data", "pricing.json"))
+PRICING_RELOAD_SECONDS = float(os.environ.get("PRICING_RELOAD_SECONDS", "5"))
+pricing_catalog.configure(PRICING_PATH, PRICING_RELOAD_SECONDS)
 
 # ── Dynamic Settings ─────────────────────────────────────────────────────────
 # Persistent settings stored in data/settings.json. Editable via dashboard or API.
@@ -95,6 +143,12 @@ COST_PER_MILLION = {
 
 SETTINGS_PATH = os.path.join(os.path.dirname(__file__), "data", "settings.json")
 
+# Parsed settings are cached; the file is re-checked for changes (e.g. saves
+# by another instance sharing it) at most every SETTINGS_RELOAD_SECONDS.
+_settings_store = SettingsStore(
+    SETTINGS_PATH, check_interval=float(os.environ.get("SETTINGS_RELOAD_SECONDS", "1"))
+)
+
 _DEFAULT_SETTINGS = {
     "session_char_limit": 200_000,
     "poll_interval_minutes": 5,
@@ -112,34 +166,25 @@ def _ensure_agent_in_settings(settings: dict, agent_name: str):
 
 
 def load_settings() -> dict:
-    """Load settings from disk, merging with defaults for missing keys."""
-    try:
-        with open(SETTINGS_PATH, "r") as f:
-            data = json.load(f)
-        # Merge defaults for any missing top-level keys
-        for k, v in _DEFAULT_SETTINGS.items():
-            if k not in data:
-                data[k] = v
-        # Ensure current agent exists in settings
-        data = _ensure_agent_in_settings(data, AGENT_NAME)
-        return data
-    except (FileNotFoundError, json.JSONDecodeError):
-        data = dict(_DEFAULT_SETTINGS)
-        data = _ensure_agent_in_settings(data, AGENT_NAME)
-        return data
+    """Current settings merged with defaults. The result is a copy the caller may modify."""
+    data = copy.deepcopy(_settings_store.get())
+    # Merge defaults for any missing top-level keys
+    for k, v in _DEFAULT_SETTINGS.items():
+        if k not in data:
+            data[k] = copy.deepcopy(v)
+    # Ensure current agent exists in settings
+    return _ensure_agent_in_settings(data, AGENT_NAME)
 
 
 def save_settings(data: dict):
     """Persist settings to disk."""
-    os.makedirs(os.path.dirname(SETTINGS_PATH), exist_ok=True)
-    with open(SETTINGS_PATH, "w") as f:
-        json.dump(data, f, indent=2)
+    _settings_store.save(data)
 
 
 def get_agent_setting(agent: str, key: str):
     """Get a setting for a specific agent, falling back to global default."""
-    settings = load_settings()
-    agent_settings = settings.get("agents", {}).get(agent, {})
+    settings = _settings_store.get()
+    agent_settings = settings.get("agents", {}).get(agent) or {}
     val = agent_settings.get(key)
     if val is not None:
         return val
@@ -157,47 +202,132 @@ log = logging.getLogger("token-monitor")
 
 app = FastAPI(title="Token Spy — API Monitor", docs_url=None, redoc_url=None)
 
-# Anthropic upstream client (for /v1/messages)
-_anthropic_client: httpx.AsyncClient | None = None
-# OpenAI-format upstream client (for /v1/chat/completions — Moonshot, OpenAI, etc.)
-_openai_client: httpx.AsyncClient | None = None
+# Upstream providers, keyed by upstream: "anthropic" serves /v1/messages,
+# "openai" serves /v1/chat/completions (Moonshot, OpenAI, local, etc.).
+# Each provider instance owns its upstream's client and connection pool.
+_upstreams: dict[str, LLMProvider] = {}
+
+
+def _pool_config(upstream: str) -> dict:
+    pool = {
+        "max_connections": UPSTREAM_MAX_CONNECTIONS,
+        "max_keepalive_connections": UPSTREAM_MAX_KEEPALIVE,
+        "keepalive_expiry": UPSTREAM_KEEPALIVE_EXPIRY,
+        "http2": UPSTREAM_HTTP2,
+    }
+    overrides = (_settings_store.get().get("upstream_pools") or {}).get(upstream) or {}
+    pool.update(overrides)
+    return pool
+
 
-_CLIENT_TIMEOUT = httpx.Timeout(connect=10.0, read=300.0, write=30.0, pool=30.0)
-_CLIENT_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+def _upstream_provider(upstream: str) -> LLMProvider:
+    provider = _upstreams.get(upstream)
+    if provider is None:
+        if upstream == "anthropic":
+            name, base_url = "anthropic", ANTHROPIC_UPSTREAM
+        else:
+            name = API_PROVIDER if API_PROVIDER in ("moonshot", "local") else "openai"
+            base_url = OPENAI_UPSTREAM
+        provider = ProviderRegistry.get(name, {"base_url": base_url, "pool": _pool_config(upstream)})
+        _upstreams[upstream] = provider
+    return provider
 
 
 def get_http_client() -> httpx.AsyncClient:
     """Get the Anthropic upstream client (Messages API)."""
-    global _anthropic_client
-    if _anthropic_client is None or _anthropic_client.is_closed:
-        _anthropic_client = httpx.AsyncClient(
-            base_url=ANTHROPIC_UPSTREAM,
-            timeout=_CLIENT_TIMEOUT,
-            limits=_CLIENT_LIMITS,
-        )
-    return _anthropic_client
+    return _upstream_provider("anthropic").get_http_client()
 
 
 def get_moonshot_client() -> httpx.AsyncClient:
     """Get the OpenAI-format upstream client (Chat Completions API)."""
-    global _openai_client
-    if _openai_client is None or _openai_client.is_closed:
-        _openai_client = httpx.AsyncClient(
-            base_url=OPENAI_UPSTREAM,
-            timeout=_CLIENT_TIMEOUT,
-            limits=_CLIENT_LIMITS,
-        )
-    return _openai_client
+    return _upstream_provider("openai").get_http_client()
 
 
 _db_available = True
 
+# ── Metrics ──────────────────────────────────────────────────────────────────
+# Served on /metrics (see metrics.py). `api` is the proxied protocol:
+# "anthropic" for /v1/messages, "openai" for /v1/chat/completions.
+
+_metrics = Registry()
+_m_parse = _metrics.histogram(
+    "tokenspy_request_parse_seconds", "Time to decode the request body", ("api",))
+_m_analysis = _metrics.histogram(
+    "tokenspy_request_analysis_seconds", "Time to analyze system prompt and messages", ("api",))
+_m_ttfb = _metrics.histogram(
+    "tokenspy_upstream_ttfb_seconds",
+    "Time from sending the request upstream to the first response byte", ("api", "stream"))
+_m_stream = _metrics.histogram(
+    "tokenspy_stream_duration_seconds", "Time from sending a streaming request to the end of its stream", ("api",))
+_m_db_write = _metrics.histogram(
+    "tokenspy_db_write_seconds", "Latency of usage writer batch writes")
+_m_turns = _metrics.counter("tokenspy_turns_total", "Logged turns", ("agent", "model"))
+_m_tokens = _metrics.counter("tokenspy_tokens_total", "Tokens by kind", ("agent", "model", "kind"))
+_m_cost = _metrics.counter("tokenspy_cost_usd_total", "Estimated cost in USD", ("agent", "model"))
+_m_upstream_errors = _metrics.counter(
+    "tokenspy_upstream_errors_total", "Upstream requests that failed before or during the response", ("api",))
+
+_storage: Storage = BackendStorage(DB_BACKEND)
+if HOT_STORE_HOURS > 0:
+    _storage = HotStore(_storage, hours=HOT_STORE_HOURS, max_rows=HOT_STORE_ROWS)
+
+_usage_writer = UsageWriter(
+    _storage.write_batch,
+    batch_size=USAGE_BATCH_SIZE,
+    flush_interval=USAGE_FLUSH_MS / 1000,
+    max_queue=USAGE_QUEUE_SIZE,
+    max_overflow=USAGE_OVERFLOW_SIZE,
+    on_flush=lambda seconds, rows: _m_db_write.observe(seconds),
+)
+
+_metrics.gauge("tokenspy_usage_queue_depth", "Usage rows waiting for the writer",
+               lambda: _usage_writer.stats()["queue_depth"])
+_metrics.gauge("tokenspy_usage_dropped_rows", "Usage rows never written, since startup",
+               lambda: {"overflow": _usage_writer.stats()["dropped_rows"],
+                        "write_failed": _usage_writer.stats()["failed_rows"]},
+               ("reason",))
+_metrics.gauge("tokenspy_upstream_in_flight", "Requests in flight per upstream pool",
+               lambda: {u: (p.pool_stats() or {}).get("in_flight", 0) for u, p in _upstreams.items()},
+               ("upstream",))
+_metrics.gauge("tokenspy_upstream_pool_wait_seconds_max", "Longest wait for a pooled connection",
+               lambda: {u: (p.pool_stats() or {}).get("wait_ms_max", 0) / 1000 for u, p in _upstreams.items()},
+               ("upstream",))
+
+_events = EventBroadcaster(ring_size=EVENTS_BUFFER_SIZE, client_queue_size=EVENTS_CLIENT_QUEUE)
+
+_prompt_cache = PromptCache(
+    max_bytes=int(PROMPT_CACHE_MB * 1024 * 1024),
+    max_entries=PROMPT_CACHE_ENTRIES,
+)
+
+_history_cache = HistoryLengthCache(max_sessions=HISTORY_CACHE_SESSIONS)
+
+_retention = None
+if RETENTION_DAYS > 0 and not DB_BACKEND.startswith("postgres"):
+    from retention import RetentionJob
+    _retention = RetentionJob(RETENTION_DAYS, archive_dir=RETENTION_ARCHIVE_DIR)
+
+_request_parser = RequestParser(max_sessions=HISTORY_CACHE_SESSIONS) if LAZY_REQUEST_PARSE else None
+
+
+def _parse_body(raw_body: bytes) -> dict:
+    """Parse a proxied request body (the raw bytes are what gets forwarded)."""
+    if _request_parser is not None:
+        return _request_parser.parse(raw_body)
+    return json.loads(raw_body)
+
+
+_loop: asyncio.AbstractEventLoop | None = None
+
+
 @app.on_event("startup")
-def on_startup():
-    global _db_available
+async def on_startup():
+    global _db_available, _loop
+    _loop = asyncio.get_running_loop()
     try:
-        init_db()
+        await _storage.init()
         _db_available = True
+        _usage_writer.start()
     except Exception as e:
         _db_available = False
         log.error(f"Database unavailable -- running in degraded mode (file-based session monitoring only): {e}")
@@ -205,64 +335,81 @@ def on_startup():
     log.info(f"Token monitor started for agent={AGENT_NAME}, provider={API_PROVIDER}, anthropic_upstream={ANTHROPIC_UPSTREAM}, openai_upstream={OPENAI_UPSTREAM}, db={db_status}")
     # Start background polling for remote agents (A16 etc.)
     # Only the first instance (port 9110) runs the poller to avoid duplicates.
-    import asyncio
-    asyncio.get_event_loop().create_task(_poll_remote_agents())
+    _start_poller()
+    if _db_available:
+        asyncio.get_event_loop().create_task(_tail_db_events())
+        if _retention is not None:
+            asyncio.get_event_loop().create_task(_run_retention())
 
 
-async def _poll_remote_agents():
-    """Periodically check remote and local-model agent sessions and auto-reset if needed."""
-    await asyncio.sleep(10)  # initial delay to let things settle
-    while True:
-        try:
-            # Poll remote agents (SSH-based)
-            for agent in REMOTE_AGENTS:
-                status = _get_remote_session_status(agent)
-                chars = status.get("current_history_chars", 0)
-                limit = get_agent_setting(agent, "session_char_limit")
-                if limit is None or limit <= 0:
-                    limit = AUTO_RESET_HISTORY_CHARS
-                rec = status.get("recommendation", "healthy")
-                tool_results = status.get("tool_results", 0)
-                needs_reset = chars >= limit or rec == "reset_recommended"
-                if needs_reset:
-                    reason = f"tool loop ({tool_results} calls)" if tool_results >= 480 else f"history {chars:,} >= {limit:,}"
-                    log.warning(f"[REMOTE-POLL] {agent}: auto-reset — {reason}")
-                    _kill_session(agent, reason=f"auto-reset ({reason})")
-                    _last_auto_reset[agent] = time.time()
-                elif chars > 0:
-                    log.info(f"[REMOTE-POLL] {agent}: {chars:,} / {limit:,} chars ({chars*100//limit}%)")
-            # Poll local-model agents (file-based, no proxy traffic)
-            for agent in AGENT_SESSION_DIRS:
-                if agent == AGENT_NAME or agent in REMOTE_AGENTS:
-                    continue  # skip agents that go through this proxy instance
-                status = _get_local_session_status(agent)
-                if not status:
-                    continue
-                chars = status.get("current_history_chars", 0)
-                limit = get_agent_setting(agent, "session_char_limit")
-                if limit is None or limit <= 0:
-                    limit = AUTO_RESET_HISTORY_CHARS
-                rec = status.get("recommendation", "healthy")
-                tool_results = status.get("tool_results", 0)
-                needs_reset = chars >= limit or rec == "reset_recommended"
-                if needs_reset:
-                    reason = f"tool loop ({tool_results} calls)" if tool_results >= 480 else f"history {chars:,} >= {limit:,}"
-                    log.warning(f"[LOCAL-POLL] {agent}: auto-reset — {reason}")
-                    _kill_session(agent, reason=f"auto-reset ({reason})")
-                    _last_auto_reset[agent] = time.time()
-                elif chars > 0:
-                    log.info(f"[LOCAL-POLL] {agent}: {chars:,} / {limit:,} chars ({chars*100//limit}%)")
-        except Exception as e:
-            log.error(f"[POLL] Error: {e}")
-        await asyncio.sleep(60)
+def _poll_interval(agent: str) -> float:
+    minutes = get_agent_setting(agent, "poll_interval_minutes")
+    return (minutes if minutes and minutes > 0 else 1) * 60
+
+
+def _check_auto_reset(agent: str, status: dict, tag: str) -> str | None:
+    """Log the agent's usage and return an auto-reset reason if it needs one."""
+    chars = status.get("current_history_chars", 0)
+    limit = get_agent_setting(agent, "session_char_limit")
+    if limit is None or limit <= 0:
+        limit = AUTO_RESET_HISTORY_CHARS
+    rec = status.get("recommendation", "healthy")
+    tool_results = status.get("tool_results", 0)
+    if chars >= limit or rec == "reset_recommended":
+        reason = f"tool loop ({tool_results} calls)" if tool_results >= 480 else f"history {chars:,} >= {limit:,}"
+        log.warning(f"[{tag}] {agent}: auto-reset — {reason}")
+        return reason
+    if chars > 0:
+        log.info(f"[{tag}] {agent}: {chars:,} / {limit:,} chars ({chars*100//limit}%)")
+    return None
+
+
+async def _poll_remote_agent(agent: str):
+    """Check a remote agent's session over its helper and auto-reset if needed."""
+    status = await _remote_session_status(agent)
+    reason = _check_auto_reset(agent, status, "REMOTE-POLL")
+    if reason:
+        await _remote_kill_session(agent, reason=f"auto-reset ({reason})")
+        _last_auto_reset[agent] = time.time()
+
+
+async def _poll_local_agent(agent: str):
+    """Refresh a file-based agent's turn index and auto-reset if needed."""
+    # Keep lifetime turn counts current for /api/summary
+    try:
+        await asyncio.to_thread(_refresh_turn_index, agent)
+    except Exception as e:
+        log.warning(f"[POLL] Turn index refresh failed for {agent}: {e}")
+    if agent == AGENT_NAME or agent in REMOTE_AGENTS:
+        return  # agents that go through this proxy instance are reset inline
+    status = await asyncio.to_thread(_get_local_session_status, agent)
+    if not status:
+        return
+    reason = _check_auto_reset(agent, status, "LOCAL-POLL")
+    if reason:
+        await asyncio.to_thread(_kill_session, agent, f"auto-reset ({reason})")
+        _last_auto_reset[agent] = time.time()
+
+
+def _start_poller() -> asyncio.Task:
+    """Schedule one polling job per remote and local-model agent."""
+    for agent in REMOTE_AGENTS:
+        _poll_scheduler.add(f"remote:{agent}", functools.partial(_poll_remote_agent, agent),
+                            functools.partial(_poll_interval, agent))
+    for agent in AGENT_SESSION_DIRS:
+        _poll_scheduler.add(f"local:{agent}", functools.partial(_poll_local_agent, agent),
+                            functools.partial(_poll_interval, agent))
+    return asyncio.get_event_loop().create_task(_poll_scheduler.run())
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    if _anthropic_client and not _anthropic_client.is_closed:
-        await _anthropic_client.aclose()
-    if _openai_client and not _openai_client.is_closed:
-        await _openai_client.aclose()
+    # Flush queued usage rows before the process exits
+    await asyncio.to_thread(_usage_writer.stop)
+    await _remote_transport.close()
+    await _storage.close()
+    for provider in _upstreams.values():
+        await provider.close()
 
 
 # ── Analysis ─────────────────────────────────────────────────────────────────
@@ -280,85 +427,17 @@ WORKSPACE_FILE_MAP = {
 
 
 def analyze_system_prompt(system_blocks: list) -> dict:
-    """Break down the system prompt into source categories by parsing markdown structure."""
+    """Break down the system prompt into source categories by parsing markdown structure.
+
+    Results are memoized by content hash. The hash and the prompt text are
+    included so the storage backend can dedupe prompts.
+    """
     if not system_blocks:
         return {"system_prompt_total_chars": 0, "base_prompt_chars": 0}
-
-    # Combine all system text blocks
-    text = "\n".join(
-        b.get("text", "") if isinstance(b, dict) else str(b)
-        for b in system_blocks
-    )
-    result = {"system_prompt_total_chars": len(text)}
-
-    # Initialize all workspace columns to 0
-    for col in WORKSPACE_FILE_MAP.values():
-        result.setdefault(col, 0)
-    result["skill_injection_chars"] = 0
-
-    # Extract workspace files from "# Project Context" section.
-    # OpenClaw injects files as: "## FILENAME.md\n\n<full file content>\n\n"
-    # The file content can contain its own ## headings, so we can't split on ## generically.
-    # Instead, find each "## KNOWNFILE.md" marker and measure until the next known marker.
-    ctx_match = re.search(r"^# Project Context\b", text, re.MULTILINE)
-    if ctx_match:
-        after_ctx = text[ctx_match.start():]
-        # Build list of all known file markers: ## AGENTS.md, ## SOUL.md, etc.
-        # Also include ## Silent Replies, ## Heartbeats, ## Runtime as end markers
-        all_file_names = list(WORKSPACE_FILE_MAP.keys())
-        end_markers = ["Silent Replies", "Heartbeats", "Runtime"]
-
-        # Find positions of all ## FILENAME.md markers within the context
-        file_positions = []
-        for fname in all_file_names:
-            pattern = re.compile(r"^## " + re.escape(fname) + r"\s*$", re.MULTILINE)
-            m = pattern.search(after_ctx)
-            if m:
-                content_start = m.end() + 1  # skip the newline after header
-                file_positions.append((m.start(), content_start, fname))
-
-        # Also find end-of-context markers (sections that follow workspace files)
-        for marker in end_markers:
-            pattern = re.compile(r"^## " + re.escape(marker) + r"\b", re.MULTILINE)
-            m = pattern.search(after_ctx)
-            if m:
-                file_positions.append((m.start(), m.start(), None))  # None = end marker
-
-        # Sort by position
-        file_positions.sort(key=lambda x: x[0])
-
-        # Measure each file's content: from content_start to the next marker's start
-        for i, (pos, content_start, fname) in enumerate(file_positions):
-            if fname is None:
-                continue  # end marker
-            # Find next marker position
-            if i + 1 < len(file_positions):
-                content_end = file_positions[i + 1][0]
-            else:
-                content_end = len(after_ctx)
-            content = after_ctx[content_start:content_end]
-            col = WORKSPACE_FILE_MAP.get(fname)
-            if col:
-                result[col] += len(content)
-            else:
-                result.setdefault("workspace_other_chars", 0)
-                result["workspace_other_chars"] = result.get("workspace_other_chars", 0) + len(content)
-
-    # Extract skills section (## Skills (mandatory) ... until next ## at same level)
-    skills_match = re.search(
-        r"^## Skills \(mandatory\)\n(.*?)(?=^## |\Z)", text, re.MULTILINE | re.DOTALL
+    prompt_hash, text, result = _prompt_cache.analyze(
+        system_blocks, lambda t: analyze_system_text(t, WORKSPACE_FILE_MAP)
     )
-    if skills_match:
-        result["skill_injection_chars"] = len(skills_match.group(0))
-
-    # Base prompt = total minus workspace files and skills
-    accounted = sum(
-        v for k, v in result.items()
-        if k.startswith("workspace_") or k == "skill_injection_chars"
-    )
-    result["base_prompt_chars"] = max(0, result["system_prompt_total_chars"] - accounted)
-
-    return result
+    return {**result, "system_prompt_hash": prompt_hash, "system_prompt_text": text}
 
 
 def analyze_messages(messages: list) -> dict:
@@ -384,7 +463,7 @@ def analyze_messages(messages: list) -> dict:
         "message_count": len(messages),
         "user_message_count": user_count,
         "assistant_message_count": assistant_count,
-        "conversation_history_chars": len(json.dumps(messages, separators=(",", ":"))),
+        "conversation_history_chars": _history_cache.measure(messages),
     }
 
 
@@ -394,6 +473,8 @@ def estimate_cost(model: str, input_tokens: int, output_tokens: int,
     
     Uses the provider plugin system for pricing data. Falls back to hardcoded
     COST_PER_MILLION if provider lookup fails for backwards compatibility.
+    Both go through the compiled, memoized pricing index; recost.py resolves
+    prices through the same ProviderRegistry.pricing.
     """
     usage = {
         "input_tokens": input_tokens,
@@ -402,27 +483,7 @@ def estimate_cost(model: str, input_tokens: int, output_tokens: int,
         "cache_write_tokens": cache_write,
     }
     
-    # Try provider-based cost calculation first
-    provider = ProviderRegistry.get_or_none(provider_name)
-    if provider:
-        return provider.calculate_cost(usage, model)
-    
-    # Fallback to hardcoded rates for backwards compatibility
-    rates = None
-    model_lower = (model or "").lower()
-    for prefix, r in COST_PER_MILLION.items():
-        if prefix in model_lower:
-            rates = r
-            break
-    if not rates:
-        return 0.0
-
-    return (
-        input_tokens * rates["input"] / 1_000_000
-        + output_tokens * rates["output"] / 1_000_000
-        + cache_read * rates["cache_read"] / 1_000_000
-        + cache_write * rates["cache_write"] / 1_000_000
-    )
+    return ProviderRegistry.pricing(provider_name).cost(usage, model)
 
 
 # ── Message Cap Helper ────────────────────────────────────────────────────────
@@ -436,10 +497,13 @@ async def proxy_messages(request: Request):
 
     # Read and parse request body
     raw_body = await request.body()
+    t0 = time.perf_counter()
     try:
-        body = json.loads(raw_body)
+        body = _parse_body(raw_body)
     except json.JSONDecodeError:
         body = {}
+    t1 = time.perf_counter()
+    _m_parse.observe(t1 - t0, "anthropic")
 
     model = body.get("model", "unknown")
     system_blocks = body.get("system", [])
@@ -452,6 +516,7 @@ async def proxy_messages(request: Request):
         system_blocks if isinstance(system_blocks, list) else [{"text": system_blocks}]
     )
     msg_analysis = analyze_messages(messages)
+    _m_analysis.observe(time.perf_counter() - t1, "anthropic")
 
     log.info(
         f"→ {model} | msgs={msg_analysis['message_count']} | "
@@ -492,75 +557,54 @@ async def proxy_messages(request: Request):
 
 async def _handle_streaming(client, raw_body, headers, model, sys_analysis,
                             msg_analysis, tools, start_time):
-    """Stream SSE response through while capturing token metrics."""
+    """Stream SSE response through while capturing token metrics.
 
-    # State for capturing usage from SSE events
-    usage = {
-        "input_tokens": 0,
-        "output_tokens": 0,
-        "cache_read_tokens": 0,
-        "cache_write_tokens": 0,
-        "stop_reason": None,
-    }
+    Upstream bytes are forwarded as-is; the scanner only decodes the
+    message_start / message_delta events that carry usage.
+    """
+    scanner = AnthropicStreamScanner()
 
     async def stream_and_capture():
-        current_event = None
+        logged = False
+        sent = time.perf_counter()
+        first = True
         try:
             async with client.stream(
                 "POST", "/v1/messages",
                 content=raw_body,
                 headers=headers,
             ) as upstream:
-                async for line in upstream.aiter_lines():
-                    # Yield line immediately for transparent passthrough
-                    yield line + "\n"
-
-                    # Parse SSE events
-                    stripped = line.strip()
-                    if stripped.startswith("event:"):
-                        current_event = stripped[6:].strip()
-                    elif stripped.startswith("data:") and current_event:
-                        data_str = stripped[5:].strip()
-                        if data_str == "[DONE]":
-                            continue
-                        try:
-                            data = json.loads(data_str)
-                        except json.JSONDecodeError:
-                            continue
-
-                        if current_event == "message_start":
-                            msg_usage = (data.get("message", {}).get("usage", {}))
-                            usage["input_tokens"] = msg_usage.get("input_tokens", 0)
-                            usage["cache_read_tokens"] = msg_usage.get("cache_read_input_tokens", 0)
-                            usage["cache_write_tokens"] = msg_usage.get("cache_creation_input_tokens", 0)
-
-                        elif current_event == "message_delta":
-                            delta_usage = data.get("usage", {})
-                            if delta_usage.get("output_tokens") is not None:
-                                usage["output_tokens"] = delta_usage["output_tokens"]
-                            stop = data.get("delta", {}).get("stop_reason")
-                            if stop:
-                                usage["stop_reason"] = stop
-
-                        elif current_event == "message_stop":
-                            # Stream complete — log metrics
-                            _log_entry(
-                                model, sys_analysis, msg_analysis, tools,
-                                raw_body, usage, start_time,
-                                provider_name="anthropic",
-                            )
+                async for chunk in _iter_passthrough(upstream):
+                    if first:
+                        first = False
+                        _m_ttfb.observe(time.perf_counter() - sent, "anthropic", "true")
+                    # Yield chunk immediately for transparent passthrough
+                    yield chunk
+                    scanner.feed(chunk)
+                    if scanner.complete and not logged:
+                        # Stream complete — log metrics
+                        logged = True
+                        _log_entry(
+                            model, sys_analysis, msg_analysis, tools,
+                            raw_body, scanner.usage, start_time,
+                            provider_name="anthropic",
+                        )
         except httpx.HTTPStatusError as e:
+            _m_upstream_errors.inc(1, "anthropic")
             log.error(f"Upstream HTTP error: {e.response.status_code}")
             yield f"data: {json.dumps({'type': 'error', 'error': {'type': 'proxy_error', 'message': str(e)}})}\n\n"
         except Exception as e:
+            _m_upstream_errors.inc(1, "anthropic")
             log.error(f"Proxy stream error: {e}")
             # Still try to log what we have
-            if usage["input_tokens"] > 0:
+            if scanner.usage["input_tokens"] > 0 and not logged:
                 _log_entry(
                     model, sys_analysis, msg_analysis, tools,
-                    raw_body, usage, start_time,
+                    raw_body, scanner.usage, start_time,
                     provider_name="anthropic",
                 )
+        finally:
+            _m_stream.observe(time.perf_counter() - sent, "anthropic")
 
     return StreamingResponse(
         stream_and_capture(),
@@ -573,42 +617,116 @@ async def _handle_streaming(client, raw_body, headers, model, sys_analysis,
     )
 
 
+def _iter_passthrough(upstream: httpx.Response):
+    """Upstream body chunks exactly as received.
+
+    Raw bytes are forwarded when the body is identity-encoded; compressed
+    bodies are decoded first since the downstream response doesn't carry
+    the upstream Content-Encoding header.
+    """
+    if upstream.headers.get("content-encoding", "identity") == "identity":
+        return upstream.aiter_raw()
+    return upstream.aiter_bytes()
+
+
+_HOP_BY_HOP = {"connection", "keep-alive", "proxy-connection", "transfer-encoding",
+               "te", "trailer", "upgrade"}
+
+
+class _UpstreamStreamingResponse(StreamingResponse):
+    """StreamingResponse that always closes the upstream response it relays.
+
+    The body generator's own cleanup only runs once iteration starts; a client
+    that disconnects before the first chunk would otherwise leave the upstream
+    connection checked out of the pool.
+    """
+
+    def __init__(self, upstream: httpx.Response, content, **kwargs):
+        super().__init__(content, **kwargs)
+        self._upstream = upstream
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._upstream.aclose()
+
+
+def _passthrough_response(upstream: httpx.Response, on_body=None, on_complete=None,
+                          on_first_chunk=None, on_error=None) -> StreamingResponse:
+    """Stream an upstream response to the client as it arrives.
+
+    on_body(chunk) sees every forwarded chunk; on_first_chunk() runs when the
+    first one arrives; on_complete() runs once the whole body has been
+    forwarded, on_error() if reading it fails. The upstream response is
+    closed either way, including when the client leaves before the body starts.
+    """
+    headers = {k: v for k, v in upstream.headers.items() if k.lower() not in _HOP_BY_HOP}
+    if upstream.headers.get("content-encoding", "identity") != "identity":
+        # _iter_passthrough decodes compressed bodies
+        headers = {k: v for k, v in headers.items() if k.lower() not in ("content-encoding", "content-length")}
+
+    async def body():
+        first = on_first_chunk
+        try:
+            async for chunk in _iter_passthrough(upstream):
+                if first is not None:
+                    first()
+                    first = None
+                if on_body is not None:
+                    on_body(chunk)
+                yield chunk
+        except httpx.HTTPError as e:
+            log.error(f"Upstream body error: {e}")
+            if on_error is not None:
+                on_error()
+            return
+        finally:
+            await upstream.aclose()
+        if on_complete is not None:
+            on_complete()
+
+    return _UpstreamStreamingResponse(upstream, body(), status_code=upstream.status_code, headers=headers)
+
+
 async def _handle_non_streaming(client, raw_body, headers, model, sys_analysis,
                                 msg_analysis, tools, start_time):
-    """Handle non-streaming requests (rare for OpenClaw, but support anyway)."""
+    """Handle non-streaming requests (rare for OpenClaw, but support anyway).
+
+    The response is forwarded as it arrives; usage is read from its tail.
+    """
+    sent = time.perf_counter()
     try:
-        resp = await client.request(
-            "POST", "/v1/messages",
-            content=raw_body,
-            headers=headers,
+        resp = await client.send(
+            client.build_request("POST", "/v1/messages", content=raw_body, headers=headers),
+            stream=True,
         )
     except Exception as e:
+        _m_upstream_errors.inc(1, "anthropic")
         log.error(f"Upstream request error: {e}")
         return JSONResponse(
             status_code=502,
             content={"error": {"type": "proxy_error", "message": str(e)}},
         )
 
-    try:
-        data = resp.json()
-    except Exception:
-        data = {}
-
-    resp_usage = data.get("usage", {})
-    usage = {
-        "input_tokens": resp_usage.get("input_tokens", 0),
-        "output_tokens": resp_usage.get("output_tokens", 0),
-        "cache_read_tokens": resp_usage.get("cache_read_input_tokens", 0),
-        "cache_write_tokens": resp_usage.get("cache_creation_input_tokens", 0),
-        "stop_reason": data.get("stop_reason"),
-    }
-
-    _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, usage, start_time, provider_name="anthropic")
+    tail = JsonTail(RESPONSE_TAIL_BYTES)
+
+    def log_usage_from_tail():
+        data = tail.parse(("stop_reason",))
+        resp_usage = data.get("usage") or {}
+        usage = {
+            "input_tokens": resp_usage.get("input_tokens", 0),
+            "output_tokens": resp_usage.get("output_tokens", 0),
+            "cache_read_tokens": resp_usage.get("cache_read_input_tokens", 0),
+            "cache_write_tokens": resp_usage.get("cache_creation_input_tokens", 0),
+            "stop_reason": data.get("stop_reason"),
+        }
+        _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, usage, start_time, provider_name="anthropic")
 
-    return Response(
-        content=resp.content,
-        status_code=resp.status_code,
-        headers=dict(resp.headers),
+    return _passthrough_response(
+        resp, on_body=tail.feed, on_complete=log_usage_from_tail,
+        on_first_chunk=lambda: _m_ttfb.observe(time.perf_counter() - sent, "anthropic", "false"),
+        on_error=lambda: _m_upstream_errors.inc(1, "anthropic"),
     )
 
 
@@ -641,7 +759,7 @@ def _analyze_openai_messages(messages: list) -> dict:
         "message_count": len(messages),
         "user_message_count": user_count,
         "assistant_message_count": assistant_count,
-        "conversation_history_chars": len(json.dumps(messages, separators=(",", ":"))),
+        "conversation_history_chars": _history_cache.measure(messages),
         "system_prompt_total_chars": system_chars,
         "base_prompt_chars": system_chars,
     }
@@ -653,10 +771,13 @@ async def proxy_chat_completions(request: Request):
     start = time.time()
 
     raw_body = await request.body()
+    t0 = time.perf_counter()
     try:
-        body = json.loads(raw_body)
+        body = _parse_body(raw_body)
     except json.JSONDecodeError:
         body = {}
+    t1 = time.perf_counter()
+    _m_parse.observe(t1 - t0, "openai")
 
     model = body.get("model", "unknown")
     messages = body.get("messages", [])
@@ -664,11 +785,12 @@ async def proxy_chat_completions(request: Request):
     is_streaming = body.get("stream", False)
 
     # Moonshot/Kimi doesn't support the "developer" role (OpenAI-specific).
-    # Rewrite to "system" before forwarding.
+    # Rewrite to "system" before forwarding. Messages are copied rather than
+    # edited in place since the request parser may share them across turns.
     rewritten = False
-    for m in messages:
+    for i, m in enumerate(messages):
         if m.get("role") == "developer":
-            m["role"] = "system"
+            messages[i] = {**m, "role": "system"}
             rewritten = True
     if rewritten:
         body["messages"] = messages
@@ -679,6 +801,7 @@ async def proxy_chat_completions(request: Request):
         "system_prompt_total_chars": msg_analysis.pop("system_prompt_total_chars", 0),
         "base_prompt_chars": msg_analysis.pop("base_prompt_chars", 0),
     }
+    _m_analysis.observe(time.perf_counter() - t1, "openai")
 
     # Debug: log message roles to diagnose ROLE_UNSPECIFIED errors
     roles = [m.get("role", "<MISSING>") for m in messages]
@@ -716,15 +839,12 @@ async def proxy_chat_completions(request: Request):
 async def _handle_openai_streaming(client, raw_body, headers, model, sys_analysis,
                                    msg_analysis, tools, start_time):
     """Stream OpenAI SSE response through while capturing token metrics."""
-    usage = {
-        "input_tokens": 0,
-        "output_tokens": 0,
-        "cache_read_tokens": 0,
-        "cache_write_tokens": 0,
-        "stop_reason": None,
-    }
+    scanner = OpenAIStreamScanner()
 
     async def stream_and_capture():
+        logged = False
+        sent = time.perf_counter()
+        first = True
         try:
             async with client.stream(
                 "POST", "/v1/chat/completions",
@@ -738,45 +858,32 @@ async def _handle_openai_streaming(client, raw_body, headers, model, sys_analysi
                     log.error(f"Upstream {upstream.status_code}: {err_body[:2000].decode(errors='replace')}")
                     yield f"data: {err_body.decode(errors='replace')}\n\n"
                     return
-                async for line in upstream.aiter_lines():
-                    yield line + "\n"
-
-                    stripped = line.strip()
-                    if not stripped.startswith("data:"):
-                        continue
-                    data_str = stripped[5:].strip()
-                    if data_str == "[DONE]":
+                async for chunk in _iter_passthrough(upstream):
+                    if first:
+                        first = False
+                        _m_ttfb.observe(time.perf_counter() - sent, "openai", "true")
+                    yield chunk
+                    # OpenAI streaming: usage comes in the final chunk, then [DONE]
+                    scanner.feed(chunk)
+                    if scanner.complete and not logged:
+                        logged = True
                         _log_entry(
                             model, sys_analysis, msg_analysis, tools,
-                            raw_body, usage, start_time,
+                            raw_body, scanner.usage, start_time,
                             provider_name="openai",
                         )
-                        continue
-                    try:
-                        data = json.loads(data_str)
-                    except json.JSONDecodeError:
-                        continue
-
-                    # OpenAI streaming: usage comes in the final chunk
-                    chunk_usage = data.get("usage")
-                    if chunk_usage:
-                        usage["input_tokens"] = chunk_usage.get("prompt_tokens", 0)
-                        usage["output_tokens"] = chunk_usage.get("completion_tokens", 0)
-                        usage["cache_read_tokens"] = chunk_usage.get("prompt_tokens_details", {}).get("cached_tokens", 0)
-
-                    choices = data.get("choices", [])
-                    if choices:
-                        finish = choices[0].get("finish_reason")
-                        if finish:
-                            usage["stop_reason"] = finish
 
         except httpx.HTTPStatusError as e:
+            _m_upstream_errors.inc(1, "openai")
             log.error(f"Upstream HTTP error: {e.response.status_code}")
             yield f"data: {json.dumps({'error': {'message': str(e), 'type': 'proxy_error'}})}\n\n"
         except Exception as e:
+            _m_upstream_errors.inc(1, "openai")
             log.error(f"Proxy stream error: {e}")
-            if usage["input_tokens"] > 0:
-                _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, usage, start_time, provider_name="openai")
+            if scanner.usage["input_tokens"] > 0 and not logged:
+                _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, scanner.usage, start_time, provider_name="openai")
+        finally:
+            _m_stream.observe(time.perf_counter() - sent, "openai")
 
     return StreamingResponse(
         stream_and_capture(),
@@ -791,40 +898,40 @@ async def _handle_openai_streaming(client, raw_body, headers, model, sys_analysi
 
 async def _handle_openai_non_streaming(client, raw_body, headers, model, sys_analysis,
                                        msg_analysis, tools, start_time):
-    """Handle non-streaming OpenAI-format requests."""
+    """Handle non-streaming OpenAI-format requests (forwarded as they arrive)."""
+    sent = time.perf_counter()
     try:
-        resp = await client.request(
-            "POST", "/v1/chat/completions",
-            content=raw_body,
-            headers=headers,
+        resp = await client.send(
+            client.build_request("POST", "/v1/chat/completions", content=raw_body, headers=headers),
+            stream=True,
         )
     except Exception as e:
+        _m_upstream_errors.inc(1, "openai")
         log.error(f"Upstream request error: {e}")
         return JSONResponse(
             status_code=502,
             content={"error": {"message": str(e), "type": "proxy_error"}},
         )
 
-    try:
-        data = resp.json()
-    except Exception:
-        data = {}
-
-    resp_usage = data.get("usage", {})
-    usage = {
-        "input_tokens": resp_usage.get("prompt_tokens", 0),
-        "output_tokens": resp_usage.get("completion_tokens", 0),
-        "cache_read_tokens": resp_usage.get("prompt_tokens_details", {}).get("cached_tokens", 0),
-        "cache_write_tokens": 0,
-        "stop_reason": (data.get("choices", [{}])[0].get("finish_reason") if data.get("choices") else None),
-    }
-
-    _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, usage, start_time, provider_name="openai")
+    tail = JsonTail(RESPONSE_TAIL_BYTES)
+
+    def log_usage_from_tail():
+        data = tail.parse(("finish_reason",))
+        resp_usage = data.get("usage") or {}
+        choices = data.get("choices")
+        usage = {
+            "input_tokens": resp_usage.get("prompt_tokens", 0),
+            "output_tokens": resp_usage.get("completion_tokens", 0),
+            "cache_read_tokens": (resp_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+            "cache_write_tokens": 0,
+            "stop_reason": choices[0].get("finish_reason") if choices else data.get("finish_reason"),
+        }
+        _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, usage, start_time, provider_name="openai")
 
-    return Response(
-        content=resp.content,
-        status_code=resp.status_code,
-        headers=dict(resp.headers),
+    return _passthrough_response(
+        resp, on_body=tail.feed, on_complete=log_usage_from_tail,
+        on_first_chunk=lambda: _m_ttfb.observe(time.perf_counter() - sent, "openai", "false"),
+        on_error=lambda: _m_upstream_errors.inc(1, "openai"),
     )
 
 
@@ -845,9 +952,32 @@ except json.JSONDecodeError:
 # To enable file-based session management, set AGENT_SESSION_DIRS as JSON:
 #   AGENT_SESSION_DIRS='{"my-agent":"/path/to/sessions"}'
 
-# Remote agents: run on different hosts, accessed via SSH.
-# No remote agents configured by default.
+# Remote agents: run on different hosts, polled over one persistent SSH
+# session per host (see remote_transport.py). No remote agents by default.
+# Format: REMOTE_AGENTS='{"agent-name":{"user":"me","host":"box","sessions_dir":"/path"}}'
 REMOTE_AGENTS = {}
+try:
+    _remote_json = os.environ.get("REMOTE_AGENTS", "")
+    if _remote_json:
+        REMOTE_AGENTS = json.loads(_remote_json)
+except json.JSONDecodeError:
+    log.warning("Invalid REMOTE_AGENTS JSON, using empty dict")
+
+# Seconds between checks of a remote sessions dir by its host's helper;
+# changes are pushed back, so this bounds how stale remote status can be.
+REMOTE_WATCH_INTERVAL = float(os.environ.get("REMOTE_WATCH_INTERVAL", "5"))
+
+_remote_transport = RemoteTransport()
+
+# Background polling: one job per agent, each on its own poll_interval_minutes.
+# POLL_CONCURRENCY bounds jobs running at once; a run taking longer than
+# POLL_TIMEOUT_SECONDS is abandoned. POLL_JITTER spreads runs by +/- that
+# fraction of the interval.
+_poll_scheduler = PollScheduler(
+    max_concurrency=int(os.environ.get("POLL_CONCURRENCY", "4")),
+    timeout=float(os.environ.get("POLL_TIMEOUT_SECONDS", "30")),
+    jitter=float(os.environ.get("POLL_JITTER", "0.1")),
+)
 
 # Agents running local/self-hosted models ($0 cost, no cloud API).
 # These get a "LOCAL" badge and $0 cost display on the dashboard.
@@ -860,54 +990,37 @@ AUTO_RESET_HISTORY_CHARS = 200_000
 
 # Cooldown: don't auto-reset the same agent more than once per 60 seconds
 _last_auto_reset: dict[str, float] = {}
+# Remote auto-resets started from the proxy handlers, by agent (one at a time)
+_auto_reset_tasks: dict[str, asyncio.Task] = {}
+
+# Per-file offsets and counters for local agents' session JSONL files
+_session_index = SessionIndex()
+
+# Lifetime turn counts per session file, persisted across restarts and purges
+TURN_INDEX_PATH = os.environ.get(
+    "TURN_INDEX_PATH", os.path.join(os.path.dirname(__file__), "data", "turn-index.db")
+)
+_turn_index = TurnIndex(TURN_INDEX_PATH)
 
 
 
 def _get_local_session_status(agent: str) -> dict:
     """Get session status for a local agent by reading JSONL files directly.
     Used for agents whose traffic doesn't pass through the token monitor proxy
-    (e.g. agents using a local model via vLLM/Ollama)."""
+    (e.g. agents using a local model via vLLM/Ollama).
+
+    The newest session file is tailed incrementally by _session_index, so this
+    only reads bytes appended since the last call. Blocking — call it from a
+    worker thread when on the event loop."""
     sessions_dir = AGENT_SESSION_DIRS.get(agent)
     if not sessions_dir:
         return None
 
-    import glob
-    files = sorted(glob.glob(os.path.join(sessions_dir, "*.jsonl")), key=os.path.getmtime, reverse=True)
-    if not files:
+    scan = _session_index.latest(sessions_dir)
+    if scan is None:
         return None
-
-    largest = files[0]
-    try:
-        with open(largest) as f:
-            lines = f.readlines()
-    except Exception:
-        return None
-
-    user_turns = 0
-    assistant_turns = 0
-    history_chars = 0
-    tool_results = 0
-    for l in lines:
-        try:
-            d = json.loads(l)
-            if d.get("type") == "message":
-                msg = d.get("message", {})
-                if isinstance(msg, str):
-                    msg = json.loads(msg)
-                role = msg.get("role", "")
-                if role == "user":
-                    user_turns += 1
-                elif role == "assistant":
-                    assistant_turns += 1
-                if role in ("toolResult", "tool") or msg.get("tool_call_id"):
-                    tool_results += 1
-                c = msg.get("content", "")
-                if isinstance(c, list):
-                    history_chars += sum(len(str(x)) for x in c)
-                elif isinstance(c, str):
-                    history_chars += len(c)
-        except Exception:
-            pass
+    history_chars = scan["history_chars"]
+    tool_results = scan["tool_results"]
 
     limit = get_agent_setting(agent, "session_char_limit") or AUTO_RESET_HISTORY_CHARS
     if tool_results >= 480:
@@ -923,7 +1036,7 @@ def _get_local_session_status(agent: str) -> dict:
 
     # Use user turns if available; fall back to assistant turns for local-model
     # agents whose OpenClaw gateway doesn't log user messages in the JSONL.
-    turns = user_turns if user_turns > 0 else assistant_turns
+    turns = scan["user_turns"] if scan["user_turns"] > 0 else scan["assistant_turns"]
 
     return {
         "agent": agent,
@@ -937,215 +1050,136 @@ def _get_local_session_status(agent: str) -> dict:
         "recommendation": rec,
         "is_local_model": agent in LOCAL_MODEL_AGENTS,
         "tool_results": tool_results,
-        "file_bytes": os.path.getsize(largest),
-        "total_lines": len(lines),
-        "session_files": len(files),
+        "file_bytes": scan["file_bytes"],
+        "total_lines": scan["total_lines"],
+        "session_files": scan["session_files"],
     }
 
 
 def _get_local_accumulated_turns(agent: str) -> int:
-    """Count total turns across ALL session files for a local-model agent,
-    with a persistent accumulator to survive session file cleanup/purge.
+    """Total turns across ALL session files for a local-model agent,
+    including files since purged by session cleanup.
     Unlike _get_local_session_status (current session only), this gives the
     lifetime accumulated turn count — important for cost-per-turn math when
-    the agent runs at $0/token."""
-    sessions_dir = AGENT_SESSION_DIRS.get(agent)
-    if not sessions_dir:
+    the agent runs at $0/token.
+
+    Answered from the turn index, which the poller refreshes every cycle;
+    session files are only read here the first time an agent is seen."""
+    if not AGENT_SESSION_DIRS.get(agent):
         return 0
+    total = _turn_index.total_turns(agent)
+    if total is None:
+        _refresh_turn_index(agent)
+        total = _turn_index.total_turns(agent)
+    return total or 0
 
-    # Count current turns from all session files on disk.
-    # Use user turns if available; fall back to assistant turns for agents
-    # whose OpenClaw gateway doesn't log user messages in the JSONL.
-    import glob
-    files = glob.glob(os.path.join(sessions_dir, "*.jsonl"))
-    user_turns = 0
-    assistant_turns = 0
-    for fpath in files:
+
+def _refresh_turn_index(agent: str):
+    """Count turns appended to an agent's session files since the last refresh."""
+    sessions_dir = AGENT_SESSION_DIRS.get(agent)
+    if not sessions_dir:
+        return
+    if _turn_index.total_turns(agent) is None:
+        # Carry over turns from purged files recorded by the old JSON accumulator
+        acc_path = os.path.join(os.path.dirname(__file__), "data", f"{agent}-accumulated-turns.json")
         try:
-            with open(fpath) as f:
-                for line in f:
-                    try:
-                        d = json.loads(line)
-                        if d.get("type") == "message":
-                            msg = d.get("message", {})
-                            if isinstance(msg, str):
-                                msg = json.loads(msg)
-                            role = msg.get("role", "")
-                            if role == "user":
-                                user_turns += 1
-                            elif role == "assistant":
-                                assistant_turns += 1
-                    except Exception:
-                        pass
+            with open(acc_path) as f:
+                acc = json.load(f)
+            _turn_index.retire(agent, max(0, acc.get("total", 0) - acc.get("last_file_turns", 0)))
         except Exception:
             pass
-    current_file_turns = user_turns if user_turns > 0 else assistant_turns
+    _turn_index.refresh(agent, sessions_dir)
 
-    # Persistent accumulator — survives session purge (250KB/24h cleanup)
-    acc_path = os.path.join(os.path.dirname(__file__), "data", f"{agent}-accumulated-turns.json")
-    try:
-        with open(acc_path) as f:
-            acc = json.load(f)
-    except Exception:
-        acc = {"total": 0, "last_file_turns": 0}
 
-    last_file_turns = acc.get("last_file_turns", 0)
-    total = acc.get("total", 0)
+def _remote_no_data(agent: str) -> dict:
+    return {"agent": agent, "recommendation": "no_data", "current_session_turns": 0,
+            "current_history_chars": 0, "last_turn_cost": 0, "avg_cost_last_5": 0,
+            "cache_write_pct_last_5": 0, "cost_since_last_reset": 0, "turns_since_last_reset": 0}
 
-    if current_file_turns >= last_file_turns:
-        # Normal growth or no change — add the delta
-        total += (current_file_turns - last_file_turns)
-    else:
-        # Session files were purged (current < last) — add what's on disk now
-        total += current_file_turns
 
-    acc = {"total": total, "last_file_turns": current_file_turns}
+def _on_loop() -> bool:
+    """Whether the caller is running on the server's event loop thread."""
     try:
-        os.makedirs(os.path.dirname(acc_path), exist_ok=True)
-        with open(acc_path, "w") as f:
-            json.dump(acc, f)
-    except Exception:
-        pass
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
 
-    return total
 
+def _run_on_loop(coro, timeout: float):
+    """Run a coroutine on the server's event loop from a worker thread."""
+    if _loop is None:
+        coro.close()
+        raise RemoteError("event loop not running")
+    if _on_loop():
+        # Waiting here would block the loop the coroutine needs to run on
+        coro.close()
+        raise RemoteError("blocking call made on the event loop")
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result(timeout)
 
-def _get_remote_session_status(agent: str) -> dict:
-    """Get session status for a remote agent via SSH."""
-    import subprocess
+
+async def _remote_session_status(agent: str) -> dict:
+    """Get session status for a remote agent over its persistent helper session."""
     remote = REMOTE_AGENTS.get(agent)
     if not remote:
-        return {"agent": agent, "recommendation": "no_data", "current_session_turns": 0,
-                "current_history_chars": 0, "last_turn_cost": 0, "avg_cost_last_5": 0,
-                "cache_write_pct_last_5": 0, "cost_since_last_reset": 0, "turns_since_last_reset": 0}
-
-    ssh_target = f"{remote['user']}@{remote['host']}"
-    sessions_dir = remote["sessions_dir"]
-
-    script = (
-        "import json, os, glob\n"
-        f"sdir = \"{sessions_dir}\"\n"
-        "files = sorted(glob.glob(os.path.join(sdir, '*.jsonl')), key=os.path.getmtime, reverse=True)\n"
-        "if not files:\n"
-        "    print(json.dumps({'turns': 0, 'chars': 0, 'files': 0}))\n"
-        "else:\n"
-        "    largest = files[0]\n"
-        "    with open(largest) as f:\n"
-        "        lines = f.readlines()\n"
-        "    turns = 0\n"
-        "    history_chars = 0\n"
-        "    tool_results = 0\n"
-        "    for l in lines:\n"
-        "        try:\n"
-        "            d = json.loads(l)\n"
-        "            if d.get('type') == 'message':\n"
-        "                msg = d.get('message', {})\n"
-        "                if isinstance(msg, str): msg = json.loads(msg)\n"
-        "                role = msg.get('role', '')\n"
-        "                if role == 'user': turns += 1\n"
-        "                if role in ('toolResult', 'tool') or msg.get('tool_call_id'): tool_results += 1\n"
-        "                c = msg.get('content', '')\n"
-        "                if isinstance(c, list):\n"
-        "                    history_chars += sum(len(str(x)) for x in c)\n"
-        "                elif isinstance(c, str):\n"
-        "                    history_chars += len(c)\n"
-        "        except: pass\n"
-        "    print(json.dumps({'turns': turns, 'chars': history_chars, 'tool_results': tool_results,"
-        " 'file_bytes': os.path.getsize(largest), 'total_lines': len(lines), 'files': len(files)}))"
-    )
+        return _remote_no_data(agent)
     try:
-        result = subprocess.run(
-            ["ssh", "-o", "ConnectTimeout=3", "-o", "StrictHostKeyChecking=no",
-             ssh_target, "python3", "-"],
-            input=script, capture_output=True, text=True, timeout=10,
-        )
-        if result.returncode != 0:
-            log.warning(f"[REMOTE] SSH to {agent} failed: {result.stderr[:200]}")
-            return {"agent": agent, "recommendation": "no_data", "current_session_turns": 0,
-                    "current_history_chars": 0, "last_turn_cost": 0, "avg_cost_last_5": 0,
-                    "cache_write_pct_last_5": 0, "cost_since_last_reset": 0, "turns_since_last_reset": 0}
-
-        data = json.loads(result.stdout.strip())
-        history_chars = data.get("chars", 0)
-        turns = data.get("turns", 0)
-        tool_results = data.get("tool_results", 0)
-
-        limit = get_agent_setting(agent, "session_char_limit") or AUTO_RESET_HISTORY_CHARS
-        if tool_results >= 480:
-            rec = "reset_recommended"
-            log.warning(f"[REMOTE] {agent}: tool loop detected ({tool_results} tool results in session)")
-        elif history_chars > limit:
-            rec = "reset_recommended"
-        elif history_chars > limit * 0.8:
-            rec = "compact_soon"
-        elif history_chars > limit * 0.6:
-            rec = "monitor"
-        else:
-            rec = "healthy"
-
-        return {
-            "agent": agent,
-            "current_session_turns": turns,
-            "current_history_chars": history_chars,
-            "last_turn_cost": 0,
-            "avg_cost_last_5": 0,
-            "cache_write_pct_last_5": 0,
-            "cost_since_last_reset": 0,
-            "turns_since_last_reset": turns,
-            "recommendation": rec,
-            "is_local_model": agent in LOCAL_MODEL_AGENTS,
-            "tool_results": tool_results,
-        }
-    except Exception as e:
+        data = await _remote_transport.status(remote, interval=REMOTE_WATCH_INTERVAL)
+    except RemoteError as e:
         log.warning(f"[REMOTE] Failed to get session status for {agent}: {e}")
-        return {"agent": agent, "recommendation": "no_data", "current_session_turns": 0,
-                "current_history_chars": 0, "last_turn_cost": 0, "avg_cost_last_5": 0,
-                "cache_write_pct_last_5": 0, "cost_since_last_reset": 0, "turns_since_last_reset": 0}
+        return _remote_no_data(agent)
 
+    history_chars = data.get("chars", 0)
+    turns = data.get("turns", 0)
+    tool_results = data.get("tool_results", 0)
 
-def _kill_remote_session(agent: str, reason: str = "dashboard") -> dict:
-    """Kill the largest session for a remote agent via SSH."""
-    import subprocess
+    limit = get_agent_setting(agent, "session_char_limit") or AUTO_RESET_HISTORY_CHARS
+    if tool_results >= 480:
+        rec = "reset_recommended"
+        log.warning(f"[REMOTE] {agent}: tool loop detected ({tool_results} tool results in session)")
+    elif history_chars > limit:
+        rec = "reset_recommended"
+    elif history_chars > limit * 0.8:
+        rec = "compact_soon"
+    elif history_chars > limit * 0.6:
+        rec = "monitor"
+    else:
+        rec = "healthy"
+
+    return {
+        "agent": agent,
+        "current_session_turns": turns,
+        "current_history_chars": history_chars,
+        "last_turn_cost": 0,
+        "avg_cost_last_5": 0,
+        "cache_write_pct_last_5": 0,
+        "cost_since_last_reset": 0,
+        "turns_since_last_reset": turns,
+        "recommendation": rec,
+        "is_local_model": agent in LOCAL_MODEL_AGENTS,
+        "tool_results": tool_results,
+    }
+
+
+async def _remote_kill_session(agent: str, reason: str = "dashboard") -> dict:
+    """Kill the largest session for a remote agent over its helper session."""
     remote = REMOTE_AGENTS.get(agent)
     if not remote:
         return {"agent": agent, "action": "none", "reason": f"unknown remote agent: {agent}"}
+    try:
+        data = await _remote_transport.request(remote, "kill", sessions_dir=remote["sessions_dir"])
+    except RemoteError as e:
+        return {"agent": agent, "action": "none", "reason": str(e)}
+    _remote_transport.invalidate(remote)
+    data["agent"] = agent
+    if data.get("action") == "killed":
+        log.warning(f"[RESET] Remote killed session {data.get('session_id')} for {agent} ({data.get('size_bytes')} bytes) — {reason}")
+    return data
 
-    ssh_target = f"{remote['user']}@{remote['host']}"
-    sessions_dir = remote["sessions_dir"]
-
-    script = (
-        "import os, glob, json\n"
-        f"sdir = \"{sessions_dir}\"\n"
-        "files = sorted(glob.glob(os.path.join(sdir, '*.jsonl')), key=os.path.getsize, reverse=True)\n"
-        "if not files:\n"
-        "    print(json.dumps({'action': 'none', 'reason': 'no sessions'}))\n"
-        "else:\n"
-        "    f = files[0]\n"
-        "    size = os.path.getsize(f)\n"
-        "    sid = os.path.basename(f).replace('.jsonl', '')\n"
-        "    os.remove(f)\n"
-        "    sj = os.path.join(sdir, 'sessions.json')\n"
-        "    try:\n"
-        "        with open(sj) as fh: data = json.load(fh)\n"
-        "        for k in list(data.keys()):\n"
-        "            if isinstance(data[k], dict) and data[k].get('sessionId') == sid: del data[k]\n"
-        "        with open(sj, 'w') as fh: json.dump(data, fh, indent=2)\n"
-        "    except: pass\n"
-        "    print(json.dumps({'action': 'killed', 'session_id': sid, 'size_bytes': size}))"
-    )
+
+def _kill_remote_session(agent: str, reason: str = "dashboard") -> dict:
+    """Blocking variant of _remote_kill_session for sync callers."""
     try:
-        result = subprocess.run(
-            ["ssh", "-o", "ConnectTimeout=3", "-o", "StrictHostKeyChecking=no",
-             ssh_target, "python3", "-"],
-            input=script, capture_output=True, text=True, timeout=10,
-        )
-        if result.returncode != 0:
-            return {"agent": agent, "action": "none", "reason": f"SSH failed: {result.stderr[:100]}"}
-        data = json.loads(result.stdout.strip())
-        data["agent"] = agent
-        if data.get("action") == "killed":
-            log.warning(f"[RESET] Remote killed session {data.get('session_id')} for {agent} ({data.get('size_bytes')} bytes) — {reason}")
-        return data
+        return _run_on_loop(_remote_kill_session(agent, reason), timeout=15)
     except Exception as e:
         return {"agent": agent, "action": "none", "reason": str(e)}
 
@@ -1215,18 +1249,42 @@ def _auto_reset_check(agent: str, history_chars: int):
     if now - last < 60:
         return
 
+    if agent in _auto_reset_tasks:
+        return
+
     log.warning(
         f"[AUTO-RESET] {agent} history={history_chars:,} chars exceeds "
         f"{limit:,} threshold — killing session"
     )
-    result = _kill_session(agent, reason=f"auto-reset (history={history_chars:,} chars)")
+    reason = f"auto-reset (history={history_chars:,} chars)"
+    if agent in REMOTE_AGENTS and _on_loop():
+        # Inline from a proxy handler: run the helper round trip as a task
+        # instead of blocking the loop on it
+        _auto_reset_tasks[agent] = asyncio.ensure_future(_auto_reset_remote(agent, reason, now))
+        return
+    _auto_reset_done(agent, _kill_session(agent, reason=reason), now)
+
+
+async def _auto_reset_remote(agent: str, reason: str, started: float):
+    try:
+        _auto_reset_done(agent, await _remote_kill_session(agent, reason), started)
+    except Exception as e:
+        log.error(f"[AUTO-RESET] {agent} remote reset failed: {e}")
+    finally:
+        _auto_reset_tasks.pop(agent, None)
+
+
+def _auto_reset_done(agent: str, result: dict, started: float):
     if result.get("action") == "killed":
-        _last_auto_reset[agent] = now
+        _last_auto_reset[agent] = started
         log.warning(f"[AUTO-RESET] {agent} session killed: {result.get('session_id')}")
 
 
 def _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, usage, start_time, provider_name: str = None):
-    """Write a usage entry to SQLite.
+    """Queue a usage entry for the background writer.
+
+    Falls back to a direct write if the writer isn't running (e.g. DB was
+    unavailable at startup).
     
     Args:
         provider_name: Provider name for cost calculation. Auto-detected from model if not provided.
@@ -1235,15 +1293,7 @@ def _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, usage, start_
     
     # Auto-detect provider from model name if not specified
     if not provider_name:
-        model_lower = (model or "").lower()
-        if "claude" in model_lower:
-            provider_name = "anthropic"
-        elif "kimi" in model_lower:
-            provider_name = "openai"  # Moonshot uses OpenAI-compatible format
-        elif "gpt" in model_lower:
-            provider_name = "openai"
-        else:
-            provider_name = "anthropic"  # default
+        provider_name = provider_for_model(model)
     
     cost = estimate_cost(
         model,
@@ -1255,6 +1305,8 @@ def _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, usage, start_
     )
 
     entry = {
+        # Stamped here, not at flush time, so rows keep their own turn time
+        "timestamp": datetime.now(timezone.utc),
         "agent": AGENT_NAME,
         "model": model,
         "request_body_bytes": len(raw_body),
@@ -1267,7 +1319,10 @@ def _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, usage, start_
     }
 
     try:
-        log_usage(entry)
+        if _usage_writer.running:
+            _usage_writer.submit(entry)
+        else:
+            _storage.write_batch([entry])
         log.info(
             f"← {model} | in={usage['input_tokens']} out={usage['output_tokens']} "
             f"cache_r={usage['cache_read_tokens']} cache_w={usage['cache_write_tokens']} | "
@@ -1276,6 +1331,23 @@ def _log_entry(model, sys_analysis, msg_analysis, tools, raw_body, usage, start_
     except Exception as e:
         log.error(f"Failed to log usage: {e}")
 
+    labels = (AGENT_NAME, model)
+    _m_turns.inc(1, *labels)
+    _m_cost.inc(entry["estimated_cost_usd"], *labels)
+    for kind in ("input", "output", "cache_read", "cache_write"):
+        _m_tokens.inc(usage[f"{kind}_tokens"] or 0, *labels, kind)
+
+    _events.publish(_sse_usage_event({
+        "agent_name": AGENT_NAME,
+        "model": model,
+        "provider": provider_name,
+        "input_tokens": usage["input_tokens"],
+        "output_tokens": usage["output_tokens"],
+        "total_tokens": usage["input_tokens"] + usage["output_tokens"],
+        "cost_usd": entry["estimated_cost_usd"],
+        "timestamp": entry["timestamp"].strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+    }))
+
     # Check if this agent needs an auto-reset
     history_chars = msg_analysis.get("conversation_history_chars", 0)
     _auto_reset_check(AGENT_NAME, history_chars)
@@ -1292,9 +1364,30 @@ def health():
         "agent": AGENT_NAME,
         "uptime_seconds": uptime,
         "session_char_limit": limit,
+        "usage_writer": _usage_writer.stats(),
+        "storage": _storage.stats(),
+        "token_events": _events.stats(),
+        "prompt_cache": _prompt_cache.stats(),
+        "history_cache": _history_cache.stats(),
+        "request_parser": _request_parser.stats() if _request_parser else None,
+        "session_index": _session_index.stats(),
+        "remote_transport": _remote_transport.stats(),
+        "settings_store": _settings_store.stats(),
+        "retention": _retention.stats() if _retention is not None else None,
+        "pricing": pricing_catalog.stats(),
+        "upstream_pools": {
+            upstream: {"provider": p.name, "base_url": p.base_url, "pool": p.pool_stats()}
+            for upstream, p in _upstreams.items()
+        },
     }
 
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of proxy latencies, token and cost counters."""
+    return PlainTextResponse(_metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # ── API Endpoints ────────────────────────────────────────────────────────────
 
 
@@ -1380,23 +1473,29 @@ def _update_timer_interval(minutes: int):
         log.warning(f"[SETTINGS] Could not update timer: {e} (may need sudo)")
 
 @app.get("/api/usage")
-def api_usage(agent: str | None = None, hours: int = 24, limit: int = 200):
-    return query_usage(agent=agent, hours=hours, limit=limit)
+async def api_usage(agent: str | None = None, hours: int = 24, limit: int = 200):
+    return await _storage.query_usage(agent=agent, hours=hours, limit=limit)
 
 
 @app.get("/token-usage")
-def token_usage_alias(agent: str | None = None, hours: int = 24, limit: int = 200):
+async def token_usage_alias(agent: str | None = None, hours: int = 24, limit: int = 200):
     """Alias for /api/usage — returns recent token usage events."""
-    return query_usage(agent=agent, hours=hours, limit=limit)
+    return await _storage.query_usage(agent=agent, hours=hours, limit=limit)
 
 
 @app.get("/api/summary")
-def api_summary(hours: int = 24):
+async def api_summary(hours: int = 24):
     try:
-        result = query_summary(hours=hours) if _db_available else []
+        result = await _storage.query_summary(hours=hours) if _db_available else []
     except Exception as e:
         log.warning(f"DB summary query failed: {e}")
         result = []
+    # Session files are read off the event loop
+    return await asyncio.to_thread(_add_untracked_agents, result)
+
+
+def _add_untracked_agents(result: list[dict]) -> list[dict]:
+    """Tag local-model agents and add session-dir agents missing from the DB summary."""
     # Tag DB results for local-model agents
     for r in result:
         if r.get("agent") in LOCAL_MODEL_AGENTS:
@@ -1427,12 +1526,12 @@ def api_summary(hours: int = 24):
 
 
 @app.get("/api/session-status")
-def api_session_status(agent: str | None = None):
+async def api_session_status(agent: str | None = None):
     """Current session health and cost recommendation for an agent."""
     target = agent or AGENT_NAME
     limit = get_agent_setting(target, "session_char_limit") or 200_000
     if target in REMOTE_AGENTS:
-        result = _get_remote_session_status(target)
+        result = await _remote_session_status(target)
         result["session_char_limit"] = limit
         return result
     # If DB is unavailable, skip the query and go straight to file-based reader
@@ -1440,13 +1539,13 @@ def api_session_status(agent: str | None = None):
         result = {"recommendation": "no_data"}
     else:
         try:
-            result = query_session_status(target, char_limit=limit)
+            result = await _storage.query_session_status(target, char_limit=limit)
         except Exception as e:
             log.warning(f"DB query failed for {target}, falling back to file reader: {e}")
             result = {"recommendation": "no_data"}
     # If DB has no data, try reading session files directly (local model agents)
     if result.get("recommendation") == "no_data" and target in AGENT_SESSION_DIRS:
-        local_result = _get_local_session_status(target)
+        local_result = await asyncio.to_thread(_get_local_session_status, target)
         if local_result:
             local_result["session_char_limit"] = limit
             return local_result
@@ -1456,6 +1555,12 @@ def api_session_status(agent: str | None = None):
     return result
 
 
+@app.get("/api/poller")
+def api_poller():
+    """Background polling schedule: per-agent last run, duration, lag and failures."""
+    return _poll_scheduler.stats()
+
+
 @app.post("/api/reset-session")
 def api_reset_session(agent: str):
     """Kill the largest active session for an agent (safety valve trigger)."""
@@ -2110,44 +2215,98 @@ def dashboard():
 
 # ── SSE Token Events Stream ─────────────────────────────────────────────────
 
+def _sse_usage_event(row: dict) -> dict:
+    """Shape a usage row (from _log_entry or query_recent_events) as an SSE payload."""
+    return {
+        "type": "token_usage",
+        "session_id": row.get("session_id") or "",
+        "model": row.get("model", ""),
+        "provider": row.get("provider", ""),
+        "input_tokens": row.get("input_tokens", 0),
+        "output_tokens": row.get("output_tokens", 0),
+        "total_tokens": row.get("total_tokens", 0),
+        "cost_usd": float(row.get("cost_usd", 0) or 0),
+        "timestamp": row.get("timestamp", ""),
+        "agent_name": row.get("agent_name", AGENT_NAME),
+    }
+
+
+async def _run_retention():
+    """Apply the usage retention policy every RETENTION_INTERVAL_HOURS."""
+    await asyncio.sleep(60)  # stay out of the way during startup
+    while True:
+        try:
+            await asyncio.to_thread(_retention.run_once)
+        except Exception as e:
+            log.error(f"[RETENTION] Error: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL_HOURS * 3600)
+
+
+async def _tail_db_events():
+    """Publish turns logged by other proxy instances sharing the database.
+
+    This instance's own turns are published directly by _log_entry, so the
+    tailer skips them. One query per interval regardless of client count,
+    and none at all while nobody is subscribed.
+    """
+    last_id = None
+    try:
+        # Seed the replay buffer so new dashboards get recent history
+        for row in await _storage.query_recent_events(limit=EVENTS_BUFFER_SIZE):
+            _events.publish(_sse_usage_event(row))
+            last_id = row.get("id")
+    except Exception as e:
+        log.warning(f"[EVENTS] Could not seed event buffer: {e}")
+    if EVENTS_TAIL_SECONDS <= 0:
+        return
+
+    while True:
+        await asyncio.sleep(EVENTS_TAIL_SECONDS)
+        if not _events.subscriber_count:
+            continue
+        try:
+            while True:
+                rows = await _storage.query_recent_events(limit=200, after_id=last_id)
+                for row in rows:
+                    last_id = row.get("id")
+                    if row.get("agent_name") != AGENT_NAME:
+                        _events.publish(_sse_usage_event(row))
+                if len(rows) < 200:
+                    break
+        except Exception as e:
+            log.error(f"[EVENTS] DB tail error: {e}")
+
+
 @app.get("/token_events")
 async def token_events(request: Request):
-    """Stream token usage events as Server-Sent Events."""
+    """Stream token usage events as Server-Sent Events.
+
+    Events are pushed from the in-process broadcaster. Clients reconnecting
+    with a Last-Event-ID header resume where they left off.
+    """
+    try:
+        last_event_id = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        last_event_id = None
+    sub = _events.subscribe(last_event_id)
+
     async def event_stream():
-        last_id = None
-        while True:
-            try:
-                # Query recent events
-                events = query_recent_events(limit=50, after_id=last_id)
-                
-                for event in events:
-                    # Format event as SSE
-                    event_data = {
-                        "type": "token_usage",
-                        "session_id": event.get("session_id", ""),
-                        "model": event.get("model", ""),
-                        "provider": event.get("provider", ""),
-                        "input_tokens": event.get("input_tokens", 0),
-                        "output_tokens": event.get("output_tokens", 0),
-                        "total_tokens": event.get("total_tokens", 0),
-                        "cost_usd": float(event.get("cost_usd", 0) or 0),
-                        "timestamp": event.get("timestamp", ""),
-                        "agent_name": event.get("agent_name", AGENT_NAME)
-                    }
-                    
-                    yield f"data: {json.dumps(event_data)}\n\n"
-                    last_id = event.get("id")
-                
-                # Heartbeat to keep connection alive
-                yield ":heartbeat\n\n"
-                
-                # Wait before next poll
-                await asyncio.sleep(2)
-                
-            except Exception as e:
-                log.error(f"SSE stream error: {e}")
-                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
-                await asyncio.sleep(5)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(sub.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Heartbeat to keep connection alive
+                    yield ":heartbeat\n\n"
+                    continue
+                if item is None:
+                    # Evicted as a slow consumer — end the stream so the client reconnects
+                    log.warning("[EVENTS] Evicted slow /token_events client")
+                    break
+                event_id, event_data = item
+                yield f"id: {event_id}\ndata: {json.dumps(event_data)}\n\n"
+        finally:
+            _events.unsubscribe(sub)
     
     return StreamingResponse(
         event_stream(),
@@ -2164,11 +2323,15 @@ async def token_events(request: Request):
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def proxy_other(request: Request, path: str):
-    """Forward any other requests to upstream transparently."""
+    """Forward any other requests to upstream transparently.
+
+    Bodies are streamed both ways, so large uploads and downloads (files,
+    batch results) never sit whole in proxy memory.
+    """
     client = get_http_client()
     headers = {}
     for key in ("x-api-key", "anthropic-version", "content-type", "anthropic-beta",
-                "authorization", "accept", "user-agent"):
+                "authorization", "accept", "user-agent", "content-length"):
         val = request.headers.get(key)
         if val:
             headers[key] = val
@@ -2180,18 +2343,17 @@ async def proxy_other(request: Request, path: str):
         else:
             headers["authorization"] = f"Bearer {UPSTREAM_API_KEY}"
 
-    body = await request.body()
+    has_body = "content-length" in headers or "transfer-encoding" in request.headers
     try:
-        resp = await client.request(
-            method=request.method,
-            url=f"/{path}",
-            content=body if body else None,
-            headers=headers,
-        )
-        return Response(
-            content=resp.content,
-            status_code=resp.status_code,
-            headers=dict(resp.headers),
+        resp = await client.send(
+            client.build_request(
+                method=request.method,
+                url=f"/{path}",
+                content=request.stream() if has_body else None,
+                headers=headers,
+            ),
+            stream=True,
         )
     except Exception as e:
         return JSONResponse(status_code=502, content={"error": str(e)})
+    return _passthrough_response(resp)
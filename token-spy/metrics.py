@@ -0,0 +1,149 @@
+"""Prometheus metrics for the proxy hot path, served as text on /metrics.
+
+The proxy only logged one line per turn, so its overhead, time to first
+token, upstream latency distribution and queue depth could only be pieced
+together from logs. This module keeps histograms and counters in memory and
+renders them in the Prometheus text exposition format; prometheus_client is
+not required.
+
+Recording is meant to cost about as much as a dict lookup: each label
+combination gets its bucket counts preallocated on first use, an observation
+is a bisect plus two list increments, and nothing takes a lock. Metrics are
+updated from the event loop, apart from the usage writer's flush latency
+(its own thread); under the GIL an unlocked increment racing another thread
+can at worst be lost, which monitoring can tolerate. Gauges are callbacks
+read at scrape time.
+"""
+
+import math
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+# Seconds; covers sub-millisecond parsing up to multi-minute streams
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: dict[tuple, list] = {}
+
+    def inc(self, amount: float = 1.0, *labels):
+        cell = self._values.get(labels)
+        if cell is None:
+            cell = self._values.setdefault(labels, [0.0])
+        cell[0] += amount
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_labels(self.label_names, k)} {_num(v[0])}"
+                for k, v in list(self._values.items())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        cell = self._values.get(labels)
+        if cell is None:
+            cell = self._values.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, cell in list(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, cell):
+                cumulative += n
+                le = _labels(self.label_names, key, 'le="%s"' % _num(bound))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += cell[len(self.buckets)]
+            le = _labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_num(cell[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value read from `fn` at scrape time: a number, or {label values: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            return [f"{self.name} {_num(value)}"]
+        return [f"{self.name}{_labels(self.label_names, k if isinstance(k, tuple) else (k,))} {_num(v)}"
+                for k, v in value.items() if v is not None]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, fn, labels))
+
+    def render(self) -> str:
+        out = []
+        for m in self._metrics:
+            out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} {m.kind}")
+            out.extend(m.render())
+        return "\n".join(out) + "\n"
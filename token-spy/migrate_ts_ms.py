@@ -0,0 +1,48 @@
+"""Backfill the integer ts_ms column of an existing SQLite usage database.
+
+Databases created before ts_ms existed get the column (empty) on the next
+start; until every row has it, queries fall back to the ISO text column.
+This fills it in short batches, each its own transaction, so it can run
+while token-spy keeps writing to the same file:
+
+    python3 migrate_ts_ms.py [--db data/usage.db] [--batch 5000] [--pause-ms 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=db.DB_PATH, help="SQLite database path (default: DB_PATH)")
+    parser.add_argument("--batch", type=int, default=5000, help="rows per transaction")
+    parser.add_argument("--pause-ms", type=float, default=20, help="sleep between batches")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        sys.exit(f"no database at {args.db}")
+    db.DB_PATH = args.db
+    db.init_db()  # adds the column, indexes and trigger if missing
+    conn = db._get_conn()
+    remaining = conn.execute("SELECT COUNT(*) FROM usage WHERE ts_ms IS NULL").fetchone()[0]
+    print(f"{args.db}: {remaining:,} rows to backfill")
+
+    done, started = 0, time.monotonic()
+    while True:
+        n = db.backfill_ts_ms(args.batch)
+        if not n:
+            break
+        done += n
+        rate = done / max(time.monotonic() - started, 1e-9)
+        print(f"  {done:,}/{remaining:,} rows ({rate:,.0f} rows/s)", flush=True)
+        time.sleep(args.pause_ms / 1000)
+    conn.execute("PRAGMA optimize")
+    print(f"done: {done:,} rows in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Per-job scheduler for background session polling.
+
+The poller used to walk every agent in one loop on a fixed sleep, so one slow
+host delayed every other agent's auto-reset check. Here each job runs on its
+own interval (re-read before every run, so settings changes apply without a
+restart), with:
+
+  - jitter, so jobs sharing an interval don't all fire in the same tick;
+  - bounded concurrency across jobs;
+  - a per-run timeout, after which the run counts as failed and gives up
+    its concurrency slot. It is not cancelled: jobs do their blocking work
+    in threads, which keep going whatever happens to the awaiting coroutine;
+  - no overlap: a job is rescheduled only after its current run finishes,
+    including a timed-out run's thread work.
+
+Per-job metrics (last run, duration, lag behind schedule, failures) are
+available from stats(). Must be used from the event loop.
+"""
+
+import asyncio
+import heapq
+import logging
+import random
+import time
+from typing import Awaitable, Callable
+
+log = logging.getLogger("token-monitor")
+
+
+class _Job:
+    __slots__ = ("name", "fn", "interval_fn", "due", "running", "stats")
+
+    def __init__(self, name: str, fn: Callable[[], Awaitable], interval_fn: Callable[[], float], due: float):
+        self.name = name
+        self.fn = fn
+        self.interval_fn = interval_fn
+        self.due = due
+        self.running = False
+        self.stats = {
+            "runs": 0, "failures": 0, "timeouts": 0,
+            "interval_s": None, "last_run": None, "last_duration_ms": None,
+            "last_lag_ms": None, "max_lag_ms": 0.0, "last_error": None,
+        }
+
+
+class PollScheduler:
+    def __init__(self, max_concurrency: int = 4, timeout: float = 30.0,
+                 jitter: float = 0.1, initial_delay: float = 10.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.jitter = max(0.0, min(jitter, 0.5))
+        self.initial_delay = initial_delay
+        self._jobs: dict[str, _Job] = {}
+        self._heap: list[tuple[float, int, str]] = []
+        self._seq = 0
+        self._wake: asyncio.Event | None = None
+        self._sem: asyncio.Semaphore | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(self, name: str, fn: Callable[[], Awaitable], interval_fn: Callable[[], float]):
+        """Register `fn` to run every interval_fn() seconds."""
+        # Spread first runs over one jitter window so they don't start together
+        due = time.monotonic() + self.initial_delay * (1 + random.uniform(0, self.jitter * 2))
+        self._jobs[name] = _Job(name, fn, interval_fn, due)
+        self._push(name, due)
+
+    async def run(self):
+        """Dispatch jobs as they come due. Runs until cancelled."""
+        self._wake = asyncio.Event()
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        try:
+            while True:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, name = heapq.heappop(self._heap)
+                    job = self._jobs.get(name)
+                    if job is not None and not job.running:
+                        job.running = True
+                        task = asyncio.create_task(self._run_job(job))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                delay = self._heap[0][0] - now if self._heap else 60.0
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        jobs = {}
+        for job in self._jobs.values():
+            jobs[job.name] = {
+                **job.stats,
+                "running": job.running,
+                "next_run_in_s": None if job.running else round(job.due - now, 3),
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "timeout_s": self.timeout,
+            "jitter": self.jitter,
+            "running": sum(1 for j in self._jobs.values() if j.running),
+            "jobs": jobs,
+        }
+
+    async def _run_job(self, job: _Job):
+        run = None
+        try:
+            async with self._sem:
+                started = time.monotonic()
+                lag_ms = round((started - job.due) * 1000, 1)
+                job.stats["last_lag_ms"] = lag_ms
+                job.stats["max_lag_ms"] = max(job.stats["max_lag_ms"], lag_ms)
+                job.stats["last_run"] = time.time()
+                run = asyncio.ensure_future(job.fn())
+                try:
+                    # Shielded, so a timeout abandons the run instead of cancelling it
+                    await asyncio.wait_for(asyncio.shield(run), self.timeout)
+                    job.stats["last_error"] = None
+                except asyncio.TimeoutError:
+                    job.stats["failures"] += 1
+                    job.stats["timeouts"] += 1
+                    job.stats["last_error"] = f"timed out after {self.timeout}s"
+                    log.warning(f"[POLL] {job.name}: timed out after {self.timeout}s")
+                except Exception as e:
+                    job.stats["failures"] += 1
+                    job.stats["last_error"] = str(e)
+                    log.error(f"[POLL] {job.name}: {e}")
+                job.stats["runs"] += 1
+                job.stats["last_duration_ms"] = round((time.monotonic() - started) * 1000, 1)
+            if not run.done():
+                # Timed out: stay marked running, outside the concurrency limit, until it ends
+                await asyncio.wait((run,))
+                job.stats["last_duration_ms"] = round((time.monotonic() - started) * 1000, 1)
+                error = None if run.cancelled() else run.exception()
+                log.warning(f"[POLL] {job.name}: timed-out run finished after "
+                            f"{job.stats['last_duration_ms'] / 1000:.1f}s" + (f" ({error})" if error else ""))
+        except asyncio.CancelledError:
+            if run is not None:
+                run.cancel()
+            raise
+        finally:
+            job.running = False
+            self._reschedule(job)
+
+    def _reschedule(self, job: _Job):
+        try:
+            interval = float(job.interval_fn())
+        except Exception as e:
+            log.warning(f"[POLL] {job.name}: bad interval ({e}), using 60s")
+            interval = 60.0
+        interval = max(1.0, interval)
+        job.stats["interval_s"] = interval
+        # Fixed-rate from the previous due time, but never schedule into the past
+        job.due = max(job.due + interval, time.monotonic()) + interval * random.uniform(-self.jitter, self.jitter)
+        self._push(job.name, job.due)
+
+    def _push(self, name: str, due: float):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, name))
+        if self._wake is not None:
+            self._wake.set()
@@ -0,0 +1,79 @@
+"""Content-addressed cache of system prompt breakdowns.
+
+Agents resend the same system prompt on nearly every turn. Breakdowns are
+memoized by a BLAKE2b digest of the joined system text, so a repeated prompt
+costs one hashing pass instead of a full analysis. The digest doubles as the
+prompt's identity in storage: the Postgres backend keeps each distinct prompt
+once in `system_prompts` and usage rows reference it by hash.
+
+The cache is a bounded LRU. Entries are evicted least-recently-used first
+once either `max_entries` or `max_bytes` (UTF-8 size of the cached prompt
+texts) is exceeded. Must be used from a single thread (the event loop).
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable
+
+
+class PromptCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entries: int = 256):
+        self.max_bytes = max(0, max_bytes)
+        self.max_entries = max(0, max_entries)
+        # prompt_hash -> (text, breakdown, size_bytes)
+        self._entries: OrderedDict[str, tuple[str, dict, int]] = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def analyze(self, system_blocks: list[Any], analyze: Callable[[str], dict]) -> tuple[str, str, dict]:
+        """Return (prompt_hash, joined text, breakdown) for `system_blocks`.
+
+        `analyze(text)` is only called on a miss. The returned breakdown is
+        shared with the cache and must not be mutated.
+        """
+        texts = [b.get("text", "") if isinstance(b, dict) else str(b) for b in system_blocks]
+        h = hashlib.blake2b(digest_size=16)
+        size = max(0, len(texts) - 1)
+        for i, text in enumerate(texts):
+            if i:
+                h.update(b"\n")
+            data = text.encode("utf-8", "surrogatepass")
+            h.update(data)
+            size += len(data)
+        key = h.hexdigest()
+
+        hit = self._entries.get(key)
+        if hit is not None:
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return key, hit[0], hit[1]
+
+        self._stats["misses"] += 1
+        joined = "\n".join(texts)
+        result = analyze(joined)
+        if self.max_entries and size <= self.max_bytes:
+            self._entries[key] = (joined, result, size)
+            self._bytes += size
+            self._evict()
+        return key, joined, result
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._stats["evictions"] += 1
@@ -7,17 +7,19 @@ Handles Anthropic-specific request/response formats including:
 """
 
 import json
-import re
 from typing import Any, Dict, List, Optional
 
 from .base import LLMProvider
 from .registry import register_provider
+from .system_prompt import analyze_system_prompt
 
 
 @register_provider("anthropic")
 class AnthropicProvider(LLMProvider):
     """Anthropic Messages API provider (Claude models)."""
     
+    supports_http2 = True
+    
     # Pricing per 1M tokens: {input, output, cache_read, cache_write}
     COST_TABLE = {
         "claude-opus-4-6": {"input": 5.0, "output": 25.0, "cache_read": 0.50, "cache_write": 6.25},
@@ -55,16 +57,9 @@ class AnthropicProvider(LLMProvider):
         return "/v1/messages"
     
     def get_model_pricing(self, model: str) -> Dict[str, float]:
-        """Match model name to pricing table."""
-        model_lower = model.lower()
-        
-        # Try exact prefix matches (longer prefixes first for specificity)
-        for prefix in sorted(self.COST_TABLE.keys(), key=len, reverse=True):
-            if prefix in model_lower:
-                return self.COST_TABLE[prefix]
-        
+        """Match model name to pricing table (longest matching entry wins)."""
         # Default to zero if unknown model
-        return {"input": 0.0, "output": 0.0, "cache_read": 0.0, "cache_write": 0.0}
+        return self.pricing().lookup(model)
     
     def analyze_request(self, body: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze Anthropic request for metrics.
@@ -111,54 +106,13 @@ class AnthropicProvider(LLMProvider):
         - A string (simple)
         - A list of blocks with text and cache_control
         """
-        result = {
-            "system_prompt_total_chars": 0,
-            "base_prompt_chars": 0,
-        }
-        for key in self.WORKSPACE_FILE_MAP.values():
-            result[key] = 0
-        
-        # Convert string to block format
         if isinstance(system, str):
             blocks = [{"type": "text", "text": system}]
         elif isinstance(system, list):
             blocks = system
         else:
-            return result
-        
-        total_chars = 0
-        base_chars = 0
-        workspace_chars = {k: 0 for k in self.WORKSPACE_FILE_MAP.values()}
-        
-        for block in blocks:
-            if not isinstance(block, dict):
-                continue
-            
-            text = block.get("text", "")
-            if not isinstance(text, str):
-                text = str(text)
-            
-            block_len = len(text)
-            total_chars += block_len
-            
-            # Check for workspace file markers
-            matched_workspace = False
-            for filename, metric_key in self.WORKSPACE_FILE_MAP.items():
-                # Look for ## FILENAME patterns
-                if f"## {filename}" in text or f"# {filename}" in text:
-                    workspace_chars[metric_key] += block_len
-                    matched_workspace = True
-                    break
-            
-            if not matched_workspace:
-                base_chars += block_len
-        
-        result["system_prompt_total_chars"] = total_chars
-        result["base_prompt_chars"] = base_chars
-        for key, chars in workspace_chars.items():
-            result[key] = chars
-        
-        return result
+            blocks = []
+        return analyze_system_prompt(blocks, self.WORKSPACE_FILE_MAP)
     
     def _analyze_messages(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Analyze message array for counts and sizes."""
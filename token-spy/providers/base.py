@@ -8,6 +8,9 @@ from abc import ABC, abstractmethod
 from typing import Any, Dict, Optional
 import httpx
 
+from .http_pool import MeteredTransport, PoolConfig, build_client
+from .pricing import PricingIndex, catalog
+
 
 class LLMProvider(ABC):
     """Abstract base for LLM API providers.
@@ -19,15 +22,20 @@ class LLMProvider(ABC):
     - Stream parsing (extracting usage from SSE streams)
     - Cost calculation (pricing per model)
     """
+
+    # Whether the upstream API can be spoken to over HTTP/2
+    supports_http2 = False
     
     def __init__(self, config: Optional[Dict[str, Any]] = None):
         """Initialize provider with optional configuration.
         
         Args:
-            config: Provider-specific configuration (base_url overrides, etc.)
+            config: Provider-specific configuration (base_url overrides,
+                "pool" settings for the upstream connection pool, etc.)
         """
         self.config = config or {}
         self._client: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[MeteredTransport] = None
     
     @property
     @abstractmethod
@@ -134,20 +142,30 @@ class LLMProvider(ABC):
         """Get or create HTTP client with provider-specific config.
         
         Creates a new client if none exists or the existing one is closed.
+        Pool limits, keepalive and HTTP/2 come from config["pool"] (see PoolConfig).
         """
         if self._client is None or self._client.is_closed:
-            self._client = httpx.AsyncClient(
-                base_url=self.base_url,
-                timeout=httpx.Timeout(connect=10.0, read=300.0, write=30.0, pool=30.0),
-                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            self._client, self._transport = build_client(
+                self.base_url, PoolConfig.from_dict(self.config.get("pool")), self.supports_http2,
             )
         return self._client
+
+    def pool_stats(self) -> Optional[Dict[str, Any]]:
+        """Connection pool metrics, or None before the client is created."""
+        if self._transport is None or self._client.is_closed:
+            return None
+        return self._transport.stats()
     
     async def close(self):
         """Close the HTTP client if open."""
         if self._client and not self._client.is_closed:
             await self._client.aclose()
             self._client = None
+            self._transport = None
+    
+    def pricing(self) -> PricingIndex:
+        """Compiled pricing for this provider: COST_TABLE plus pricing-file overrides."""
+        return catalog.index(self.name, getattr(self, "COST_TABLE", {}))
     
     def calculate_cost(self, usage: Dict[str, Any], model: str) -> float:
         """Calculate cost in USD from usage and model.
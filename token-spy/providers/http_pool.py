@@ -0,0 +1,171 @@
+"""Per-provider upstream connection pools with saturation metrics.
+
+Each provider instance owns one httpx.AsyncClient whose pool is sized from
+its config ("pool" key, see PoolConfig). HTTP/2 is used when the provider
+supports it and the `h2` package is installed, so concurrent streams to
+one upstream share a few connections instead of each holding its own.
+
+MeteredTransport wraps the client's transport and records, per pool:
+in-flight requests (counted until the response body is closed, so a long
+stream occupies its slot for its whole duration), how often a request
+started while the pool was already full, new connections and their
+connect time, and how long requests waited for a connection.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+log = logging.getLogger("token-monitor")
+_h2_warned = False
+
+
+@dataclass
+class PoolConfig:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    http2: bool = True
+    connect_timeout: float = 10.0
+    read_timeout: float = 300.0
+    write_timeout: float = 30.0
+    pool_timeout: float = 30.0
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "PoolConfig":
+        """Build from a config dict, ignoring unknown keys."""
+        known = {f.name for f in fields(cls)}
+        cfg = cls()
+        for key, value in (data or {}).items():
+            if key not in known or value is None:
+                continue
+            default = getattr(cfg, key)
+            if isinstance(default, bool) and isinstance(value, str):
+                value = value.lower() in ("1", "true", "yes")
+            setattr(cfg, key, type(default)(value))
+        return cfg
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout, read=self.read_timeout,
+            write=self.write_timeout, pool=self.pool_timeout,
+        )
+
+
+class _MeteredStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, transport: "MeteredTransport"):
+        self._stream = stream
+        self._transport = transport
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._transport._release()
+        await self._stream.aclose()
+
+
+class MeteredTransport(httpx.AsyncBaseTransport):
+    """An AsyncHTTPTransport that keeps pool usage counters."""
+
+    def __init__(self, config: PoolConfig, http2: bool):
+        self.config = config
+        self.http2 = http2
+        self._transport = httpx.AsyncHTTPTransport(limits=config.limits(), http2=http2)
+        self.in_flight = 0
+        self._stats = {
+            "requests": 0, "errors": 0, "max_in_flight": 0, "saturated_requests": 0,
+            "new_connections": 0, "connect_ms_total": 0.0,
+            "wait_ms_total": 0.0, "wait_ms_max": 0.0, "last_wait_ms": 0.0,
+        }
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        timing = {"connect": 0.0, "sent": None}
+        if self.in_flight >= self.config.max_connections and not self.http2:
+            self._stats["saturated_requests"] += 1
+        self.in_flight += 1
+        self._stats["requests"] += 1
+        self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self.in_flight)
+
+        async def trace(event: str, info: dict):
+            # httpcore trace events; see httpcore's "trace" request extension
+            if event == "connection.connect_tcp.started":
+                timing["connect_started"] = time.perf_counter()
+            elif event in ("connection.start_tls.complete", "connection.connect_tcp.complete") \
+                    and "connect_started" in timing:
+                timing["connect"] = time.perf_counter() - timing["connect_started"]
+            elif event.endswith(".send_request_headers.started") and timing["sent"] is None:
+                timing["sent"] = time.perf_counter()
+
+        request.extensions = {**request.extensions, "trace": trace}
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._stats["errors"] += 1
+            self._release()
+            raise
+        if timing["sent"] is not None:
+            if "connect_started" in timing:
+                self._stats["new_connections"] += 1
+                self._stats["connect_ms_total"] += timing["connect"] * 1000
+            wait_ms = max(0.0, (timing["sent"] - started - timing["connect"]) * 1000)
+            self._stats["wait_ms_total"] += wait_ms
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], wait_ms)
+            self._stats["last_wait_ms"] = round(wait_ms, 2)
+        response.stream = _MeteredStream(response.stream, self)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+    def stats(self) -> dict:
+        requests = self._stats["requests"] or 1
+        return {
+            **self._stats,
+            "connect_ms_total": round(self._stats["connect_ms_total"], 1),
+            "wait_ms_total": round(self._stats["wait_ms_total"], 1),
+            "wait_ms_max": round(self._stats["wait_ms_max"], 2),
+            "avg_wait_ms": round(self._stats["wait_ms_total"] / requests, 3),
+            "in_flight": self.in_flight,
+            "max_connections": self.config.max_connections,
+            "max_keepalive_connections": self.config.max_keepalive_connections,
+            "keepalive_expiry_s": self.config.keepalive_expiry,
+            "http2": self.http2,
+        }
+
+    def _release(self):
+        self.in_flight -= 1
+
+
+def build_client(base_url: str, config: PoolConfig,
+                 supports_http2: bool) -> Tuple[httpx.AsyncClient, MeteredTransport]:
+    """An AsyncClient for one upstream, and the metered transport its pool runs on."""
+    global _h2_warned
+    if config.http2 and supports_http2 and not H2_AVAILABLE and not _h2_warned:
+        _h2_warned = True
+        log.warning("[POOL] HTTP/2 requested but the h2 package is missing (pip install 'httpx[http2]'); "
+                    "upstreams will use HTTP/1.1")
+    transport = MeteredTransport(config, http2=config.http2 and supports_http2 and H2_AVAILABLE)
+    client = httpx.AsyncClient(base_url=base_url, timeout=config.timeout(), transport=transport)
+    return client, transport
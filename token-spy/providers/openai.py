@@ -24,6 +24,9 @@ class OpenAICompatibleProvider(LLMProvider):
     - Any other OpenAI-compatible service
     """
     
+    # HTTP/2 is negotiated via TLS ALPN, so plain-HTTP upstreams stay on HTTP/1.1
+    supports_http2 = True
+    
     # Pricing per 1M tokens: {input, output, cache_read, cache_write}
     # cache_read/write are 0 for providers that don't support caching
     COST_TABLE = {
@@ -64,16 +67,9 @@ class OpenAICompatibleProvider(LLMProvider):
         return "/v1/chat/completions"
     
     def get_model_pricing(self, model: str) -> Dict[str, float]:
-        """Match model name to pricing table."""
-        model_lower = model.lower()
-        
-        # Try exact prefix matches (longer prefixes first for specificity)
-        for prefix in sorted(self.COST_TABLE.keys(), key=len, reverse=True):
-            if prefix in model_lower:
-                return self.COST_TABLE[prefix]
-        
+        """Match model name to pricing table (longest matching entry wins)."""
         # Default to zero for unknown models (likely local)
-        return {"input": 0.0, "output": 0.0, "cache_read": 0.0, "cache_write": 0.0}
+        return self.pricing().lookup(model)
     
     def analyze_request(self, body: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze OpenAI-format request for metrics."""
@@ -248,6 +244,8 @@ class LocalProvider(OpenAICompatibleProvider):
     Same as OpenAI-compatible but defaults to localhost and zero costs.
     """
     
+    supports_http2 = False
+    
     @property
     def name(self) -> str:
         return "local"
@@ -0,0 +1,241 @@
+"""Compiled model pricing lookup, shared by the providers and estimate_cost.
+
+Pricing tables map a model-name fragment to per-1M-token rates; a model
+is priced by the longest fragment its (lowercased) name contains, ties going
+to the earlier table entry. Scanning the table for every turn was linear in
+its size and, for the legacy COST_PER_MILLION fallback, depended on dict
+order ("gpt-4o" was listed first and matched "gpt-4o-mini"). PricingIndex
+compiles a table into a trie once, walks it from each offset of the name,
+and memoizes the result per model string, so steady-state lookups are a
+dict hit.
+
+PricingCatalog holds one index per provider. Entries from an optional
+pricing file override and extend the built-in tables:
+
+    {"anthropic": {"claude-sonnet-4": {"input": 3.0, "output": 15.0,
+                                       "cache_read": 0.3, "cache_write": 3.75}},
+     "openai": {...}}
+
+The file is re-checked at most every `check_interval` seconds and the
+indexes rebuilt when it changes; `version` counts rebuilds so callers can
+tell prices moved. cost_many() prices whole token columns at once (with
+NumPy when installed), for re-costing stored rows.
+
+COST_PER_MILLION is the table for providers that are not registered
+("default" in the pricing file); ProviderRegistry.pricing() picks between
+the two, so live turns and re-costed rows resolve prices the same way.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RATE_KEYS = ("input", "output", "cache_read", "cache_write")
+ZERO_RATES = {"input": 0.0, "output": 0.0, "cache_read": 0.0, "cache_write": 0.0}
+
+_MEMO_MAX = 4096
+
+
+class PricingIndex:
+    """Longest-fragment lookup over one pricing table. Thread-safe."""
+
+    def __init__(self, table: Dict[str, Dict[str, float]], default: Optional[Dict[str, float]] = None):
+        self.default = default or ZERO_RATES
+        self.table = dict(table)
+        # Trie of dicts keyed by character; the "" key holds (length, order, rates)
+        self._root: Dict[str, Any] = {}
+        for order, (fragment, rates) in enumerate(table.items()):
+            node = self._root
+            for ch in fragment.lower():
+                node = node.setdefault(ch, {})
+            if "" not in node:
+                node[""] = (len(fragment), order, {k: float(rates.get(k, 0.0)) for k in RATE_KEYS})
+        self._memo: Dict[Optional[str], Dict[str, float]] = {}
+        self.size = len(table)
+
+    def lookup(self, model: Optional[str]) -> Dict[str, float]:
+        """Rates per 1M tokens for `model` (the default when nothing matches). Do not mutate."""
+        rates = self._memo.get(model)
+        if rates is None:
+            rates = self._match((model or "").lower())
+            if len(self._memo) >= _MEMO_MAX:
+                self._memo.clear()
+            self._memo[model] = rates
+        return rates
+
+    def cost(self, usage: Dict[str, Any], model: Optional[str]) -> float:
+        rates = self.lookup(model)
+        return (
+            (usage.get("input_tokens") or 0) * rates["input"] / 1_000_000
+            + (usage.get("output_tokens") or 0) * rates["output"] / 1_000_000
+            + (usage.get("cache_read_tokens") or 0) * rates["cache_read"] / 1_000_000
+            + (usage.get("cache_write_tokens") or 0) * rates["cache_write"] / 1_000_000
+        )
+
+    def cost_many(self, models: Sequence[Optional[str]], input_tokens: Sequence,
+                  output_tokens: Sequence, cache_read: Sequence, cache_write: Sequence) -> List[float]:
+        """Costs in USD for rows given as columns (None tokens count as 0).
+
+        Rates are looked up once per distinct model; the arithmetic runs over
+        whole columns, in the same order as cost() so results are identical.
+        """
+        n = len(models)
+        if not n:
+            return []
+        distinct = {m: self.lookup(m) for m in set(models)}
+        columns = (input_tokens, output_tokens, cache_read, cache_write)
+        if np is not None:
+            total = np.zeros(n)
+            for key, col in zip(RATE_KEYS, columns):
+                tokens = np.array([t or 0 for t in col], dtype=np.float64)
+                rates = np.fromiter((distinct[m][key] for m in models), dtype=np.float64, count=n)
+                total += tokens * rates / 1_000_000
+            return total.tolist()
+        rows = [distinct[m] for m in models]
+        total = [0.0] * n
+        for key, col in zip(RATE_KEYS, columns):
+            total = [acc + (t or 0) * r[key] / 1_000_000 for acc, t, r in zip(total, col, rows)]
+        return total
+
+    def _match(self, name: str) -> Dict[str, float]:
+        best = None
+        root = self._root
+        for start in range(len(name)):
+            node = root.get(name[start])
+            i = start + 1
+            while node is not None:
+                hit = node.get("")
+                if hit is not None and (best is None or hit[0] > best[0]
+                                        or (hit[0] == best[0] and hit[1] < best[1])):
+                    best = hit
+                if i == len(name):
+                    break
+                node = node.get(name[i])
+                i += 1
+        return best[2] if best is not None else self.default
+
+
+class PricingCatalog:
+    """Per-provider PricingIndexes, with overrides from a hot-reloaded pricing file."""
+
+    def __init__(self, path: str = "", check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.version = 0
+        self._overrides: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._indexes: Dict[str, PricingIndex] = {}
+        self._key = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+        self._stats = {"reloads": 0, "reload_errors": 0}
+
+    def configure(self, path: str, check_interval: Optional[float] = None):
+        with self._lock:
+            self.path = path
+            if check_interval is not None:
+                self.check_interval = check_interval
+            self._key = None
+            self._checked = float("-inf")
+
+    def index(self, provider: str, table: Dict[str, Dict[str, float]]) -> PricingIndex:
+        """The index for `provider`: its built-in `table` plus any file overrides."""
+        if self.path and time.monotonic() - self._checked >= self.check_interval:
+            with self._lock:
+                self._refresh()
+        index = self._indexes.get(provider)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(provider)
+                if index is None:
+                    index = self._indexes[provider] = PricingIndex(
+                        {**table, **self._overrides.get(provider, {})}
+                    )
+        return index
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "path": self.path or None,
+            "version": self.version,
+            "indexes": {name: idx.size for name, idx in self._indexes.items()},
+        }
+
+    def _refresh(self):
+        self._checked = time.monotonic()
+        try:
+            st = os.stat(self.path)
+            key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            key = None
+        if key == self._key:
+            return
+        overrides = {}
+        if key is not None:
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                # Keep the current prices until the file parses again
+                self._stats["reload_errors"] += 1
+                return
+            if isinstance(data, dict):
+                overrides = {
+                    provider: {f: r for f, r in table.items() if isinstance(r, dict)}
+                    for provider, table in data.items() if isinstance(table, dict)
+                }
+        self._key = key
+        if overrides != self._overrides:
+            self._overrides = overrides
+            self._indexes = {}
+            self.version += 1
+            self._stats["reloads"] += 1
+
+
+# Cost per million tokens by model name fragment (longest match wins), used
+# when the provider is unknown ("default" in the pricing file)
+# USD per 1M tokens — input, output, cache_read, cache_write
+COST_PER_MILLION = {
+    # Anthropic Claude models
+    "claude-opus-4-6": {"input": 5.0, "output": 25.0, "cache_read": 0.50, "cache_write": 6.25},
+    "claude-opus-4-5": {"input": 5.0, "output": 25.0, "cache_read": 0.50, "cache_write": 6.25},
+    "claude-opus-4-1": {"input": 15.0, "output": 75.0, "cache_read": 1.50, "cache_write": 18.75},
+    "claude-opus-4": {"input": 15.0, "output": 75.0, "cache_read": 1.50, "cache_write": 18.75},
+    "claude-sonnet-4": {"input": 3.0, "output": 15.0, "cache_read": 0.30, "cache_write": 3.75},
+    "claude-haiku-4-5": {"input": 1.0, "output": 5.0, "cache_read": 0.10, "cache_write": 1.25},
+    "claude-haiku-3-5": {"input": 0.80, "output": 4.0, "cache_read": 0.08, "cache_write": 1.0},
+    "claude-haiku": {"input": 0.80, "output": 4.0, "cache_read": 0.08, "cache_write": 1.0},
+    # Moonshot Kimi models
+    "kimi-k2-0711": {"input": 0.60, "output": 3.0, "cache_read": 0.10, "cache_write": 0.60},
+    "kimi-k2-0905": {"input": 0.60, "output": 2.50, "cache_read": 0.15, "cache_write": 0.60},
+    "kimi-k2-thinking": {"input": 0.60, "output": 2.50, "cache_read": 0.15, "cache_write": 0.60},
+    "kimi-k2": {"input": 0.60, "output": 2.50, "cache_read": 0.15, "cache_write": 0.60},
+    # OpenAI models
+    "gpt-4o": {"input": 2.50, "output": 10.0, "cache_read": 1.25, "cache_write": 0},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60, "cache_read": 0.075, "cache_write": 0},
+    "gpt-4-turbo": {"input": 10.0, "output": 30.0, "cache_read": 0, "cache_write": 0},
+    "gpt-4": {"input": 30.0, "output": 60.0, "cache_read": 0, "cache_write": 0},
+    "gpt-3.5-turbo": {"input": 0.50, "output": 1.50, "cache_read": 0, "cache_write": 0},
+}
+
+
+def provider_for_model(model: Optional[str]) -> str:
+    """Provider whose prices a turn is charged at when the endpoint doesn't say."""
+    model_lower = (model or "").lower()
+    if "claude" in model_lower:
+        return "anthropic"
+    elif "kimi" in model_lower:
+        return "openai"  # Moonshot uses OpenAI-compatible format
+    elif "gpt" in model_lower:
+        return "openai"
+    return "anthropic"  # default
+
+
+# Shared by every provider instance
+catalog = PricingCatalog()
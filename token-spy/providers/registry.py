@@ -3,6 +3,7 @@
 from typing import Any, Dict, List, Optional, Type
 
 from .base import LLMProvider
+from .pricing import COST_PER_MILLION, PricingIndex, catalog
 
 
 class ProviderRegistry:
@@ -68,6 +69,17 @@ class ProviderRegistry:
         except ValueError:
             return None
     
+    @classmethod
+    def pricing(cls, name: str) -> PricingIndex:
+        """Pricing for turns charged to provider `name`.
+
+        Falls back to COST_PER_MILLION when no such provider is registered.
+        """
+        provider = cls.get_or_none(name)
+        if provider is not None:
+            return provider.pricing()
+        return catalog.index("default", COST_PER_MILLION)
+    
     @classmethod
     def list_providers(cls) -> List[str]:
         """List all registered provider names."""
@@ -0,0 +1,134 @@
+"""One-pass system prompt breakdown.
+
+OpenClaw injects workspace files into the system prompt under a
+"# Project Context" heading as "## FILENAME.md\n\n<file content>", followed by
+sections such as "## Silent Replies" / "## Heartbeats" / "## Runtime", plus a
+"## Skills (mandatory)" block. File content can contain its own ## headings,
+so a file's size is measured from its marker to the next *known* marker.
+
+A single precompiled regex sweeps every heading line once; markers are
+classified with set/dict lookups instead of compiling and running one regex
+per workspace file and end marker.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Sections that follow the workspace files and end the last file's content
+END_MARKERS = ("Silent Replies", "Heartbeats", "Runtime")
+SKILLS_HEADING = "Skills (mandatory)"
+
+# Group 1 is None for the "# Project Context" heading, else the "## " heading text
+_HEADING_RE = re.compile(r"^(?:# Project Context\b|## ([^\n]*))", re.MULTILINE)
+
+
+def join_system_blocks(system_blocks: List[Any]) -> str:
+    """Combine all system text blocks the way the breakdown measures them."""
+    return "\n".join(
+        b.get("text", "") if isinstance(b, dict) else str(b)
+        for b in system_blocks
+    )
+
+
+def analyze_system_prompt(system_blocks: List[Any], file_map: Dict[str, str]) -> Dict[str, int]:
+    """Break down the system prompt into source categories.
+
+    Args:
+        system_blocks: Anthropic-style system blocks (dicts with "text") or strings
+        file_map: Workspace filename -> result column (e.g. "SOUL.md" -> "workspace_soul_chars")
+    """
+    if not system_blocks:
+        return {"system_prompt_total_chars": 0, "base_prompt_chars": 0}
+    return analyze_system_text(join_system_blocks(system_blocks), file_map)
+
+
+def analyze_system_text(text: str, file_map: Dict[str, str]) -> Dict[str, int]:
+    """Same as analyze_system_prompt, for already-joined text."""
+    result = {"system_prompt_total_chars": len(text)}
+    for col in file_map.values():
+        result.setdefault(col, 0)
+
+    markers, skills = scan_sections(text, file_map)
+
+    # Measure each file's content: from content_start to the next marker's start
+    for i, (pos, content_start, fname) in enumerate(markers):
+        if fname is None:
+            continue  # end marker
+        content_end = markers[i + 1][0] if i + 1 < len(markers) else len(text)
+        result[file_map[fname]] += max(0, content_end - content_start)
+
+    result["skill_injection_chars"] = skills[1] - skills[0] if skills else 0
+
+    # Base prompt = total minus workspace files and skills
+    accounted = sum(
+        v for k, v in result.items()
+        if k.startswith("workspace_") or k == "skill_injection_chars"
+    )
+    result["base_prompt_chars"] = max(0, result["system_prompt_total_chars"] - accounted)
+    return result
+
+
+def scan_sections(
+    text: str, file_map: Dict[str, str]
+) -> Tuple[List[Tuple[int, int, Optional[str]]], Optional[Tuple[int, int]]]:
+    """Locate workspace file / end markers and the skills block in one sweep.
+
+    Returns:
+        markers: (marker_start, content_start, filename or None for end markers),
+            first occurrence of each marker after "# Project Context", in order
+        skills: (start, end) of the first "## Skills (mandatory)" block, or None
+    """
+    n = len(text)
+    in_context = False
+    seen = set()
+    markers: List[Tuple[int, int, Optional[str]]] = []
+    skills_start = skills_end = None
+
+    for m in _HEADING_RE.finditer(text):
+        heading = m.group(1)
+        if heading is None:
+            in_context = True
+            continue
+        start = m.start()
+        # Any "## " heading ends the skills block
+        if skills_start is not None and skills_end is None:
+            skills_end = start
+        if skills_start is None and heading == SKILLS_HEADING and m.end() < n:
+            skills_start = start
+            continue
+        if not in_context:
+            continue
+
+        name = heading.rstrip()
+        if name in file_map:
+            if name not in seen:
+                seen.add(name)
+                markers.append((start, _content_start(text, m.end()), name))
+            continue
+        for marker in END_MARKERS:
+            if marker not in seen and heading.startswith(marker) and _ends_word(heading, len(marker)):
+                seen.add(marker)
+                markers.append((start, start, None))
+                break
+
+    if skills_start is None:
+        return markers, None
+    return markers, (skills_start, n if skills_end is None else skills_end)
+
+
+def _content_start(text: str, line_end: int) -> int:
+    """Where a file's content begins after its "## FILE.md" header line.
+
+    Skips the header's newline and any blank lines after it.
+    """
+    n = len(text)
+    j = line_end
+    while j < n and text[j].isspace():
+        j += 1
+    last_nl = n if j == n else text.rfind("\n", line_end, j)
+    return last_nl + 1
+
+
+def _ends_word(s: str, i: int) -> bool:
+    """Regex \\b semantics after a marker that ends in a word character."""
+    return i >= len(s) or not (s[i].isalnum() or s[i] == "_")
@@ -0,0 +1,176 @@
+"""Recompute stored estimated_cost_usd values with the current pricing.
+
+Costs are computed when a turn is logged, so a pricing change (a provider's
+COST_TABLE, COST_PER_MILLION or the PRICING_PATH file) leaves older rows
+priced at the old rates. This re-prices every row in chunks: each chunk is
+read as columns, priced one provider at a time (PricingIndex.cost_many,
+NumPy when installed), and only rows whose cost changed are written back, in one short
+transaction per chunk, so it can run while token-spy keeps writing:
+
+    python3 recost.py [--db data/usage.db] [--chunk 20000] [--dry-run]
+    DB_BACKEND=postgres python3 recost.py
+
+Progress is checkpointed to a JSON file after every chunk; an interrupted
+run resumes from there. The checkpoint records a fingerprint of the prices
+used, and a run with different prices starts over. Re-running a chunk is
+harmless: costs are compared with what is stored, so nothing is applied
+twice (for SQLite the rollups are adjusted by the same per-row deltas).
+
+Rows do not record the endpoint a turn came through, so each row is
+charged to the provider _log_entry infers from the model name
+(provider_for_model) and priced through ProviderRegistry.pricing, with the
+same COST_PER_MILLION fallback. A model sent to the other provider's
+endpoint (say a gpt-* model on /v1/messages) was priced at that endpoint's
+rates when logged and is re-priced at the inferred provider's. Not updated: rollup buckets whose raw rows
+retention already deleted, the current-session cost in session_state, and
+a running instance's hot store (until restart).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+from providers import ProviderRegistry
+from providers.pricing import PricingIndex, catalog, provider_for_model
+
+
+def build_pricing() -> dict[str, PricingIndex]:
+    """The indexes turns are priced with, by the provider names provider_for_model returns."""
+    return {name: ProviderRegistry.pricing(name) for name in ("anthropic", "openai")}
+
+
+def fingerprint(pricing: dict[str, PricingIndex]) -> str:
+    tables = {name: index.table for name, index in pricing.items()}
+    return hashlib.sha256(json.dumps(tables, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_checkpoint(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(path: str, state: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def price_columns(pricing: dict[str, PricingIndex], cols: dict) -> list[float]:
+    """Costs for a chunk's rows, each priced by the provider its model infers."""
+    providers = {m: provider_for_model(m) for m in set(cols["model"])}
+    groups: dict[str, list[int]] = {}
+    for i, model in enumerate(cols["model"]):
+        groups.setdefault(providers[model], []).append(i)
+    costs = [0.0] * len(cols["model"])
+    keys = ("model", "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens")
+    for provider, rows in groups.items():
+        priced = pricing[provider].cost_many(*([cols[k][i] for i in rows] for k in keys))
+        for i, cost in zip(rows, priced):
+            costs[i] = cost
+    return costs
+
+
+def recost_chunk(backend, pricing: dict[str, PricingIndex], after, limit: int, dry_run: bool):
+    """Re-price one chunk. Returns (rows read, rows changed, cost delta, next checkpoint)."""
+    cols, last = backend.fetch_cost_columns(after, limit)
+    if not cols:
+        return 0, 0, 0.0, after
+    costs = price_columns(pricing, cols)
+    changes = []
+    for i, cost in enumerate(costs):
+        # Stored like _log_entry stores them
+        cost = round(cost, 6)
+        old = cols["estimated_cost_usd"][i]
+        if old is None or abs(cost - old) > 5e-7:
+            changes.append((cols["id"][i], cols["timestamp"][i], cols["agent"][i], cost, old))
+    if not dry_run:
+        backend.update_costs(changes)
+    delta = sum(new - (old or 0) for _, _, _, new, old in changes)
+    return len(costs), len(changes), delta, last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default=os.environ.get("DB_BACKEND", "sqlite"),
+                        help="sqlite or postgres (default: DB_BACKEND)")
+    parser.add_argument("--db", help="SQLite database path (default: DB_PATH)")
+    parser.add_argument("--chunk", type=int, default=20000, help="rows per chunk")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: next to the database)")
+    parser.add_argument("--pricing", default=os.environ.get(
+                            "PRICING_PATH", os.path.join(os.path.dirname(__file__), "data", "pricing.json")),
+                        help="pricing overrides file (default: PRICING_PATH)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="report changes without writing")
+    parser.add_argument("--pause-ms", type=float, default=0, help="sleep between chunks")
+    args = parser.parse_args()
+
+    if args.backend.startswith("postgres"):
+        # The async backend shares the schema; the job uses the sync driver
+        import db_postgres as backend
+        target = f"postgres://{backend.DB_HOST}:{backend.DB_PORT}/{backend.DB_NAME}"
+        default_checkpoint = os.path.join(os.path.dirname(__file__), "data", "recost.postgres.json")
+    else:
+        import db as backend
+        if args.db:
+            backend.DB_PATH = args.db
+        if not os.path.exists(backend.DB_PATH):
+            sys.exit(f"no database at {backend.DB_PATH}")
+        target = backend.DB_PATH
+        default_checkpoint = f"{backend.DB_PATH}.recost.json"
+    backend.init_db()
+
+    if args.pricing:
+        catalog.configure(args.pricing)
+    pricing = build_pricing()
+    prices = fingerprint(pricing)
+    checkpoint_path = args.checkpoint or default_checkpoint
+
+    state = {} if args.restart else load_checkpoint(checkpoint_path)
+    if state and (state.get("target") != target or state.get("prices") != prices):
+        print(f"checkpoint {checkpoint_path} is for other prices or another database; starting over")
+        state = {}
+    if state.get("done"):
+        print(f"{target}: already recomputed with these prices (use --restart to run again)")
+        return
+    if not state:
+        state = {"target": target, "prices": prices, "after": None,
+                 "rows": 0, "changed": 0, "delta_usd": 0.0, "done": False}
+    elif state["after"] is not None:
+        print(f"resuming after {state['after']} ({state['rows']:,} rows done)")
+
+    mode = " (dry run)" if args.dry_run else ""
+    print(f"{target}: recomputing costs, prices {prices}{mode}")
+    started, rows = time.monotonic(), 0
+    while True:
+        n, changed, delta, state["after"] = recost_chunk(
+            backend, pricing, state["after"], args.chunk, args.dry_run
+        )
+        if not n:
+            break
+        rows += n
+        state["rows"] += n
+        state["changed"] += changed
+        state["delta_usd"] += delta
+        if not args.dry_run:
+            save_checkpoint(checkpoint_path, state)
+        rate = rows / max(time.monotonic() - started, 1e-9)
+        print(f"  {state['rows']:,} rows, {state['changed']:,} changed ({rate:,.0f} rows/s)", flush=True)
+        if args.pause_ms:
+            time.sleep(args.pause_ms / 1000)
+    state["done"] = True
+    if not args.dry_run:
+        save_checkpoint(checkpoint_path, state)
+    print(f"done: {state['rows']:,} rows, {state['changed']:,} changed, "
+          f"total cost {state['delta_usd']:+,.6f} USD, {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
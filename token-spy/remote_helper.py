@@ -0,0 +1,257 @@
+"""Remote-side helper for polling agents on other hosts.
+
+Started once per host over a single long-lived SSH session (see
+remote_transport.py) and kept running; requests and responses are
+line-delimited JSON on stdin/stdout:
+
+    -> {"id": 1, "op": "status", "sessions_dir": "/path"}
+    <- {"id": 1, "ok": true, "result": {...}}
+
+The first line written is {"id": 0, "ready": true} once the helper is up.
+
+Because the helper is resident, it tails session files instead of re-reading
+them: per file it keeps the offset of the last complete line and running
+counters, so a status call only parses bytes appended since the previous one.
+A file that was replaced, truncated or rewritten in place is rescanned.
+
+`watch` registers a sessions directory with a background thread that
+re-checks it every `interval` seconds and pushes an event line only when its
+counters change, so an idle session costs nothing on either end:
+
+    <- {"id": null, "event": "status", "sessions_dir": "/path", "result": {...}}
+
+Stdlib only and Python 3.6 compatible, since it runs on the remote host's
+interpreter. It can also be run locally as a stand-in for a remote host.
+"""
+
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+PROTOCOL_VERSION = 2
+
+_READ_CHUNK = 1 << 20
+_ANCHOR_BYTES = 64
+
+
+def _line_counts(line):
+    """(user_turns, tool_results, content_chars) for one JSONL line."""
+    try:
+        d = json.loads(line)
+        if d.get("type") != "message":
+            return None
+        msg = d.get("message", {})
+        if isinstance(msg, str):
+            msg = json.loads(msg)
+        role = msg.get("role", "")
+        tool = 1 if role in ("toolResult", "tool") or msg.get("tool_call_id") else 0
+        c = msg.get("content", "")
+        if isinstance(c, list):
+            chars = sum(len(str(x)) for x in c)
+        elif isinstance(c, str):
+            chars = len(c)
+        else:
+            chars = 0
+        return (1 if role == "user" else 0, tool, chars)
+    except Exception:
+        return None
+
+
+class _Tail(object):
+    __slots__ = ("inode", "head", "anchor", "offset", "lines", "counts")
+
+    def __init__(self, inode, head):
+        self.inode = inode
+        self.head = head
+        self.anchor = b""
+        self.offset = 0
+        self.lines = 0
+        self.counts = [0, 0, 0]
+
+
+class SessionTailer(object):
+    """Running counters per session file, advanced by reading appended bytes."""
+
+    def __init__(self):
+        self._tails = {}
+        self._lock = threading.Lock()
+
+    def status(self, sessions_dir):
+        with self._lock:
+            mtimes = {}
+            for path in glob.glob(os.path.join(sessions_dir, "*.jsonl")):
+                try:
+                    mtimes[path] = os.path.getmtime(path)
+                except OSError:
+                    pass
+            for path in [p for p in self._tails if os.path.dirname(p) == sessions_dir and p not in mtimes]:
+                del self._tails[path]
+            if not mtimes:
+                return {"turns": 0, "chars": 0, "files": 0}
+            newest = max(mtimes, key=mtimes.get)
+            result = self._scan(newest)
+            result["files"] = len(mtimes)
+            return result
+
+    def _scan(self, path):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            head = f.read(_ANCHOR_BYTES)
+            tail = self._tails.get(path)
+            if tail is not None and tail.anchor:
+                f.seek(tail.offset - len(tail.anchor))
+                anchor = f.read(len(tail.anchor))
+            else:
+                anchor = b""
+            if (
+                tail is None
+                or tail.inode != st.st_ino
+                or st.st_size < tail.offset
+                or head[:len(tail.head)] != tail.head
+                or anchor != tail.anchor
+            ):
+                tail = self._tails[path] = _Tail(st.st_ino, head)
+            elif len(tail.head) < _ANCHOR_BYTES:
+                tail.head = head
+            f.seek(tail.offset)
+            pending = b""
+            while True:
+                chunk = f.read(_READ_CHUNK)
+                if not chunk:
+                    break
+                data = pending + chunk if pending else chunk
+                nl = data.rfind(b"\n")
+                if nl < 0:
+                    pending = data
+                    continue
+                for line in data[:nl].decode("utf-8", "replace").split("\n"):
+                    tail.lines += 1
+                    counts = _line_counts(line)
+                    if counts:
+                        tail.counts = [a + b for a, b in zip(tail.counts, counts)]
+                tail.offset += nl + 1
+                tail.anchor = data[max(0, nl + 1 - _ANCHOR_BYTES):nl + 1]
+                pending = data[nl + 1:]
+
+        # A trailing line still being written counts now but isn't committed
+        counts, lines = tail.counts, tail.lines
+        if pending:
+            lines += 1
+            extra = _line_counts(pending.decode("utf-8", "replace"))
+            if extra:
+                counts = [a + b for a, b in zip(counts, extra)]
+        return {
+            "turns": counts[0],
+            "chars": counts[2],
+            "tool_results": counts[1],
+            "file_bytes": st.st_size,
+            "total_lines": lines,
+        }
+
+
+_tailer = SessionTailer()
+_watches = {}  # sessions_dir -> [interval, next_due, last_result]
+_watch_lock = threading.Lock()
+_send_lock = threading.Lock()
+
+
+def op_status(sessions_dir):
+    return _tailer.status(sessions_dir)
+
+
+def op_watch(sessions_dir, interval=5.0):
+    interval = max(0.5, float(interval))
+    result = _tailer.status(sessions_dir)
+    with _watch_lock:
+        _watches[sessions_dir] = [interval, time.time() + interval, result]
+    return result
+
+
+def op_unwatch(sessions_dir):
+    with _watch_lock:
+        return {"watching": _watches.pop(sessions_dir, None) is not None}
+
+
+def op_kill(sessions_dir):
+    files = sorted(glob.glob(os.path.join(sessions_dir, "*.jsonl")), key=os.path.getsize, reverse=True)
+    if not files:
+        return {"action": "none", "reason": "no sessions"}
+    f = files[0]
+    size = os.path.getsize(f)
+    sid = os.path.basename(f).replace(".jsonl", "")
+    os.remove(f)
+    sj = os.path.join(sessions_dir, "sessions.json")
+    try:
+        with open(sj) as fh:
+            data = json.load(fh)
+        for k in list(data.keys()):
+            if isinstance(data[k], dict) and data[k].get("sessionId") == sid:
+                del data[k]
+        with open(sj, "w") as fh:
+            json.dump(data, fh, indent=2)
+    except Exception:
+        pass
+    return {"action": "killed", "session_id": sid, "size_bytes": size}
+
+
+OPS = {
+    "status": op_status,
+    "watch": op_watch,
+    "unwatch": op_unwatch,
+    "kill": op_kill,
+}
+
+
+def _send(obj):
+    line = json.dumps(obj) + "\n"
+    with _send_lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+
+def _watch_loop():
+    while True:
+        now = time.time()
+        with _watch_lock:
+            due = [(d, w[0]) for d, w in _watches.items() if w[1] <= now]
+            wake = min([w[1] for w in _watches.values()] + [now + 1.0])
+        for sessions_dir, interval in due:
+            try:
+                result = _tailer.status(sessions_dir)
+            except Exception as e:
+                result = {"error": "%s: %s" % (type(e).__name__, e)}
+            with _watch_lock:
+                w = _watches.get(sessions_dir)
+                if w is None:
+                    continue
+                w[1] = time.time() + interval
+                changed = result != w[2]
+                w[2] = result
+            if changed:
+                _send({"id": None, "event": "status", "sessions_dir": sessions_dir, "result": result})
+        time.sleep(max(0.05, min(wake, now + 1.0) - time.time()))
+
+
+def main():
+    watcher = threading.Thread(target=_watch_loop, name="watch")
+    watcher.daemon = True
+    watcher.start()
+    _send({"id": 0, "ready": True, "version": PROTOCOL_VERSION})
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        req_id = None
+        try:
+            req = json.loads(line)
+            req_id = req.pop("id", None)
+            op = OPS[req.pop("op")]
+            _send({"id": req_id, "ok": True, "result": op(**req)})
+        except Exception as e:
+            _send({"id": req_id, "ok": False, "error": "%s: %s" % (type(e).__name__, e)})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""Persistent transport to remote agent hosts.
+
+Remote polling used to spawn a fresh `ssh` per call (new TCP connection and
+key exchange) and ship a Python script each time, blocking the event loop
+in `subprocess.run`. Instead, one long-lived helper process is kept per host:
+SSH is started once, `remote_helper.py` is sent as the first stdin line, and
+requests are multiplexed over the same session as line-delimited JSON with
+ids, so concurrent requests to one host share the connection and a whole
+fleet can be polled concurrently with asyncio.
+
+A helper that exits, times out or fails to start is discarded and restarted
+on the next request.
+
+Session status is watched rather than polled: the first `status` call for a
+sessions directory registers a watch, after which the helper tails the
+directory itself and pushes an event only when its counters change. Later
+calls return the last pushed result without a round trip, refreshing it
+explicitly only if nothing has arrived for `max_age` seconds. Watches are
+re-registered when a helper restarts.
+
+Each REMOTE_AGENTS entry is {"user", "host", "sessions_dir"}; an optional
+"command" replaces the SSH invocation, e.g. a local stand-in helper:
+
+    {"host": "local", "sessions_dir": "/tmp/sessions",
+     "command": ["python3", "-u", "-c", "import sys; exec(sys.stdin.readline())"]}
+
+Must be used from the event loop.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import shlex
+import time
+
+log = logging.getLogger("token-monitor")
+
+# Reads the helper program from the first stdin line and runs it
+BOOTSTRAP = "import sys; exec(sys.stdin.readline())"
+
+SSH_OPTIONS = [
+    "-o", "ConnectTimeout=3",
+    "-o", "StrictHostKeyChecking=no",
+    "-o", "BatchMode=yes",
+    "-o", "ServerAliveInterval=15",
+    "-o", "ServerAliveCountMax=3",
+]
+
+_HELPER_PATH = os.path.join(os.path.dirname(__file__), "remote_helper.py")
+_STDERR_TAIL = 2000
+
+
+class RemoteError(Exception):
+    """A remote request failed (helper unavailable, timed out or reported an error)."""
+
+
+def helper_command(remote: dict) -> list[str]:
+    """Command that starts a helper for one REMOTE_AGENTS entry."""
+    if remote.get("command"):
+        return list(remote["command"])
+    target = f"{remote['user']}@{remote['host']}"
+    return ["ssh", *SSH_OPTIONS, target, "python3", "-u", "-c", shlex.quote(BOOTSTRAP)]
+
+
+def _bootstrap_line() -> bytes:
+    with open(_HELPER_PATH) as f:
+        source = f.read()
+    return f"exec(compile({source!r}, 'remote_helper', 'exec'))\n".encode()
+
+
+class RemoteHelper:
+    """One helper process and the requests in flight on it."""
+
+    def __init__(self, name: str, command: list[str], start_timeout: float = 10.0):
+        self.name = name
+        self.command = command
+        self.start_timeout = start_timeout
+        self._proc: asyncio.subprocess.Process | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._pending: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._start_lock = asyncio.Lock()
+        self._stderr = b""
+        # sessions_dir -> (monotonic time received, status) for the current process
+        self._latest: dict[str, tuple[float, dict]] = {}
+        self._stats = {"starts": 0, "requests": 0, "errors": 0, "last_rtt_ms": 0.0,
+                       "events": 0, "status_cached": 0}
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    async def request(self, op: str, timeout: float = 10.0, **params) -> dict:
+        """Send one request and wait for its response."""
+        await self._ensure_started()
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        self._stats["requests"] += 1
+        t0 = time.perf_counter()
+        try:
+            self._proc.stdin.write((json.dumps({"id": req_id, "op": op, **params}) + "\n").encode())
+            await self._proc.stdin.drain()
+            resp = await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self._stats["errors"] += 1
+            await self.close()
+            raise RemoteError(f"{self.name}: {op} timed out after {timeout}s")
+        except (ConnectionError, RuntimeError) as e:
+            self._stats["errors"] += 1
+            await self.close()
+            raise RemoteError(f"{self.name}: {e}")
+        finally:
+            self._pending.pop(req_id, None)
+        self._stats["last_rtt_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        if not resp.get("ok"):
+            self._stats["errors"] += 1
+            raise RemoteError(f"{self.name}: {resp.get('error')}")
+        return resp["result"]
+
+    async def status(self, sessions_dir: str, interval: float = 5.0, max_age: float = 300.0) -> dict:
+        """Session status for `sessions_dir`, from the watch when one is active."""
+        await self._ensure_started()
+        latest = self._latest.get(sessions_dir)
+        if latest is not None and time.monotonic() - latest[0] <= max_age:
+            self._stats["status_cached"] += 1
+            return latest[1]
+        op = "status" if latest is not None else "watch"
+        params = {"interval": interval} if op == "watch" else {}
+        result = await self.request(op, sessions_dir=sessions_dir, **params)
+        self._latest[sessions_dir] = (time.monotonic(), result)
+        return result
+
+    def invalidate(self, sessions_dir: str):
+        """Force the next status() for `sessions_dir` to ask the helper."""
+        latest = self._latest.get(sessions_dir)
+        if latest is not None:
+            self._latest[sessions_dir] = (float("-inf"), latest[1])
+
+    async def close(self):
+        proc, self._proc = self._proc, None
+        self._latest.clear()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._fail_pending(f"{self.name}: helper closed")
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+            try:
+                await asyncio.wait_for(proc.wait(), 5)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {**self._stats, "alive": self.alive, "in_flight": len(self._pending),
+                "watches": len(self._latest)}
+
+    async def _ensure_started(self):
+        async with self._start_lock:
+            if self.alive:
+                return
+            await self.close()
+            self._stderr = b""
+            self._stats["starts"] += 1
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *self.command,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    limit=1 << 20,
+                )
+            except OSError as e:
+                self._stats["errors"] += 1
+                raise RemoteError(f"{self.name}: failed to start helper: {e}")
+            self._proc = proc
+            self._tasks = [asyncio.create_task(self._drain_stderr(proc))]
+            try:
+                proc.stdin.write(_bootstrap_line())
+                await proc.stdin.drain()
+                line = await asyncio.wait_for(proc.stdout.readline(), self.start_timeout)
+                ready = json.loads(line) if line else {}
+            except (asyncio.TimeoutError, ConnectionError, ValueError):
+                ready = {}
+            except asyncio.CancelledError:
+                # Caller gave up mid-handshake; don't leave a half-started helper looking alive
+                self._proc = None
+                proc.kill()
+                raise
+            if not ready.get("ready"):
+                await asyncio.sleep(0.05)  # let stderr catch up for the error message
+                err = self._stderr.decode(errors="replace").strip()[-200:]
+                self._stats["errors"] += 1
+                await self.close()
+                raise RemoteError(f"{self.name}: helper did not start: {err or 'no response'}")
+            self._tasks.append(asyncio.create_task(self._read_responses(proc)))
+            log.info(f"[REMOTE] Helper connected: {self.name}")
+
+    async def _read_responses(self, proc: asyncio.subprocess.Process):
+        try:
+            while True:
+                line = await proc.stdout.readline()
+                if not line:
+                    break
+                try:
+                    resp = json.loads(line)
+                except ValueError:
+                    continue
+                if resp.get("event") == "status":
+                    self._stats["events"] += 1
+                    if "error" in resp["result"]:
+                        self._latest.pop(resp["sessions_dir"], None)  # re-ask so the error surfaces
+                    else:
+                        self._latest[resp["sessions_dir"]] = (time.monotonic(), resp["result"])
+                    continue
+                fut = self._pending.get(resp.get("id"))
+                if fut is not None and not fut.done():
+                    fut.set_result(resp)
+        finally:
+            if proc is self._proc:
+                err = self._stderr.decode(errors="replace").strip()[-200:]
+                log.warning(f"[REMOTE] Helper for {self.name} exited{': ' + err if err else ''}")
+                self._fail_pending(f"{self.name}: helper exited")
+
+    async def _drain_stderr(self, proc: asyncio.subprocess.Process):
+        while True:
+            chunk = await proc.stderr.read(4096)
+            if not chunk:
+                return
+            self._stderr = (self._stderr + chunk)[-_STDERR_TAIL:]
+
+    def _fail_pending(self, message: str):
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(RemoteError(message))
+
+
+class RemoteTransport:
+    """Helpers keyed by their start command, so agents on one host share a session."""
+
+    def __init__(self):
+        self._helpers: dict[tuple, RemoteHelper] = {}
+
+    def helper(self, remote: dict) -> RemoteHelper:
+        command = helper_command(remote)
+        key = tuple(command)
+        h = self._helpers.get(key)
+        if h is None:
+            name = f"{remote['user']}@{remote['host']}" if remote.get("user") else remote.get("host", "local")
+            h = self._helpers[key] = RemoteHelper(name, command)
+        return h
+
+    async def request(self, remote: dict, op: str, timeout: float = 10.0, **params) -> dict:
+        return await self.helper(remote).request(op, timeout=timeout, **params)
+
+    async def status(self, remote: dict, interval: float = 5.0, max_age: float = 300.0) -> dict:
+        return await self.helper(remote).status(remote["sessions_dir"], interval, max_age)
+
+    def invalidate(self, remote: dict):
+        self.helper(remote).invalidate(remote["sessions_dir"])
+
+    async def close(self):
+        await asyncio.gather(*(h.close() for h in self._helpers.values()))
+
+    def stats(self) -> dict:
+        return {h.name: h.stats() for h in self._helpers.values()}
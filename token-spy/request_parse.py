@@ -0,0 +1,154 @@
+"""Incremental parsing of proxied request bodies.
+
+The proxy endpoints forward the original request bytes untouched and only
+parse the body to read `model`, `stream`, `system`, `messages` and `tools`.
+Agents resend their whole conversation every turn, so almost all of a
+multi-hundred-KB body is a `messages` array that was already parsed on the
+previous turn.
+
+`RequestParser` walks the top-level object with the stdlib C scanner and
+decodes the `messages` array element by element, remembering each element's
+end offset. On the next request, if the array starts with the same text as
+a remembered one, the already-decoded message objects are reused and only
+the newly appended messages are decoded. Parse time and new allocations
+then scale with what changed rather than with the length of the history.
+
+The usual case, a conversation that only grew, is one in-place comparison
+of the whole remembered array. When the history was edited (compaction, a
+rewritten message), the longest matching run of elements is found by a
+binary search over element boundaries; str has no bounded compare against
+part of another string, so each probe copies the remembered prefix it
+tests (log n copies, still C-speed).
+
+The result is the same dict `json.loads` would return. Reused message
+objects are shared between requests and must not be mutated. Anything the
+walker doesn't handle (non-UTF-8, BOM, malformed JSON) falls back to
+`json.loads`, which raises exactly as before.
+
+Must be used from a single thread (the event loop).
+"""
+
+import json
+from json.decoder import WHITESPACE, scanstring
+
+_decoder = json.JSONDecoder()
+_ws = WHITESPACE.match
+
+
+class RequestParser:
+    def __init__(self, max_sessions: int = 16):
+        self.max_sessions = max(1, max_sessions)
+        # Remembered arrays: (text from "[" to the end of the last element,
+        # decoded elements, end offset of each element relative to "[")
+        self._slots: list[tuple[str, list, list[int]]] = []
+        self._stats = {"requests": 0, "fallbacks": 0, "messages_reused": 0, "messages_decoded": 0}
+
+    def parse(self, raw_body: bytes) -> dict:
+        self._stats["requests"] += 1
+        try:
+            return self._parse_object(raw_body.decode("utf-8"))
+        except (ValueError, IndexError):
+            self._stats["fallbacks"] += 1
+            return json.loads(raw_body)
+
+    def stats(self) -> dict:
+        return {**self._stats, "sessions": len(self._slots), "max_sessions": self.max_sessions}
+
+    def _parse_object(self, text: str) -> dict:
+        idx = _ws(text, 0).end()
+        if text[idx] != "{":
+            raise ValueError("not an object")
+        result = {}
+        idx = _ws(text, idx + 1).end()
+        if text[idx] == "}":
+            idx += 1
+        else:
+            while True:
+                if text[idx] != '"':
+                    raise ValueError("expected key")
+                key, idx = scanstring(text, idx + 1)
+                idx = _ws(text, idx).end()
+                if text[idx] != ":":
+                    raise ValueError("expected ':'")
+                idx = _ws(text, idx + 1).end()
+                if key == "messages" and text[idx] == "[":
+                    value, idx = self._parse_messages(text, idx)
+                else:
+                    value, idx = _decoder.raw_decode(text, idx)
+                result[key] = value
+                idx = _ws(text, idx).end()
+                if text[idx] == ",":
+                    idx = _ws(text, idx + 1).end()
+                elif text[idx] == "}":
+                    idx += 1
+                    break
+                else:
+                    raise ValueError("expected ',' or '}'")
+        if _ws(text, idx).end() != len(text):
+            raise ValueError("extra data")
+        return result
+
+    def _parse_messages(self, text: str, start: int) -> tuple[list, int]:
+        slot, reused = self._match(text, start)
+        if slot is not None:
+            items, ends = list(slot[1][:reused]), slot[2][:reused]
+        else:
+            items, ends = [], []
+
+        if items:
+            idx = _ws(text, start + ends[-1]).end()
+            if text[idx] == ",":
+                idx = _ws(text, idx + 1).end()
+            elif text[idx] != "]":
+                raise ValueError("expected ',' or ']'")
+        else:
+            idx = _ws(text, start + 1).end()
+
+        if text[idx] != "]":
+            while True:
+                item, idx = _decoder.raw_decode(text, idx)
+                items.append(item)
+                ends.append(idx - start)
+                idx = _ws(text, idx).end()
+                if text[idx] == ",":
+                    idx = _ws(text, idx + 1).end()
+                elif text[idx] == "]":
+                    break
+                else:
+                    raise ValueError("expected ',' or ']'")
+
+        self._stats["messages_reused"] += reused
+        self._stats["messages_decoded"] += len(items) - reused
+        if ends:
+            self._remember(slot, text[start:start + ends[-1]], list(items), ends)
+        return items, idx + 1
+
+    def _match(self, text: str, start: int):
+        """Find the remembered array sharing the most leading elements with text[start:]."""
+        best, best_k = None, 0
+        for slot in self._slots:
+            region, _, ends = slot
+            if not ends or len(ends) <= best_k:
+                continue
+            if text.startswith(region, start):
+                k = len(ends)
+            else:
+                # Largest k whose first k elements match byte for byte (copies each probed prefix)
+                lo, hi = 0, len(ends) - 1
+                while lo < hi:
+                    mid = (lo + hi + 1) // 2
+                    if text.startswith(region[:ends[mid - 1]], start):
+                        lo = mid
+                    else:
+                        hi = mid - 1
+                k = lo
+            if k > best_k:
+                best, best_k = slot, k
+        return best, best_k
+
+    def _remember(self, replaced, region: str, items: list, ends: list[int]):
+        if replaced is not None:
+            self._slots.remove(replaced)
+        self._slots.append((region, items, ends))
+        if len(self._slots) > self.max_sessions:
+            del self._slots[0]
@@ -0,0 +1,118 @@
+"""Retention for the SQLite usage table.
+
+Without it usage.db grows forever and every timestamp-range query slows with
+it. Each run:
+
+  1. exports raw rows older than `days` to gzip JSONL archive files, one per
+     UTC day (usage-YYYY-MM-DD.jsonl.gz, appended to as later batches for the
+     same day arrive), then deletes them in short batches;
+  2. drops minute rollups older than `days`; hour rollups are kept, so
+     summaries over old windows stay available at hourly resolution;
+  3. runs incremental vacuum in small steps to give freed pages back to the
+     filesystem (databases created before this need one full VACUUM first).
+
+Archive batches are fsynced before their rows are deleted, so a crash can
+at worst archive a batch twice, never lose it. With no archive dir, old
+rows are deleted without export.
+
+run_once() blocks; call it from a worker thread.
+"""
+
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import db
+
+log = logging.getLogger("token-monitor")
+
+
+class RetentionJob:
+    def __init__(self, days: float, archive_dir: str | None = None,
+                 batch_size: int = 5000, vacuum_pages: int = 2000):
+        self.days = days
+        self.archive_dir = archive_dir or None
+        self.batch_size = max(1, batch_size)
+        self.vacuum_pages = vacuum_pages
+        self._lock = threading.Lock()
+        self._stats = {
+            "runs": 0, "running": False, "last_run": None, "last_duration_s": None,
+            "last_error": None, "rows_eligible": 0, "rows_done": 0,
+            "rows_archived_total": 0, "rows_deleted_total": 0,
+            "minute_rollups_deleted_total": 0, "pages_vacuumed_total": 0,
+        }
+
+    def run_once(self) -> dict:
+        """Apply the policy once. Returns this run's counts."""
+        if not self._lock.acquire(blocking=False):
+            return {"skipped": "already running"}
+        started = time.monotonic()
+        self._stats.update(running=True, last_run=time.time(), rows_done=0, last_error=None)
+        counts = {"archived": 0, "deleted": 0, "minute_rollups": 0, "pages_vacuumed": 0}
+        try:
+            oldest_kept = datetime.now(timezone.utc) - timedelta(days=self.days)
+            cutoff = oldest_kept.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+            self._stats["rows_eligible"] = db.count_usage_before(cutoff)
+            while True:
+                rows = db.fetch_usage_before(cutoff, self.batch_size)
+                if not rows:
+                    break
+                if self.archive_dir:
+                    self._archive(rows)
+                    counts["archived"] += len(rows)
+                    self._stats["rows_archived_total"] += len(rows)
+                deleted = db.delete_usage_range(rows[0]["id"], rows[-1]["id"], cutoff)
+                counts["deleted"] += deleted
+                self._stats["rows_deleted_total"] += deleted
+                self._stats["rows_done"] += len(rows)
+                time.sleep(0.01)  # let proxied writes in between batches
+            counts["minute_rollups"] = db.prune_minute_rollups(cutoff)
+            self._stats["minute_rollups_deleted_total"] += counts["minute_rollups"]
+            while True:
+                vacuumed = db.incremental_vacuum(self.vacuum_pages)
+                if vacuumed is None:
+                    if counts["deleted"]:
+                        log.info("[RETENTION] Database predates incremental vacuum; run VACUUM once to shrink the file")
+                    break
+                counts["pages_vacuumed"] += vacuumed
+                self._stats["pages_vacuumed_total"] += vacuumed
+                if vacuumed < self.vacuum_pages:
+                    break
+                time.sleep(0.01)
+            if counts["deleted"] or counts["minute_rollups"]:
+                log.info(f"[RETENTION] Pruned rows before {cutoff}: {counts}")
+            return counts
+        except Exception as e:
+            self._stats["last_error"] = str(e)
+            raise
+        finally:
+            self._stats["runs"] += 1
+            self._stats["running"] = False
+            self._stats["last_duration_s"] = round(time.monotonic() - started, 3)
+            self._lock.release()
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "retention_days": self.days,
+            "archive_dir": self.archive_dir,
+        }
+
+    def _archive(self, rows: list[dict]):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        by_day: dict[str, list[dict]] = {}
+        for row in rows:
+            by_day.setdefault(row["timestamp"][:10], []).append(row)
+        for day, day_rows in by_day.items():
+            path = os.path.join(self.archive_dir, f"usage-{day}.jsonl.gz")
+            with open(path, "ab") as raw:
+                # Each append is its own gzip member; readers see one stream
+                with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+                    for row in day_rows:
+                        gz.write((json.dumps(row, separators=(",", ":")) + "\n").encode())
+                raw.flush()
+                os.fsync(raw.fileno())
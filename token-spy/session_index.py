@@ -0,0 +1,195 @@
+"""Incremental index of local agent session files (OpenClaw JSONL).
+
+Session status for local agents used to re-read and re-parse the newest
+session file on every call. The index remembers, per file, the byte offset
+of the last complete line it parsed plus running counters, so each call only
+reads bytes appended since the previous one. A file whose inode changed,
+that shrank, or whose first bytes or bytes just before the remembered offset
+differ (rewritten in place) is treated as new and rescanned.
+
+A trailing line without its newline yet is parsed on every call but never
+committed, so results match a full re-read of the file at that moment.
+
+check_tail and read_lines implement that resumable scan and are shared with
+turn_index.py.
+
+Thread-safe; callers on the event loop should use asyncio.to_thread.
+"""
+
+import glob
+import json
+import os
+import threading
+
+_READ_CHUNK = 1 << 20
+_HEAD_BYTES = 64
+_ANCHOR_BYTES = 64
+
+
+def parse_session_line(line: str) -> tuple[int, int, int, int] | None:
+    """Counters contributed by one JSONL line: (user, assistant, tool_results, content_chars)."""
+    try:
+        d = json.loads(line)
+        if d.get("type") != "message":
+            return None
+        msg = d.get("message", {})
+        if isinstance(msg, str):
+            msg = json.loads(msg)
+        role = msg.get("role", "")
+        tool = 1 if role in ("toolResult", "tool") or msg.get("tool_call_id") else 0
+        c = msg.get("content", "")
+        if isinstance(c, list):
+            chars = sum(len(str(x)) for x in c)
+        elif isinstance(c, str):
+            chars = len(c)
+        else:
+            chars = 0
+        return (1 if role == "user" else 0, 1 if role == "assistant" else 0, tool, chars)
+    except Exception:
+        return None
+
+
+def check_tail(f, st: os.stat_result, recorded: tuple | None) -> tuple[bytes, bool]:
+    """Whether open file `f` still continues a scan recorded as (inode, offset, head, anchor).
+
+    Returns (the file's first bytes, ok). Not ok when nothing was recorded,
+    the inode changed, the file shrank below `offset`, or its first bytes
+    or the bytes just before `offset` differ (rewritten in place).
+    """
+    head = f.read(_HEAD_BYTES)
+    if recorded is None:
+        return head, False
+    inode, offset, old_head, anchor = recorded
+    if inode != st.st_ino or st.st_size < offset or head[:len(old_head)] != old_head:
+        return head, False
+    f.seek(offset - len(anchor))
+    return head, f.read(len(anchor)) == anchor
+
+
+def read_lines(f, offset: int, anchor: bytes, on_lines) -> tuple[int, bytes, bytes, int]:
+    """Pass complete lines from `offset` on to `on_lines(list[str])`, a chunk at a time.
+
+    Returns (offset after the last complete line, the anchor bytes just
+    before it, the unterminated tail, bytes read).
+    """
+    f.seek(offset)
+    pending = b""
+    read = 0
+    while True:
+        chunk = f.read(_READ_CHUNK)
+        if not chunk:
+            return offset, anchor, pending, read
+        read += len(chunk)
+        data = pending + chunk if pending else chunk
+        nl = data.rfind(b"\n")
+        if nl < 0:
+            pending = data
+            continue
+        on_lines(data[:nl].decode("utf-8", "replace").split("\n"))
+        offset += nl + 1
+        anchor = data[max(0, nl + 1 - _ANCHOR_BYTES):nl + 1]
+        pending = data[nl + 1:]
+
+
+class _FileState:
+    __slots__ = ("inode", "head", "anchor", "offset", "lines", "counts", "key", "result")
+
+    def __init__(self, inode: int, head: bytes):
+        self.inode = inode
+        self.head = head
+        self.anchor = b""        # last bytes before offset
+        self.offset = 0          # end of the last complete line parsed
+        self.lines = 0           # complete lines parsed
+        self.counts = [0, 0, 0, 0]
+        self.key = None          # (size, mtime_ns) the cached result was built from
+        self.result = None
+
+
+class SessionIndex:
+    def __init__(self):
+        self._files: dict[str, _FileState] = {}
+        self._lock = threading.Lock()
+        self._stats = {"scans": 0, "cached": 0, "bytes_read": 0, "rescans": 0}
+
+    def latest(self, sessions_dir: str) -> dict | None:
+        """Counters for the most recently modified *.jsonl file in `sessions_dir`.
+
+        Returns None if there are no session files or the newest can't be read.
+        """
+        files = glob.glob(os.path.join(sessions_dir, "*.jsonl"))
+        mtimes = {}
+        for path in files:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                pass
+        if not mtimes:
+            return None
+        newest = max(mtimes, key=mtimes.get)
+        result = self.scan(newest)
+        with self._lock:
+            # Forget files that are gone from this directory
+            for path in [p for p in self._files if os.path.dirname(p) == sessions_dir and p not in mtimes]:
+                del self._files[path]
+        if result is None:
+            return None
+        return {**result, "session_files": len(files)}
+
+    def scan(self, path: str) -> dict | None:
+        """Bring one file's counters up to date, reading only appended bytes."""
+        with self._lock:
+            try:
+                with open(path, "rb") as f:
+                    st = os.fstat(f.fileno())
+                    key = (st.st_size, st.st_mtime_ns)
+                    state = self._files.get(path)
+                    if state is not None and state.inode == st.st_ino and state.key == key:
+                        self._stats["cached"] += 1
+                        return state.result
+                    recorded = (state.inode, state.offset, state.head, state.anchor) if state else None
+                    head, ok = check_tail(f, st, recorded)
+                    if not ok:
+                        if state is not None:
+                            self._stats["rescans"] += 1
+                        state = _FileState(st.st_ino, head)
+                        self._files[path] = state
+                    elif len(state.head) < _HEAD_BYTES:
+                        state.head = head
+                    tail = self._consume(f, state)
+            except OSError:
+                return None
+
+            self._stats["scans"] += 1
+            counts = list(state.counts)
+            lines = state.lines
+            if tail:
+                lines += 1
+                extra = parse_session_line(tail.decode("utf-8", "replace"))
+                if extra:
+                    counts = [a + b for a, b in zip(counts, extra)]
+            state.key = key
+            state.result = {
+                "user_turns": counts[0],
+                "assistant_turns": counts[1],
+                "tool_results": counts[2],
+                "history_chars": counts[3],
+                "total_lines": lines,
+                "file_bytes": st.st_size,
+            }
+            return state.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "files": len(self._files)}
+
+    def _consume(self, f, state: _FileState) -> bytes:
+        """Parse complete lines from state.offset on; return the unterminated tail."""
+        def on_lines(lines: list[str]):
+            counts = [c for c in map(parse_session_line, lines) if c]
+            state.lines += len(lines)
+            if counts:
+                state.counts = [a + sum(col) for a, col in zip(state.counts, zip(*counts))]
+
+        state.offset, state.anchor, tail, read = read_lines(f, state.offset, state.anchor, on_lines)
+        self._stats["bytes_read"] += read
+        return tail
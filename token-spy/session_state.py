@@ -0,0 +1,153 @@
+"""Incremental per-agent session state for /api/session-status.
+
+Instead of re-reading every turn from the last 24 hours and searching for the
+last session reset on each request, both DB backends keep one small state row
+per agent and advance it as usage rows are written. Reading session status is
+then a single primary-key lookup.
+
+As before, only turns from the last 24 hours count. Turns since the last
+reset are kept as per-hour (turns, cost) buckets, and a bucket is dropped
+once all of its turns are older than the window, so an agent that never
+resets does not accumulate cost across days; a turn can keep counting for
+up to an hour past 24h. The state stays bounded whatever the turn rate.
+
+State dict layout (persisted by the backend):
+    session_start_id    id of the first usage row in the current session
+    session_turns       turns since the last reset, within the window
+    session_cost        USD of those turns
+    last_history_chars  conversation_history_chars of the latest turn
+    recent              {"last": last RECENT_TURNS turns as [at, cost, cache_read, cache_write],
+                         "hours": [[epoch hour, turns, cost], ...] oldest first}
+    last_turn_at        epoch seconds of the latest turn
+"""
+
+# A turn starts a new session when history drops by more than half
+# from a previous turn that was over RESET_MIN_PREV_CHARS.
+RESET_MIN_PREV_CHARS = 1000
+RESET_DROP_RATIO = 0.5
+
+# Turns older than this are not considered part of the current session.
+SESSION_WINDOW_SECONDS = 24 * 3600
+
+RECENT_TURNS = 5
+
+
+def is_current(state: dict | None) -> bool:
+    """False for a missing state or one stored in an older layout; rebuild those from raw rows."""
+    return state is not None and isinstance(state.get("recent"), dict)
+
+
+def _in_window(state: dict | None, now: float) -> dict | None:
+    """A copy of `state` without turns older than the window (None if none are left)."""
+    if not is_current(state):
+        return None
+    cutoff = now - SESSION_WINDOW_SECONDS
+    if state["last_turn_at"] <= cutoff:
+        return None
+    hours = [b for b in state["recent"]["hours"] if (b[0] + 1) * 3600 > cutoff]
+    state = dict(state)
+    state["recent"] = {"last": [t for t in state["recent"]["last"] if t[0] > cutoff], "hours": hours}
+    state["session_turns"] = sum(b[1] for b in hours)
+    state["session_cost"] = sum(b[2] for b in hours)
+    return state
+
+
+def advance(state: dict | None, row_id, entry: dict, now: float) -> dict:
+    """Return the state after applying one usage row (does not mutate `state`).
+
+    The turn is timed by the entry's `timestamp` (a datetime) if it has one,
+    else by `now`.
+    """
+    history = entry.get("conversation_history_chars") or 0
+    cost = float(entry.get("estimated_cost_usd") or 0)
+    cache_read = entry.get("cache_read_tokens") or 0
+    cache_write = entry.get("cache_write_tokens") or 0
+    if entry.get("timestamp"):
+        now = entry["timestamp"].timestamp()
+
+    state = _in_window(state, now)
+    is_reset = state is None
+    if not is_reset:
+        prev = state["last_history_chars"]
+        is_reset = prev > RESET_MIN_PREV_CHARS and history < prev * RESET_DROP_RATIO
+
+    if is_reset:
+        state = {"session_start_id": row_id, "session_turns": 0, "session_cost": 0.0,
+                 "recent": {"last": [], "hours": []}}
+
+    state["session_turns"] += 1
+    state["session_cost"] += cost
+    state["last_history_chars"] = history
+    recent = state["recent"]
+    recent["last"] = (recent["last"] + [[now, cost, cache_read, cache_write]])[-RECENT_TURNS:]
+    hour = int(now // 3600)
+    hours = recent["hours"]
+    for i, (h, turns, hour_cost) in enumerate(hours):
+        if h == hour:
+            hours[i] = [h, turns + 1, hour_cost + cost]
+            break
+    else:
+        hours.append([hour, 1, cost])
+        hours.sort(key=lambda b: b[0])
+    state["last_turn_at"] = now
+    return state
+
+
+def rebuild(rows: list[dict]) -> dict | None:
+    """Build state from chronological rows (id, usage columns, `ts` epoch seconds).
+
+    Seeds state for an agent that has none yet (or one in an older layout).
+    """
+    state = None
+    for r in rows:
+        state = advance(state, r["id"], r, r["ts"])
+    return state
+
+
+def to_status(agent: str, state: dict | None, char_limit: int, now: float) -> dict:
+    """Render state as the /api/session-status payload."""
+    state = _in_window(state, now)
+    if state is None:
+        return {
+            "agent": agent,
+            "current_session_turns": 0,
+            "current_history_chars": 0,
+            "last_turn_cost": 0,
+            "avg_cost_last_5": 0,
+            "cache_write_pct_last_5": 0,
+            "cost_since_last_reset": 0,
+            "turns_since_last_reset": 0,
+            "recommendation": "no_data",
+        }
+
+    recent = state["recent"]["last"]
+    current_history = state["last_history_chars"]
+    last_cost = recent[-1][1]
+    avg_cost_5 = sum(r[1] for r in recent) / len(recent)
+    total_cache_5 = sum(r[2] + r[3] for r in recent)
+    total_write_5 = sum(r[3] for r in recent)
+    cache_write_pct = total_write_5 / max(total_cache_5, 1)
+
+    # Recommendation logic (thresholds scale with configurable char_limit)
+    if current_history > char_limit * 2.5:
+        rec = "reset_recommended"
+    elif current_history > char_limit * 2:
+        rec = "compact_soon"
+    elif current_history > char_limit:
+        rec = "monitor"
+    elif cache_write_pct > 0.20 and len(recent) >= 3:
+        rec = "cache_unstable"
+    else:
+        rec = "healthy"
+
+    return {
+        "agent": agent,
+        "current_session_turns": state["session_turns"],
+        "current_history_chars": current_history,
+        "last_turn_cost": round(last_cost, 6),
+        "avg_cost_last_5": round(avg_cost_5, 6),
+        "cache_write_pct_last_5": round(cache_write_pct, 4),
+        "cost_since_last_reset": round(state["session_cost"], 6),
+        "turns_since_last_reset": state["session_turns"],
+        "recommendation": rec,
+    }
@@ -0,0 +1,87 @@
+"""In-memory cache of the settings file.
+
+Settings are read on every proxied turn (auto-reset limit), every poll and
+every dashboard refresh; each read used to open and parse settings.json. The
+store keeps the parsed file in memory and re-checks the file's identity
+(inode, size, mtime) at most once every `check_interval` seconds, reloading
+only when it changed, so other instances sharing the file converge within
+that interval and lookups in between are plain dictionary reads.
+
+Saves write a temp file in the same directory and rename it over the
+original, so readers never see a partially written file.
+
+Thread-safe.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class SettingsStore:
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._data: dict = {}
+        self._key = None          # (inode, size, mtime_ns) of the loaded file
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+        self._stats = {"reads": 0, "reloads": 0, "saves": 0}
+
+    def get(self) -> dict:
+        """The parsed settings file ({} if missing or invalid). Do not mutate."""
+        self._stats["reads"] += 1
+        if time.monotonic() - self._checked >= self.check_interval:
+            with self._lock:
+                self._refresh()
+        return self._data
+
+    def save(self, data: dict):
+        """Atomically replace the settings file and the cached copy."""
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".settings-", suffix=".tmp")
+            try:
+                os.chmod(tmp, 0o644)
+                with os.fdopen(fd, "w") as f:
+                    json.dump(data, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+            self._data = json.loads(json.dumps(data))
+            self._key = self._stat_key()
+            self._checked = time.monotonic()
+            self._stats["saves"] += 1
+
+    def stats(self) -> dict:
+        return {**self._stats, "check_interval_s": self.check_interval}
+
+    def _stat_key(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _refresh(self):
+        self._checked = time.monotonic()
+        key = self._stat_key()
+        if key == self._key:
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            data = {}
+        self._data = data if isinstance(data, dict) else {}
+        self._key = key
+        self._stats["reloads"] += 1
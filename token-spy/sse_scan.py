@@ -0,0 +1,146 @@
+"""Incremental SSE usage scanners for the streaming proxy handlers.
+
+The streaming handlers forward upstream bytes untouched and feed each chunk
+to a scanner. A scanner only splits a chunk into lines when it might contain
+an event that carries usage, and only `json.loads` those lines — content
+deltas (the vast majority of a long generation) are never decoded.
+
+Scanners expose:
+    usage     dict with input/output/cache token counts and stop_reason
+    complete  True once the end-of-stream event has been seen
+"""
+
+import json
+import re
+
+
+class _SSEScanner:
+    def __init__(self):
+        self._tail = b""
+        self.complete = False
+        self.usage = {
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_read_tokens": 0,
+            "cache_write_tokens": 0,
+            "stop_reason": None,
+        }
+
+    def feed(self, chunk: bytes):
+        data = self._tail + chunk if self._tail else chunk
+        nl = data.rfind(b"\n")
+        if nl < 0:
+            self._tail = data
+            return
+        self._tail = data[nl + 1:]
+        if not self._pending() and not self._interesting(data, nl):
+            return
+        for line in data[:nl].split(b"\n"):
+            self._line(line.rstrip(b"\r"))
+
+    def _interesting(self, data: bytes, end: int) -> bool:
+        """Whether data[:end] may contain a usage-carrying event (false positives are fine)."""
+        raise NotImplementedError
+
+    def _pending(self) -> bool:
+        return False
+
+    def _line(self, line: bytes):
+        raise NotImplementedError
+
+
+class AnthropicStreamScanner(_SSEScanner):
+    """Anthropic Messages API: usage arrives in message_start and message_delta."""
+
+    _EVENT = re.compile(rb"event:\s*message_")
+
+    def __init__(self):
+        super().__init__()
+        self._event = None
+
+    def _interesting(self, data: bytes, end: int) -> bool:
+        return self._EVENT.search(data, 0, end) is not None
+
+    def _pending(self) -> bool:
+        # An interesting event line was seen but its data line hasn't arrived yet
+        return self._event is not None
+
+    def _line(self, line: bytes):
+        if line.startswith(b"event:"):
+            event = line[6:].strip()
+            if event == b"message_stop":
+                self.complete = True
+                self._event = None
+            elif event in (b"message_start", b"message_delta"):
+                self._event = event
+            else:
+                self._event = None
+        elif self._event is not None and line.startswith(b"data:"):
+            event, self._event = self._event, None
+            try:
+                data = json.loads(line[5:])
+            except ValueError:
+                return
+            if event == b"message_start":
+                msg_usage = data.get("message", {}).get("usage", {})
+                self.usage["input_tokens"] = msg_usage.get("input_tokens", 0)
+                self.usage["cache_read_tokens"] = msg_usage.get("cache_read_input_tokens", 0)
+                self.usage["cache_write_tokens"] = msg_usage.get("cache_creation_input_tokens", 0)
+            else:
+                delta_usage = data.get("usage", {})
+                if delta_usage.get("output_tokens") is not None:
+                    self.usage["output_tokens"] = delta_usage["output_tokens"]
+                stop = data.get("delta", {}).get("stop_reason")
+                if stop:
+                    self.usage["stop_reason"] = stop
+
+
+class OpenAIStreamScanner(_SSEScanner):
+    """OpenAI Chat Completions: usage in the final chunk, finish_reason in the last
+    content chunk, then `data: [DONE]`."""
+
+    def _interesting(self, data: bytes, end: int) -> bool:
+        # Every content chunk has "finish_reason": null (and often "usage": null),
+        # so look at the value, not just the key. Plain finds beat a regex here.
+        return (
+            data.find(b"[DONE]", 0, end) >= 0
+            or _has_value(data, b'"usage"', end, b"{")
+            or _has_value(data, b'"finish_reason"', end, b'"')
+        )
+
+    def _line(self, line: bytes):
+        if not line.startswith(b"data:") or not self._interesting(line, len(line)):
+            return
+        data_str = line[5:].strip()
+        if data_str == b"[DONE]":
+            self.complete = True
+            return
+        try:
+            data = json.loads(data_str)
+        except ValueError:
+            return
+
+        chunk_usage = data.get("usage")
+        if chunk_usage:
+            self.usage["input_tokens"] = chunk_usage.get("prompt_tokens", 0)
+            self.usage["output_tokens"] = chunk_usage.get("completion_tokens", 0)
+            self.usage["cache_read_tokens"] = (chunk_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+
+        choices = data.get("choices", [])
+        if choices:
+            finish = choices[0].get("finish_reason")
+            if finish:
+                self.usage["stop_reason"] = finish
+
+
+def _has_value(data: bytes, key: bytes, end: int, openers: bytes) -> bool:
+    """True if `key` occurs in data[:end] followed by a value starting with one of `openers`."""
+    i = data.find(key, 0, end)
+    while i >= 0:
+        j = i + len(key)
+        while j < end and data[j] in b" \t:":
+            j += 1
+        if j < end and data[j] in openers:
+            return True
+        i = data.find(key, j, end)
+    return False
@@ -0,0 +1,112 @@
+"""Storage interface between main.py and the usage backends.
+
+The backends (db for SQLite, db_postgres, db_postgres_async) are modules of
+plain functions with the same names. Storage is the interface the server
+talks to instead; BackendStorage adapts one of those modules to it, and
+other implementations (see hot_store.py) can wrap a BackendStorage.
+
+Reads are coroutines: async backends are awaited on the event loop, sync
+ones run in a worker thread. write_batch() blocks and is meant for the
+usage writer thread; called on the event loop with an async backend, it
+schedules the write instead of blocking.
+"""
+
+import asyncio
+import inspect
+import logging
+
+log = logging.getLogger("token-monitor")
+
+
+class Storage:
+    """What the server needs from a usage store."""
+
+    async def init(self):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def write_batch(self, entries: list[dict]):
+        raise NotImplementedError
+
+    async def query_usage(self, agent: str | None = None, hours: int = 24, limit: int = 200) -> list[dict]:
+        raise NotImplementedError
+
+    async def query_summary(self, hours: int = 24) -> list[dict]:
+        raise NotImplementedError
+
+    async def query_session_status(self, agent: str, char_limit: int = 200_000) -> dict:
+        raise NotImplementedError
+
+    async def query_recent_events(self, limit: int = 100, after_id=None) -> list[dict]:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class BackendStorage(Storage):
+    """One of the db modules, selected by DB_BACKEND name."""
+
+    def __init__(self, backend: str):
+        if backend == "postgres":
+            import db_postgres as module
+        elif backend == "postgres-async":
+            import db_postgres_async as module
+        else:
+            import db as module
+        self.backend = backend
+        self._db = module
+        self._async = inspect.iscoroutinefunction(module.log_usage_batch)
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def init(self):
+        self._loop = asyncio.get_running_loop()
+        await self._call(self._db.init_db)
+
+    async def close(self):
+        close_db = getattr(self._db, "close_db", None)
+        if close_db is not None:
+            await self._call(close_db)
+
+    def write_batch(self, entries: list[dict]):
+        if not self._async:
+            return self._db.log_usage_batch(entries)
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            # Direct write from a handler (writer down or queue full): don't block the loop on it
+            task = asyncio.ensure_future(self._db.log_usage_batch(entries))
+            task.add_done_callback(_report_write_failure)
+            return
+        if self._loop is None:
+            raise RuntimeError("storage not initialized")
+        return asyncio.run_coroutine_threadsafe(self._db.log_usage_batch(entries), self._loop).result(30)
+
+    async def query_usage(self, agent: str | None = None, hours: int = 24, limit: int = 200) -> list[dict]:
+        return await self._call(self._db.query_usage, agent=agent, hours=hours, limit=limit)
+
+    async def query_summary(self, hours: int = 24) -> list[dict]:
+        return await self._call(self._db.query_summary, hours=hours)
+
+    async def query_session_status(self, agent: str, char_limit: int = 200_000) -> dict:
+        return await self._call(self._db.query_session_status, agent, char_limit=char_limit)
+
+    async def query_recent_events(self, limit: int = 100, after_id=None) -> list[dict]:
+        return await self._call(self._db.query_recent_events, limit=limit, after_id=after_id)
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "async": self._async}
+
+    async def _call(self, fn, *args, **kwargs):
+        if self._async:
+            return await fn(*args, **kwargs)
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+def _report_write_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        log.error(f"Failed to log usage: {task.exception()}")
@@ -0,0 +1,164 @@
+"""Persistent lifetime turn counts for local agents' session files.
+
+/api/summary reports lifetime turns for agents that only have session files
+(no proxied traffic). The old implementation re-read every *.jsonl file in an
+agent's session directory on every call and kept a JSON accumulator that
+guessed at purges from shrinking totals.
+
+This index keeps one SQLite row per session file: inode, size, mtime, the
+offset of the last complete line counted and the file's user/assistant turn
+counts.
+`refresh` reads only bytes appended since the last refresh. When a file is
+deleted (session purge) or replaced, its turns move into a per-agent retired
+total, so the lifetime count survives cleanup exactly instead of by heuristic.
+`total_turns` answers from the index alone without touching session files.
+
+A file's turns are its user turns, or its assistant turns for gateways that
+don't log user messages. Thread-safe.
+"""
+
+import glob
+import os
+import sqlite3
+import threading
+
+from session_index import check_tail, parse_session_line, read_lines
+
+
+def _file_turns(user_turns: int, assistant_turns: int) -> int:
+    return user_turns if user_turns > 0 else assistant_turns
+
+
+class TurnIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS session_files (
+                    agent TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    inode INTEGER NOT NULL,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    mtime_ns INTEGER NOT NULL DEFAULT 0,
+                    offset INTEGER NOT NULL DEFAULT 0,
+                    head BLOB NOT NULL DEFAULT x'',
+                    anchor BLOB NOT NULL DEFAULT x'',
+                    user_turns INTEGER NOT NULL DEFAULT 0,
+                    assistant_turns INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (agent, path)
+                );
+
+                -- Turns from session files that have since been purged or replaced
+                CREATE TABLE IF NOT EXISTS retired_turns (
+                    agent TEXT PRIMARY KEY,
+                    turns INTEGER NOT NULL DEFAULT 0
+                );
+            """)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def total_turns(self, agent: str) -> int | None:
+        """Lifetime turns for `agent`, or None if it has never been indexed."""
+        with self._lock:
+            conn = self._get_conn()
+            retired = conn.execute(
+                "SELECT turns FROM retired_turns WHERE agent = ?", (agent,)
+            ).fetchone()
+            files = conn.execute(
+                "SELECT user_turns, assistant_turns FROM session_files WHERE agent = ?", (agent,)
+            ).fetchall()
+        if retired is None and not files:
+            return None
+        return (retired[0] if retired else 0) + sum(_file_turns(u, a) for u, a in files)
+
+    def retire(self, agent: str, turns: int):
+        """Add turns that are no longer on disk to the agent's lifetime total."""
+        with self._lock:
+            conn = self._get_conn()
+            self._retire(conn, agent, turns)
+            conn.commit()
+
+    def refresh(self, agent: str, sessions_dir: str):
+        """Bring the agent's rows up to date with the session files on disk."""
+        with self._lock:
+            conn = self._get_conn()
+            rows = {
+                r[0]: r[1:]
+                for r in conn.execute(
+                    "SELECT path, inode, size, mtime_ns, offset, head, anchor, user_turns, assistant_turns "
+                    "FROM session_files WHERE agent = ?",
+                    (agent,),
+                )
+            }
+            retired = 0
+            for path in glob.glob(os.path.join(sessions_dir, "*.jsonl")):
+                row = rows.pop(path, None)
+                try:
+                    updated, lost = self._scan(path, row)
+                except OSError:
+                    continue  # vanished or unreadable; keep its row until the next refresh
+                retired += lost
+                if updated is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO session_files "
+                        "(agent, path, inode, size, mtime_ns, offset, head, anchor, user_turns, assistant_turns) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (agent, path, *updated),
+                    )
+            # Files that are gone: keep their turns in the lifetime total
+            for path, row in rows.items():
+                retired += _file_turns(row[6], row[7])
+                conn.execute("DELETE FROM session_files WHERE agent = ? AND path = ?", (agent, path))
+            self._retire(conn, agent, retired)
+            conn.commit()
+
+    @staticmethod
+    def _retire(conn: sqlite3.Connection, agent: str, turns: int):
+        conn.execute(
+            "INSERT INTO retired_turns (agent, turns) VALUES (?, ?) "
+            "ON CONFLICT(agent) DO UPDATE SET turns = turns + excluded.turns",
+            (agent, turns),
+        )
+
+    @staticmethod
+    def _scan(path: str, row: tuple | None) -> tuple[tuple | None, int]:
+        """Count turns appended to `path` since `row` was recorded.
+
+        Returns (new row values or None if unchanged, turns retired because
+        the file was replaced or rewritten).
+        """
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if row is not None and row[:3] == (st.st_ino, st.st_size, st.st_mtime_ns):
+                return None, 0
+            recorded = None
+            if row is not None:
+                inode, _, _, offset, old_head, anchor, user_turns, assistant_turns = row
+                recorded = (inode, offset, old_head, anchor)
+            head, ok = check_tail(f, st, recorded)
+            lost = 0
+            if not ok:
+                if row is not None:
+                    lost = _file_turns(user_turns, assistant_turns)
+                offset, anchor, user_turns, assistant_turns = 0, b"", 0, 0
+
+            turns = [user_turns, assistant_turns]
+
+            def on_lines(lines: list[str]):
+                for counts in map(parse_session_line, lines):
+                    if counts:
+                        turns[0] += counts[0]
+                        turns[1] += counts[1]
+
+            offset, anchor, _, _ = read_lines(f, offset, anchor, on_lines)
+
+        return (st.st_ino, st.st_size, st.st_mtime_ns, offset, head, anchor, *turns), lost
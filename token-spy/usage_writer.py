@@ -0,0 +1,246 @@
+"""Background usage writer — moves DB inserts off the asyncio event loop.
+
+`_log_entry` enqueues finished turns here instead of calling `log_usage`
+directly. A dedicated thread drains the queue and writes rows in batches,
+flushing when either `batch_size` rows are pending or `flush_interval`
+seconds have passed since the first pending row arrived.
+
+When the queue is full the entry is handed to a single overflow thread
+that writes it on its own, so a burst does not block the event loop. The
+overflow backlog is capped at `max_overflow` rows; past that a stalled
+database costs rows (counted as dropped_rows) rather than memory.
+
+A failed batch write is retried with exponential backoff (backends write a
+batch in one transaction). If it still fails after `max_retries` retries
+the rows are written one at a time, so a single bad row is the only one
+dropped and counted as failed_rows.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+log = logging.getLogger("token-monitor")
+
+# How often an idle writer thread checks for stop()
+_IDLE_POLL = 0.25
+_MAX_RETRY_DELAY = 30.0
+
+
+class UsageWriter:
+    """Bounded queue + single writer thread doing batched inserts."""
+
+    def __init__(
+        self,
+        write_batch: Callable[[list[dict]], None],
+        batch_size: int = 50,
+        flush_interval: float = 0.5,
+        max_queue: int = 10_000,
+        on_flush: Callable[[float, int], None] | None = None,
+        max_retries: int = 5,
+        retry_delay: float = 0.5,
+        max_overflow: int = 1000,
+    ):
+        self._write_batch = write_batch
+        # Called with (seconds, rows) after each successful batch write
+        self._on_flush = on_flush
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.01, flush_interval)
+        self.max_queue = max(1, max_queue)
+        self.max_retries = max(0, max_retries)
+        self.retry_delay = retry_delay
+        self.max_overflow = max(0, max_overflow)
+        self._queue: queue.Queue = queue.Queue(maxsize=self.max_queue)
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._overflow: ThreadPoolExecutor | None = None
+        # Rows handed to the overflow thread and not yet written
+        self._overflow_pending = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "failed_rows": 0,
+            "retries": 0,
+            "overflow_writes": 0,
+            "dropped_rows": 0,
+            "max_queue_depth": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    # ── Producer side (event loop) ───────────────────────────────────────────
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="usage-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, entry: dict):
+        """Queue a usage row. Never blocks; drops the row if the overflow backlog is full too."""
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            # Back-pressure: write this row on the overflow thread, off the caller
+            with self._lock:
+                if self._overflow_pending >= self.max_overflow:
+                    self._stats["dropped_rows"] += 1
+                    dropped = self._stats["dropped_rows"]
+                    overflow = None
+                else:
+                    self._stats["overflow_writes"] += 1
+                    self._overflow_pending += 1
+                    if self._overflow is None:
+                        self._overflow = ThreadPoolExecutor(max_workers=1, thread_name_prefix="usage-overflow")
+                    overflow = self._overflow
+            if overflow is None:
+                # Log the first drop and then every 1000th, not every row of a stall
+                if dropped % 1000 == 1:
+                    log.error(f"[WRITER] Queue and overflow backlog full, dropped {dropped} usage rows so far")
+                return
+            overflow.submit(self._flush_overflow, entry)
+            return
+        with self._lock:
+            self._stats["enqueued"] += 1
+            depth = self._queue.qsize()
+            if depth > self._stats["max_queue_depth"]:
+                self._stats["max_queue_depth"] = depth
+
+    def stop(self, timeout: float = 10.0):
+        """Flush everything still queued and stop the writer thread."""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            log.warning(f"[WRITER] Shutdown timed out with {self._queue.qsize()} rows queued")
+        with self._lock:
+            overflow, self._overflow = self._overflow, None
+        if overflow is not None:
+            overflow.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+        out["queue_depth"] = self._queue.qsize()
+        out["queue_capacity"] = self.max_queue
+        out["overflow_pending"] = self._overflow_pending
+        out["running"] = self.running
+        return out
+
+    # ── Consumer side (writer thread) ────────────────────────────────────────
+
+    def _run(self):
+        batch: list[dict] = []
+        deadline = None
+        while True:
+            timeout = _IDLE_POLL if deadline is None else max(0.0, min(deadline - time.monotonic(), _IDLE_POLL))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if self._stop.is_set():
+                if item is not None:
+                    batch.append(item)
+                self._drain_into(batch)
+                self._flush(batch)
+                return
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                # Grab whatever else is already waiting without blocking
+                self._drain_into(batch, self.batch_size)
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+    def _drain_into(self, batch: list, limit: int | None = None):
+        while limit is None or len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _flush_overflow(self, entry: dict):
+        try:
+            self._flush([entry])
+        finally:
+            with self._lock:
+                self._overflow_pending -= 1
+
+    def _flush(self, batch: list[dict]):
+        """Write a batch, retrying failures with backoff (writer or overflow thread)."""
+        if not batch:
+            return
+        attempt = 0
+        while True:
+            t0 = time.perf_counter()
+            try:
+                self._write_batch(batch)
+                break
+            except Exception as e:
+                if attempt >= self.max_retries and len(batch) > 1:
+                    log.warning(
+                        f"[WRITER] Batch of {len(batch)} usage rows failed {attempt + 1} times, "
+                        f"writing rows one at a time: {e}"
+                    )
+                    self._flush_rows(batch)
+                    return
+                if attempt >= self.max_retries:
+                    log.error(f"[WRITER] Dropping usage row after {attempt + 1} attempts: {e}")
+                    with self._lock:
+                        self._stats["failed_rows"] += len(batch)
+                    return
+                delay = min(self.retry_delay * 2 ** attempt, _MAX_RETRY_DELAY)
+                log.warning(f"[WRITER] Failed to write {len(batch)} usage rows, retrying in {delay:.1f}s: {e}")
+                with self._lock:
+                    self._stats["retries"] += 1
+                attempt += 1
+                # Shutting down: retry without waiting out the backoff
+                self._stop.wait(delay)
+        elapsed = time.perf_counter() - t0
+        elapsed_ms = elapsed * 1000
+        if self._on_flush is not None:
+            self._on_flush(elapsed, len(batch))
+        with self._lock:
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["last_batch_size"] = len(batch)
+            self._stats["last_flush_ms"] = round(elapsed_ms, 2)
+
+    def _flush_rows(self, batch: list[dict]):
+        """Write a batch that keeps failing row by row, dropping only the rows that fail."""
+        written = 0
+        t0 = time.perf_counter()
+        for entry in batch:
+            try:
+                self._write_batch([entry])
+                written += 1
+            except Exception as e:
+                log.error(f"[WRITER] Dropping usage row for {entry.get('agent')}/{entry.get('model')}: {e}")
+                with self._lock:
+                    self._stats["failed_rows"] += 1
+        if not written:
+            return
+        elapsed = time.perf_counter() - t0
+        if self._on_flush is not None:
+            self._on_flush(elapsed, written)
+        with self._lock:
+            self._stats["written"] += written
+            self._stats["batches"] += 1
+            self._stats["last_batch_size"] = written
+            self._stats["last_flush_ms"] = round(elapsed * 1000, 2)